@@ -0,0 +1,121 @@
+# benchmarks/bench_chunking.py - 比較舊的分塊方式與生成器分塊（utils.vectordb.chunking）在多 MB 文件上的耗時
+#
+# - 英文、中文與中英混合的合成文件，每種分別測試多個大小
+# - 舊方式：每塊複製並反轉視窗後以正規表示式搜尋句點（只認得英文 .!?）
+# - 新方式：單次掃描段落與中英文句子邊界的生成器；另外測試以估算 token 數切分
+# - 同時統計塊在段落或句子邊界結束的比例
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_chunking --sizes-mb 1 4 16 --chunk-size 1000 --chunk-overlap 200
+import argparse
+import random
+import re
+from typing import List
+
+from benchmarks.common import random_text, measure, print_report
+from utils.vectordb.chunking import iter_chunks
+
+CJK_SENTENCES = [
+    "向量資料庫會把文件切成多個區塊後再建立索引", "檢索時先找出最相近的區塊", "模型根據檢索到的內容回答問題",
+    "分塊大小會影響檢索的準確度", "重疊的區塊可以保留上下文", "中文句子通常以句號結尾",
+]
+CJK_TERMINATORS = "。。。！？"
+
+
+def legacy_split(text: str, chunk_size: int, chunk_overlap: int) -> List[str]:
+    """修改前的 ChromaDBConnecter._split_text_into_chunks（僅供比較）"""
+    if len(text) <= chunk_size:
+        return [text]
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunk = text[start:end]
+        if end < len(text):
+            paragraph_break = chunk.rfind('\n\n')
+            if paragraph_break != -1 and paragraph_break > chunk_size // 2:
+                end = start + paragraph_break + 2
+                chunk = text[start:end]
+            else:
+                sentence_break = re.search(r'[.!?]\s+', chunk[::-1])
+                if sentence_break and sentence_break.start() < chunk_size // 4:
+                    break_pos = len(chunk) - sentence_break.start()
+                    end = start + break_pos
+                    chunk = text[start:end]
+        chunks.append(chunk)
+        start = end - chunk_overlap
+    return chunks
+
+
+def latin_paragraph(rng: random.Random) -> str:
+    return " ".join(random_text(rng, rng.randint(8, 25)).capitalize() + "." for _ in range(rng.randint(3, 8)))
+
+
+def cjk_paragraph(rng: random.Random) -> str:
+    return "".join(
+        "，".join(rng.choices(CJK_SENTENCES, k=rng.randint(1, 3))) + rng.choice(CJK_TERMINATORS)
+        for _ in range(rng.randint(3, 8))
+    )
+
+
+def make_document(kind: str, size_chars: int, seed: int = 42) -> str:
+    rng = random.Random(seed)
+    paragraphs, length = [], 0
+    while length < size_chars:
+        if kind == "latin" or (kind == "mixed" and rng.random() < 0.5):
+            paragraph = latin_paragraph(rng)
+        else:
+            paragraph = cjk_paragraph(rng)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)[:size_chars]
+
+
+def boundary_ratio(chunks: List[str]) -> float:
+    """在段落或句子邊界結束的塊所佔比例（不含最後一塊）"""
+    if len(chunks) < 2:
+        return 1.0
+    ends = sum(1 for chunk in chunks[:-1] if re.search(r"([.!?]\s*|[。！？]\s*|\n\n)$", chunk))
+    return ends / (len(chunks) - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark document chunking on multi-MB inputs")
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--kinds", nargs="+", default=["latin", "cjk", "mixed"])
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    report = {"chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap, "results": []}
+    for kind in args.kinds:
+        for size_mb in args.sizes_mb:
+            text = make_document(kind, int(size_mb * 1024 * 1024))
+            row = {"kind": kind, "size_mb": size_mb, "chars": len(text)}
+            variants = {
+                "legacy": lambda: legacy_split(text, args.chunk_size, args.chunk_overlap),
+                "generator": lambda: list(iter_chunks(text, args.chunk_size, args.chunk_overlap)),
+                # 以 token 估算時約一半大小，使塊的字元數與其他方式相近
+                "generator_tokens": lambda: list(
+                    iter_chunks(text, args.chunk_size // 2, args.chunk_overlap // 2, unit="tokens")
+                ),
+            }
+            for name, fn in variants.items():
+                chunks = fn()
+                timing = measure(fn, args.repeat)
+                row[name] = {
+                    **timing,
+                    "mb_per_s": size_mb / (timing["median_ms"] / 1000),
+                    "chunks": len(chunks),
+                    "boundary_ratio": boundary_ratio(chunks),
+                }
+            report["results"].append(row)
+            print(f"{kind} {size_mb}MB | legacy {row['legacy']['median_ms']:.0f}ms"
+                  f" | generator {row['generator']['median_ms']:.0f}ms"
+                  f" | tokens {row['generator_tokens']['median_ms']:.0f}ms")
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
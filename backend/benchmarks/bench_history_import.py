@@ -0,0 +1,74 @@
+# benchmarks/bench_history_import.py - 測量 NDJSON 批次匯入的吞吐量
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_history_import --rows 500000
+#   python -m benchmarks.bench_history_import --database-url postgresql://... --rows 500000
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.common import default_database_url, init_database, random_text, print_report
+
+
+def write_ndjson(path: str, n_rows: int, turns_per_session: int = 10, seed: int = 0) -> None:
+    """產生與 /history/export 相同格式的 NDJSON 檔案"""
+    rng = random.Random(seed)
+    base_time = datetime(2024, 1, 1)
+    with open(path, "w", encoding="utf-8") as f:
+        session_id = user_id = None
+        for i in range(n_rows):
+            if i % turns_per_session == 0:
+                session_id = uuid.UUID(int=rng.getrandbits(128))
+                user_id = uuid.UUID(int=rng.getrandbits(128))
+            f.write(json.dumps({
+                "session_id": str(session_id),
+                "turn_id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "user_id": str(user_id),
+                "timestamp": (base_time + timedelta(seconds=i)).isoformat(),
+                "user_message": random_text(rng, 20),
+                "assistant_message": random_text(rng, 60),
+            }, ensure_ascii=False) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk NDJSON history import")
+    parser.add_argument("--database-url", default=default_database_url("bench_history_import"))
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    database = init_database(args.database_url)
+    import models
+    from utils.chat_import import import_file
+
+    db = database.SessionLocal()
+    db.query(models.Chat).delete()
+    db.query(models.ChatSession).delete()
+    db.commit()
+
+    path = os.path.join(tempfile.gettempdir(), "bench_history_import.ndjson")
+    write_ndjson(path, args.rows)
+
+    report = {"database_url": args.database_url, "rows": args.rows, "batch_size": args.batch_size}
+    for run in ("first", "duplicate"):
+        start = time.perf_counter()
+        progress = import_file(db, path, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        report[run] = {
+            "seconds": elapsed,
+            "rows_per_minute": int(args.rows / elapsed * 60),
+            "imported": progress.imported,
+            "skipped": progress.skipped,
+        }
+    db.close()
+    os.remove(path)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# benchmarks/bench_history_pagination.py - 比較 /history 的 offset 與 cursor 分頁在不同深度的耗時
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_history_pagination --chats 1000000
+import argparse
+
+from benchmarks.common import default_database_url, init_database, generate_chats, make_request, measure, print_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offset vs cursor pagination for /history")
+    parser.add_argument("--database-url", default=default_database_url("bench_history_pagination"))
+    parser.add_argument("--chats", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--pages", type=int, nargs="+", default=[0, 10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="不重新產生資料")
+    args = parser.parse_args()
+
+    database = init_database(args.database_url)
+    import models
+    from routes import history_routes
+    from utils.chat_sessions import PREVIEW_LENGTH
+    from utils.pagination import encode_cursor
+
+    db = database.SessionLocal()
+
+    def read_chat_history(skip: int = 0, pagination: str = "offset", cursor=None):
+        # 直接呼叫路由函數時必須明確傳入每個參數，否則 Query(...) 的默認物件會被當成參數值
+        return history_routes.read_chat_history(
+            request=make_request("/history/"), skip=skip, limit=args.limit, user_id=None,
+            pagination=pagination, cursor=cursor, include_total=None,
+            view="full", preview_length=PREVIEW_LENGTH, db=db
+        )
+
+    if not args.reuse:
+        db.query(models.Chat).delete()
+        db.query(models.ChatSession).delete()
+        db.commit()
+        generate_chats(database.engine, args.chats)
+
+    report = {"database_url": args.database_url, "chats": db.query(models.Chat).count(), "pages": []}
+    for page in args.pages:
+        skip = page * args.limit
+        offset_page = history_routes.read_chat_history_by_offset(db, skip, args.limit)
+        if not offset_page["items"] and page > 0:
+            break
+        # 以 offset 查詢取得該深度的游標（不計入耗時）
+        cursor = None
+        if skip > 0:
+            previous = history_routes.read_chat_history_by_offset(db, skip - 1, 1)["items"][0]
+            cursor = encode_cursor(previous["timestamp"], previous["session_id"])
+
+        report["pages"].append({
+            "page": page,
+            "offset": measure(lambda: read_chat_history(skip=skip), args.repeat),
+            "cursor": measure(lambda: read_chat_history(pagination="cursor", cursor=cursor), args.repeat),
+        })
+    db.close()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/bench_history_preview.py - 比較 /history 的 full 與 preview 模式的響應大小與耗時
+#
+# 助手回覆由 README 段落與原始碼片段組成（長度呈對數常態分佈），模擬以長篇程式碼回答結尾的 session。
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_history_preview --sessions 20000 --users 100
+import argparse
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from benchmarks.common import default_database_url, init_database, make_request, measure, print_report
+
+
+def generate_sessions(database, n_sessions: int, n_users: int, turns_per_session: int = 4, seed: int = 0) -> list:
+    import models
+    from sqlalchemy import insert
+    from sqlalchemy.orm import Session
+    from benchmarks.bench_message_compression import build_corpus
+    from utils.chat_sessions import rebuild_chat_sessions
+
+    rng = random.Random(seed)
+    corpus = build_corpus(2000, seed)
+    questions, answers = corpus[0::2], corpus[1::2]
+    base_time = datetime(2024, 1, 1)
+    users = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(n_users)]
+    rows = []
+    for s in range(n_sessions):
+        session_id = uuid.UUID(int=rng.getrandbits(128))
+        user_id = rng.choice(users)
+        for t in range(turns_per_session):
+            rows.append({
+                "session_id": session_id,
+                "turn_id": uuid.UUID(int=rng.getrandbits(128)),
+                "user_id": user_id,
+                "user_message": rng.choice(questions),
+                "assistant_message": rng.choice(answers),
+                "timestamp": base_time + timedelta(minutes=s * turns_per_session + t),
+            })
+    with database.engine.begin() as connection:
+        for start in range(0, len(rows), 10000):
+            connection.execute(insert(models.Chat), rows[start:start + 10000])
+    with Session(bind=database.engine) as db:
+        rebuild_chat_sessions(db)
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full vs preview history list")
+    parser.add_argument("--database-url", default=default_database_url("bench_history_preview"))
+    parser.add_argument("--sessions", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--limits", type=int, nargs="+", default=[20, 50])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--reuse", action="store_true", help="不重新產生資料")
+    args = parser.parse_args()
+
+    database = init_database(args.database_url)
+    import models
+    from sqlalchemy import func
+    from routes import history_routes
+    from utils.chat_sessions import PREVIEW_LENGTH
+
+    if not args.reuse:
+        with database.SessionLocal() as db:
+            db.query(models.Chat).delete()
+            db.query(models.ChatSession).delete()
+            db.commit()
+        generate_sessions(database, args.sessions, args.users)
+
+    db = database.SessionLocal()
+    # 側邊欄以用戶為單位讀取，選擇 session 最多的用戶
+    user_id = (
+        db.query(models.ChatSession.user_id)
+        .group_by(models.ChatSession.user_id)
+        .order_by(func.count().desc())
+        .limit(1)
+        .scalar()
+    )
+
+    def read(view: str, limit: int, preview_length: int = PREVIEW_LENGTH):
+        return history_routes.read_chat_history(
+            request=make_request("/history/"), skip=0, limit=limit, user_id=user_id,
+            pagination="offset", cursor=None, include_total=None,
+            view=view, preview_length=preview_length, db=db
+        )
+
+    report = {
+        "sessions": db.query(models.ChatSession).count(),
+        "user_sessions": db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).count(),
+        "pages": []
+    }
+    for limit in args.limits:
+        entry = {"limit": limit}
+        for name, view, length in (("full", "full", PREVIEW_LENGTH), ("preview", "preview", PREVIEW_LENGTH),
+                                   ("preview_40", "preview", 40)):
+            entry[name] = {
+                "bytes": len(read(view, limit, length).body),
+                **measure(lambda: read(view, limit, length), args.repeat),
+            }
+        entry["bytes_ratio"] = entry["full"]["bytes"] / entry["preview"]["bytes"]
+        entry["latency_ratio"] = entry["full"]["median_ms"] / entry["preview"]["median_ms"]
+        report["pages"].append(entry)
+    db.close()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# benchmarks/bench_history_search.py - 比較全文檢索索引與 ILIKE 全表掃描的搜尋延遲
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_history_search --chats 1000000
+import argparse
+
+from benchmarks.common import (
+    VOCABULARY, default_database_url, init_database, generate_chats, measure, print_report
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexed full-text search vs ILIKE")
+    parser.add_argument("--database-url", default=default_database_url("bench_history_search"))
+    parser.add_argument("--chats", type=int, default=100000)
+    # 預設涵蓋常用詞、中頻詞、長尾詞、多詞查詢與中文詞
+    parser.add_argument("--terms", nargs="+", default=[
+        VOCABULARY[40], VOCABULARY[1000], VOCABULARY[15000],
+        f"{VOCABULARY[100]} {VOCABULARY[2000]}", "資料庫"
+    ])
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--reuse", action="store_true", help="不重新產生資料")
+    args = parser.parse_args()
+
+    database = init_database(args.database_url)
+    import models
+    from sqlalchemy import desc, or_
+    from utils.chat_search import ensure_search_index, search_chats
+
+    ensure_search_index(database.engine)
+    db = database.SessionLocal()
+    if not args.reuse:
+        db.query(models.Chat).delete()
+        db.query(models.ChatSession).delete()
+        db.commit()
+        generate_chats(database.engine, args.chats)
+
+    def ilike_search(term):
+        # 原本 ChatQueryOptimizer.search_messages 的查詢方式
+        return (
+            db.query(models.Chat)
+            .filter(or_(
+                models.Chat.user_message.ilike(f"%{term}%"),
+                models.Chat.assistant_message.ilike(f"%{term}%")
+            ))
+            .order_by(desc(models.Chat.timestamp))
+            .limit(args.limit)
+            .all()
+        )
+
+    report = {"database_url": args.database_url, "chats": db.query(models.Chat).count(), "terms": []}
+    for term in args.terms:
+        report["terms"].append({
+            "term": term,
+            "results": len(search_chats(db, term, limit=args.limit)),
+            "indexed": measure(lambda: search_chats(db, term, limit=args.limit), args.repeat),
+            "ilike": measure(lambda: ilike_search(term), args.repeat),
+        })
+    db.close()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/bench_json_codec.py - 比較 response_model 驗證 + 標準庫 json 與 orjson 快速路徑的耗時
+#
+# - 歷史記錄頁面：不同頁面大小的序列化耗時
+# - 聊天請求：含大量上下文的請求解析與驗證耗時
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_json_codec --items 20 200 2000 --context 10 100 200
+import argparse
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from benchmarks.common import default_database_url, init_database, random_text, measure, print_report
+
+
+def make_rows(rng: random.Random, n_items: int):
+    base_time = datetime(2024, 1, 1)
+    return [
+        SimpleNamespace(
+            session_id=uuid.UUID(int=rng.getrandbits(128)),
+            turn_id=uuid.UUID(int=rng.getrandbits(128)),
+            user_id=uuid.UUID(int=rng.getrandbits(128)),
+            user_message=random_text(rng, 30),
+            assistant_message=random_text(rng, 200),
+            timestamp=base_time + timedelta(seconds=i),
+        )
+        for i in range(n_items)
+    ]
+
+
+def make_chat_request(rng: random.Random, n_context: int) -> bytes:
+    return json.dumps({
+        "session_id": str(uuid.uuid4()),
+        "message": random_text(rng, 50),
+        "context": [
+            {
+                "user_message": random_text(rng, 50),
+                "assistant_message": random_text(rng, 300),
+                "file_content": random_text(rng, 500) if i % 10 == 0 else "",
+            }
+            for i in range(n_context)
+        ],
+        "model": "gpt-4o-mini",
+    }, ensure_ascii=False).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON serialization and request parsing")
+    parser.add_argument("--items", type=int, nargs="+", default=[20, 200, 2000])
+    parser.add_argument("--context", type=int, nargs="+", default=[10, 100, 200])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    init_database(default_database_url("bench_json_codec"))
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter, BaseModel
+    from typing import List
+    import schemas
+    from routes.history_routes import PaginatedChatHistory
+    from utils.json_codec import FastJSONResponse, chats_to_list, loads, orjson
+
+    rng = random.Random(0)
+    page_adapter = TypeAdapter(PaginatedChatHistory)
+    report = {"orjson": orjson is not None, "history_pages": [], "chat_requests": []}
+
+    for n_items in args.items:
+        rows = make_rows(rng, n_items)
+        page = {"total": n_items, "page": 0, "limit": n_items, "has_more": False}
+
+        def validated():
+            # FastAPI 的 response_model 流程：驗證後轉為 JSON 相容物件，再以標準庫 json 輸出
+            value = page_adapter.validate_python({**page, "items": rows})
+            return JSONResponse(page_adapter.dump_python(value, mode="json")).body
+
+        def fast():
+            return FastJSONResponse({**page, "items": chats_to_list(rows), "next_cursor": None}).body
+
+        assert json.loads(validated()) == json.loads(fast())
+        report["history_pages"].append({
+            "items": n_items,
+            "bytes": len(fast()),
+            "response_model_json": measure(validated, args.repeat),
+            "fast_path_orjson": measure(fast, args.repeat),
+        })
+
+    class UntypedChatRequest(BaseModel):
+        # 改版前的請求模型：context 為未驗證的 dict 列表
+        session_id: uuid.UUID
+        message: str
+        context: list = []
+        model: str = "gpt-4o-mini"
+
+    for n_context in args.context:
+        body = make_chat_request(rng, n_context)
+        report["chat_requests"].append({
+            "context_turns": n_context,
+            "bytes": len(body),
+            "json_untyped": measure(lambda: UntypedChatRequest(**json.loads(body)), args.repeat),
+            "json_typed": measure(lambda: schemas.ChatRequest(**json.loads(body)), args.repeat),
+            "orjson_typed": measure(lambda: schemas.ChatRequest(**loads(body)), args.repeat),
+            "validate_json_typed": measure(lambda: schemas.ChatRequest.model_validate_json(body), args.repeat),
+        })
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# benchmarks/bench_message_compression.py - 比較訊息壓縮方式的儲存節省與解壓成本
+#
+# 語料由專案內的 README 段落與 Python 原始碼片段組成（模擬含有說明與程式碼的助手回覆），
+# 另外混入 Zipf 分佈的合成文字作為使用者訊息。
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_message_compression --messages 20000
+import argparse
+import glob
+import os
+import random
+import time
+
+from benchmarks.common import default_database_url, init_database, random_text, print_report
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_fragments():
+    """讀取 README 段落與原始碼區塊作為組成回覆的片段"""
+    fragments = []
+    with open(os.path.join(BACKEND_DIR, "..", "README.md"), encoding="utf-8") as f:
+        fragments.extend(p.strip() for p in f.read().split("\n\n") if p.strip())
+    for path in glob.glob(os.path.join(BACKEND_DIR, "**", "*.py"), recursive=True):
+        if "benchmarks" in path or "tests" in path:
+            continue
+        with open(path, encoding="utf-8") as f:
+            blocks = f.read().split("\n\n\n")
+        fragments.extend("```python\n" + block.strip() + "\n```" for block in blocks if block.strip())
+    return fragments
+
+
+def build_corpus(n_messages: int, seed: int = 0):
+    """產生長度呈對數常態分佈的訊息（多數較短，少數很長）"""
+    rng = random.Random(seed)
+    fragments = load_fragments()
+    messages = []
+    for i in range(n_messages):
+        if i % 2 == 0:
+            messages.append(random_text(rng, max(3, int(rng.lognormvariate(3, 1)))))
+        else:
+            target = int(rng.lognormvariate(7, 1.2))
+            parts = []
+            while sum(len(p) for p in parts) < target:
+                parts.append(rng.choice(fragments))
+            messages.append("\n\n".join(parts))
+    return messages
+
+
+def measure_mode(messages, settings):
+    from utils.compressed_text import compress_text, decompress_text
+
+    raw_bytes = sum(len(m.encode("utf-8")) for m in messages)
+    start = time.perf_counter()
+    stored = [compress_text(m, settings) for m in messages]
+    compress_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for value in stored:
+        decompress_text(value, settings)
+    decode_seconds = time.perf_counter() - start
+
+    stored_bytes = sum(len(v) if isinstance(v, bytes) else len(v.encode("utf-8")) for v in stored)
+    compressed = [v for v in stored if isinstance(v, bytes)]
+    return {
+        "raw_mb": raw_bytes / 1e6,
+        "stored_mb": stored_bytes / 1e6,
+        "saving_pct": 100 * (1 - stored_bytes / raw_bytes),
+        "compressed_values": len(compressed),
+        "compress_mb_per_s": raw_bytes / 1e6 / compress_seconds,
+        "decode_mb_per_s": raw_bytes / 1e6 / decode_seconds,
+        "decode_us_per_compressed_value": 1e6 * decode_seconds / max(len(compressed), 1),
+    }
+
+
+def measure_database(database, messages, mode: str):
+    """寫入資料庫後比較檔案大小與讀取整個 session 的耗時"""
+    import uuid
+    from datetime import datetime, timedelta
+    import models
+    from utils import compressed_text
+
+    compressed_text.compression_settings.mode = mode
+    db = database.SessionLocal()
+    db.query(models.Chat).delete()
+    db.commit()
+    session_ids = [uuid.uuid4() for _ in range(max(1, len(messages) // 50))]
+    base_time = datetime(2024, 1, 1)
+    for i in range(0, len(messages) - 1, 2):
+        db.add(models.Chat(
+            session_id=session_ids[(i // 2) % len(session_ids)],
+            turn_id=uuid.uuid4(),
+            user_message=messages[i],
+            assistant_message=messages[i + 1],
+            timestamp=base_time + timedelta(seconds=i)
+        ))
+    db.commit()
+    with database.engine.connect() as connection:
+        connection.exec_driver_sql("VACUUM")
+    size = os.path.getsize(database.engine.url.database)
+
+    start = time.perf_counter()
+    for session_id in session_ids[:100]:
+        db.query(models.Chat).filter(models.Chat.session_id == session_id).all()
+        db.expunge_all()
+    elapsed_ms = (time.perf_counter() - start) * 1000 / min(len(session_ids), 100)
+    db.close()
+    return {"db_file_mb": size / 1e6, "session_read_ms": elapsed_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message compression")
+    parser.add_argument("--database-url", default=default_database_url("bench_message_compression"))
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--min-bytes", type=int, default=1024)
+    args = parser.parse_args()
+
+    database = init_database(args.database_url)
+    from utils.compressed_text import CompressionSettings, zstandard
+
+    messages = build_corpus(args.messages)
+    report = {"messages": len(messages), "min_bytes": args.min_bytes, "modes": {}}
+    modes = {
+        "zlib": CompressionSettings(mode="zlib", min_bytes=args.min_bytes),
+        "zstd": CompressionSettings(mode="zstd", min_bytes=args.min_bytes),
+    }
+    if zstandard is not None:
+        import tempfile
+        dict_path = os.path.join(tempfile.gettempdir(), "bench_message_compression.dict")
+        samples = [m.encode("utf-8") for m in messages[: len(messages) // 2]]
+        with open(dict_path, "wb") as f:
+            f.write(zstandard.train_dictionary(112640, samples).as_bytes())
+        modes["zstd_dict"] = CompressionSettings(mode="zstd", min_bytes=args.min_bytes, dictionary_path=dict_path)
+
+    for name, settings in modes.items():
+        report["modes"][name] = measure_mode(messages, settings)
+
+    from utils import compressed_text
+    compressed_text.compression_settings.min_bytes = args.min_bytes
+    report["database"] = {mode: measure_database(database, messages, mode) for mode in ("off", "zlib", "zstd")}
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
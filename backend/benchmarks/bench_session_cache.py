@@ -0,0 +1,62 @@
+# benchmarks/bench_session_cache.py - 比較開啟 session 時查詢資料庫與命中對話記錄快取的耗時
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_session_cache --sessions 2000 --turns 10 50 200
+import argparse
+import random
+import uuid
+
+from benchmarks.common import default_database_url, init_database, make_request, measure, print_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session history cache")
+    parser.add_argument("--database-url", default=default_database_url("bench_session_cache"))
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    database = init_database(args.database_url)
+    import models
+    from benchmarks.bench_history_preview import generate_sessions
+    from routes import history_routes
+    from utils.session_cache import session_cache
+
+    report = {"sessions": args.sessions, "reads": []}
+    db = database.SessionLocal()
+    for turns in args.turns:
+        db.query(models.Chat).delete()
+        db.query(models.ChatSession).delete()
+        db.commit()
+        generate_sessions(database, args.sessions, max(1, args.sessions // 20), turns_per_session=turns)
+        session_ids = [row[0] for row in db.query(models.ChatSession.session_id).limit(100).all()]
+        rng = random.Random(0)
+
+        def read(session_id=None):
+            return history_routes.read_session_chat_history(
+                session_id=session_id or rng.choice(session_ids), request=make_request("/history/session"),
+                user_id=None, db=db
+            )
+
+        def uncached():
+            session_cache.invalidate()
+            return read()
+
+        database_ms = measure(uncached, args.repeat)
+        # 模擬剛寫入的 session：先載入到快取
+        for session_id in session_ids:
+            read(session_id)
+        report["reads"].append({
+            "turns": turns,
+            "bytes": len(read().body),
+            "database": database_ms,
+            "cache_hit": measure(read, args.repeat),
+            "cache": session_cache.get_stats(),
+        })
+    db.close()
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
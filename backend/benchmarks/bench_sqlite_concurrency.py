@@ -0,0 +1,145 @@
+# benchmarks/bench_sqlite_concurrency.py - 比較 SQLite 默認設定與正式環境設定（WAL + 單一寫入執行緒）的併發表現
+#
+# 模擬多個同時進行的串流對話：每輪先寫入使用者訊息，等待模型回覆後再寫入回覆與用量，
+# 期間穿插讀取 session 歷史。
+#
+# 使用方式（在 backend 目錄下）:
+#   python -m benchmarks.bench_sqlite_concurrency --workers 16 --turns 50
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from benchmarks.common import init_database, print_report
+
+
+def percentile(samples, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] if ordered else 0.0
+
+
+def make_turn_writers(models, record_turn, record_response, record_usage, session_id, user_id, turn: int):
+    """返回一輪對話的兩段寫入（與 stream_and_save 相同的寫入內容）"""
+    chat = models.Chat(
+        session_id=session_id,
+        turn_id=uuid.uuid4(),
+        user_id=user_id,
+        user_message=f"question {turn}",
+        assistant_message="",
+        timestamp=datetime.now()
+    )
+
+    def save_user_turn(db):
+        db.add(chat)
+        record_turn(db, chat)
+
+    def save_response(db):
+        chat.assistant_message = f"answer {turn} " * 40
+        db.add(chat)
+        record_response(db, chat)
+        record_usage(db, user_id, chat.timestamp, "bench-model", tokens=200, latency_ms=5.0)
+
+    return save_user_turn, save_response
+
+
+def run_profile(database_url: str, profile: str, workers: int, turns: int, stream_ms: float) -> dict:
+    from sqlalchemy import create_engine, exc
+    from sqlalchemy.orm import sessionmaker
+    import models
+    from utils.chat_sessions import record_turn, record_response
+    from utils.compressed_text import register_sqlite_functions
+    from utils.db_pool import pool_settings_from_env
+    from utils.sqlite_profile import configure_sqlite_engine, create_write_queue
+    from utils.usage_rollup import record_usage
+
+    engine = create_engine(database_url, **pool_settings_from_env(database_url))
+    register_sqlite_functions(engine)
+    configure_sqlite_engine(engine, database_url, profile=profile)
+    models.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    write_queue = create_write_queue(database_url, profile=profile)
+
+    write_ms, read_ms = [], []
+    errors = {"locked": 0, "other": 0}
+    lock = threading.Lock()
+
+    def write(db, fn):
+        start = time.perf_counter()
+        try:
+            if write_queue is not None:
+                write_queue.run(fn)
+            else:
+                fn(db)
+                db.commit()
+        except exc.OperationalError as e:
+            db.rollback()
+            with lock:
+                errors["locked" if "locked" in str(e) else "other"] += 1
+            return
+        with lock:
+            write_ms.append((time.perf_counter() - start) * 1000)
+
+    def worker(index: int):
+        db = SessionLocal()
+        session_id, user_id = uuid.uuid4(), uuid.uuid4()
+        try:
+            for turn in range(turns):
+                save_user_turn, save_response = make_turn_writers(
+                    models, record_turn, record_response, record_usage, session_id, user_id, turn
+                )
+                write(db, save_user_turn)
+                time.sleep(stream_ms / 1000)
+                write(db, save_response)
+                start = time.perf_counter()
+                db.query(models.Chat).filter(models.Chat.session_id == session_id).all()
+                db.rollback()
+                with lock:
+                    read_ms.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "turns_per_second": len(write_ms) / 2 / elapsed,
+        "write_p50_ms": statistics.median(write_ms) if write_ms else 0.0,
+        "write_p99_ms": percentile(write_ms, 0.99),
+        "read_p50_ms": statistics.median(read_ms) if read_ms else 0.0,
+        "read_p99_ms": percentile(read_ms, 0.99),
+        "failed_writes": errors,
+    }
+    if write_queue is not None:
+        write_queue.stop()
+        report["writer"] = write_queue.get_stats()
+    engine.dispose()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQLite default vs production profile under concurrent writes")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--stream-ms", type=float, default=5.0, help="模擬模型串流的時間")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_sqlite_concurrency")
+    init_database(f"sqlite:///{os.path.join(directory, 'init.db')}")
+    report = {"workers": args.workers, "turns_per_worker": args.turns, "profiles": {}}
+    for profile in ("default", "production"):
+        url = f"sqlite:///{os.path.join(directory, profile)}.db"
+        report["profiles"][profile] = run_profile(url, profile, args.workers, args.turns, args.stream_ms)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
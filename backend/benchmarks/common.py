@@ -0,0 +1,138 @@
+# benchmarks/common.py - 基準測試共用工具：資料庫初始化、合成資料與計時
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import statistics
+import tempfile
+import itertools
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = [
+    "python", "database", "index", "query", "session", "stream", "token", "model", "vector",
+    "chunk", "cache", "latency", "cursor", "partition", "embedding", "retrieval", "prompt",
+    "資料庫", "索引", "查詢", "向量", "模型", "對話", "檢索", "文件", "效能", "分頁", "快取",
+]
+# 以 Zipf 分佈抽樣的詞彙表：常用詞出現頻繁，長尾詞很少出現，接近真實文本的詞頻
+_vocabulary_rng = random.Random(0)
+VOCABULARY = WORDS + [
+    "".join(_vocabulary_rng.choices("abcdefghijklmnopqrstuvwxyz", k=_vocabulary_rng.randint(4, 9)))
+    for _ in range(20000)
+]
+_CUMULATIVE_WEIGHTS = list(itertools.accumulate(1.0 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def default_database_url(name: str) -> str:
+    """返回暫存目錄下的 SQLite 連接字串"""
+    return f"sqlite:///{os.path.join(tempfile.gettempdir(), name)}.db"
+
+
+def init_database(database_url: str):
+    """
+    設定 DATABASE_URL 並建立資料表
+
+    必須在匯入任何後端模組之前呼叫，因為 database.py 在匯入時讀取環境變數。
+
+    Returns:
+        database 模組
+    """
+    os.environ["DATABASE_URL"] = database_url
+    import database
+    import models
+    models.Base.metadata.create_all(bind=database.engine)
+    return database
+
+
+def make_request(path: str = "/", headers: Dict[str, str] = None):
+    """建立可直接傳給路由函數的 Request 物件（不經過 HTTP 層）"""
+    from starlette.requests import Request
+    raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": path, "headers": raw_headers, "query_string": b""})
+
+
+def random_text(rng: random.Random, n_words: int) -> str:
+    return " ".join(rng.choices(VOCABULARY, cum_weights=_CUMULATIVE_WEIGHTS, k=n_words))
+
+
+def generate_chats(
+    engine,
+    n_chats: int,
+    n_users: int = 1000,
+    turns_per_session: int = 10,
+    message_words: int = 30,
+    batch_size: int = 10000,
+    seed: int = 42
+) -> Dict[str, Any]:
+    """
+    產生合成的聊天記錄並批量寫入 chats 表
+
+    每個 session 屬於一位隨機用戶，包含 1 到 2 * turns_per_session 輪對話，
+    時間戳在過去一年內遞增分佈。寫入後重建 chat_sessions 摘要表。
+
+    Returns:
+        產生的用戶ID列表與寫入時間等資訊
+    """
+    import models
+    from sqlalchemy import insert
+    from sqlalchemy.orm import Session
+    from utils.chat_sessions import rebuild_chat_sessions
+
+    rng = random.Random(seed)
+    users = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(n_users)]
+    start_time = datetime.now() - timedelta(days=365)
+    seconds_per_chat = 365 * 24 * 3600 / max(n_chats, 1)
+
+    rows: List[Dict[str, Any]] = []
+    written = 0
+    begin = time.perf_counter()
+    with engine.begin() as connection:
+        while written + len(rows) < n_chats:
+            session_id = uuid.UUID(int=rng.getrandbits(128))
+            user_id = rng.choice(users)
+            for _ in range(rng.randint(1, 2 * turns_per_session)):
+                index = written + len(rows)
+                if index >= n_chats:
+                    break
+                rows.append({
+                    "session_id": session_id,
+                    "turn_id": uuid.UUID(int=rng.getrandbits(128)),
+                    "user_id": user_id,
+                    "user_message": random_text(rng, message_words),
+                    "assistant_message": random_text(rng, message_words * 4),
+                    "timestamp": start_time + timedelta(seconds=index * seconds_per_chat),
+                })
+            if len(rows) >= batch_size:
+                connection.execute(insert(models.Chat), rows)
+                written += len(rows)
+                rows = []
+        if rows:
+            connection.execute(insert(models.Chat), rows)
+            written += len(rows)
+    insert_seconds = time.perf_counter() - begin
+
+    with Session(bind=engine) as db:
+        rebuild_chat_sessions(db)
+    return {"users": users, "rows": written, "insert_seconds": insert_seconds}
+
+
+def measure(fn: Callable[[], Any], repeat: int = 5) -> Dict[str, float]:
+    """執行多次並返回耗時統計（毫秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "median_ms": statistics.median(samples),
+        "min_ms": min(samples),
+        "max_ms": max(samples),
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(json.dumps(report, indent=2, ensure_ascii=False, default=str))
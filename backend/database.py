@@ -5,6 +5,9 @@ from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 from utils.backend_logger import BackendLogger
+from utils.db_pool import pool_settings_from_env
+from utils.compressed_text import register_sqlite_functions
+from utils.sqlite_profile import configure_sqlite_engine, create_write_queue
 backend_logger = BackendLogger().logger
 
 # 載入環境變數
@@ -13,11 +16,29 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 db_type = DATABASE_URL.split("+")[0]
 
 # 創建 SQLAlchemy 引擎
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **pool_settings_from_env(DATABASE_URL))
+
+# SQLite 連線需註冊訊息解壓函數（全文檢索觸發器使用）
+register_sqlite_functions(engine)
+# SQLITE_PROFILE=production 時設定 WAL 等 pragma（此引擎的連線池只負責讀取與一般操作）
+configure_sqlite_engine(engine, DATABASE_URL)
 
 # 創建 SessionLocal 類
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 可選的唯讀副本，未設定時讀取也使用主資料庫
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+read_engine = (
+    create_engine(DATABASE_REPLICA_URL, **pool_settings_from_env(DATABASE_REPLICA_URL))
+    if DATABASE_REPLICA_URL else engine
+)
+if read_engine is not engine:
+    register_sqlite_functions(read_engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# SQLite 正式環境的單一寫入執行緒，其他情況為 None（寫入直接使用請求的 session）
+write_queue = create_write_queue(DATABASE_URL)
+
 # 創建基礎類別
 Base = declarative_base()
 
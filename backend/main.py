@@ -1,6 +1,8 @@
 import logging
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
 from utils.logging import setup_logging
@@ -11,12 +13,41 @@ from utils.security_middleware import (
     request_logging_middleware
 )
 from routes import chat_routes, log_routes, health_routes, history_routes, vectordb_routes
+from database import engine, read_engine, write_queue
+from utils.db_pool import warm_up_pool
+from utils.chat_archive import start_archive_job
+from utils.json_codec import FastJSONResponse
+from utils.vectordb.embedding import EMBEDDING_WARMUP, warm_up_embedding
+from utils.vectordb.ingest import INGEST_MAX_BYTES
 
 # 設置日誌
 setup_logging()
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 啟動時預熱連線池，避免第一批請求承擔建立連線的延遲
+    await run_in_threadpool(warm_up_pool, engine)
+    if read_engine is not engine:
+        await run_in_threadpool(warm_up_pool, read_engine)
+    # 載入並預熱嵌入模型，避免第一次新增或檢索文件時才載入
+    if EMBEDDING_WARMUP:
+        await run_in_threadpool(warm_up_embedding)
+    # 啟用保留期限時，定期將舊對話搬移到冷儲存
+    archive_task = start_archive_job()
+    if write_queue is not None:
+        write_queue.start()
+    yield
+    if archive_task is not None:
+        archive_task.cancel()
+    if write_queue is not None:
+        # 關閉前寫入佇列中剩餘的對話
+        await run_in_threadpool(write_queue.stop)
+
 app = FastAPI(
+    lifespan=lifespan,
+    # 所有 JSON 響應以 orjson 序列化
+    default_response_class=FastJSONResponse,
     title="聊天 API",
     description="這是一個使用 FastAPI 和 LangChain 實現的聊天 API",
     version="1.1.0"
@@ -59,8 +90,9 @@ app.add_middleware(
         "Content-Type",
         "Authorization",
         "X-Requested-With",
+        "If-None-Match",
     ],  # 明確指定允許的頭部
-    expose_headers=["X-Total-Count"],  # 暴露必要的響應頭部
+    expose_headers=["X-Total-Count", "ETag"],  # 暴露必要的響應頭部
     max_age=600,  # 預檢請求的緩存時間（秒）
 )
 
@@ -68,7 +100,11 @@ app.add_middleware(
 app.middleware("http")(request_logging_middleware)
 app.middleware("http")(security_headers_middleware)
 app.middleware("http")(rate_limit_middleware)
-app.middleware("http")(validate_request_size(max_size=10 * 1024 * 1024))  # 10MB 限制
+# 10MB 限制；批次寫入端點邊接收邊處理，使用自己的上限
+app.middleware("http")(validate_request_size(
+    max_size=10 * 1024 * 1024,
+    path_limits={"/vectordb/ingest": INGEST_MAX_BYTES}
+))
 
 # 引入路由
 app.include_router(chat_routes.router, prefix="/chat", tags=["Chat"])
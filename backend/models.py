@@ -1,16 +1,17 @@
 # models.py
-from sqlalchemy import Column, DateTime, Index, Text
+from sqlalchemy import BigInteger, Column, Date, DateTime, Float, Index, Integer, Text
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from database import Base
+from utils.compressed_text import CompressedText
 
 class Chat(Base):
     __tablename__ = "chats"
     session_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     turn_id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), nullable=True, index=True)  # 添加索引
-    user_message = Column(Text)  # 改為 Text 類型以支持更長的內容
-    assistant_message = Column(Text)  # 改為 Text 類型以支持更長的內容
+    user_message = Column(CompressedText)  # Text 類型，啟用 CHAT_COMPRESSION 時在 SQLite 上壓縮大型內容
+    assistant_message = Column(CompressedText)
     timestamp = Column(DateTime, index=True)  # 添加索引以優化時間排序查詢
 
     # 明確定義複合索引以優化常見查詢
@@ -21,4 +22,58 @@ class Chat(Base):
         Index('idx_session_timestamp', 'session_id', 'timestamp'),
         # 優化按時間和用戶的複合索引（用於分頁查詢）
         Index('idx_timestamp_user', 'timestamp', 'user_id'),
-    )
\ No newline at end of file
+    )
+
+class ChatSession(Base):
+    """每個 session 的摘要，於寫入對話時增量維護，供歷史列表使用"""
+    __tablename__ = "chat_sessions"
+    session_id = Column(UUID(as_uuid=True), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), nullable=True)
+    first_timestamp = Column(DateTime, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)  # 與最新一輪對話的 chats.timestamp 相同
+    turn_count = Column(Integer, nullable=False, default=0)
+    last_user_message_preview = Column(Text)
+    last_assistant_message_preview = Column(Text)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # 優化按用戶列出最近會話的查詢（含游標分頁）
+        Index('idx_chat_sessions_user_last', 'user_id', 'last_timestamp', 'session_id'),
+        # 優化不分用戶的最近會話查詢與過期會話清理
+        Index('idx_chat_sessions_last', 'last_timestamp', 'session_id'),
+    )
+
+class ChatArchive(Base):
+    """已搬移到冷儲存的對話區塊位置，每個 session 每次歸檔一筆"""
+    __tablename__ = "chat_archive_index"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    user_id = Column(UUID(as_uuid=True), nullable=True)
+    archive_file = Column(Text, nullable=False)  # 相對於歸檔目錄的檔名
+    byte_offset = Column(BigInteger, nullable=False)
+    byte_length = Column(Integer, nullable=False)
+    turn_count = Column(Integer, nullable=False)
+    first_timestamp = Column(DateTime, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
+
+class UserDailyUsage(Base):
+    """每位用戶每日、每個模型的用量彙總，於寫入對話時增量更新"""
+    __tablename__ = "user_daily_usage"
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    day = Column(Date, primary_key=True)
+    model = Column(Text, primary_key=True)
+    turns = Column(Integer, nullable=False, default=0)
+    sessions = Column(Integer, nullable=False, default=0)  # 當天第一輪使用此模型的 session 數（每個 session 每天只計一次，記在當天第一輪的模型下）
+    tokens = Column(Integer, nullable=False, default=0)
+    errors = Column(Integer, nullable=False, default=0)
+    latency_ms_sum = Column(Float, nullable=False, default=0)
+    last_timestamp = Column(DateTime, nullable=False)
+
+class TokenUsage(Base):
+    """每位用戶按時間桶累計的 token 用量，用於配額計算"""
+    __tablename__ = "token_usage"
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)  # 時間桶起點
+    tokens = Column(Integer, nullable=False, default=0)
+    requests = Column(Integer, nullable=False, default=0)
\ No newline at end of file
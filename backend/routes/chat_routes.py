@@ -1,4 +1,5 @@
 import os
+import time
 import uuid
 import models
 import schemas
@@ -7,8 +8,11 @@ from datetime import datetime
 from sqlalchemy.orm import Session
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
-from typing import AsyncGenerator
+from uuid import UUID
+from typing import AsyncGenerator, List, Optional
 import google.generativeai as genai
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
@@ -16,23 +20,49 @@ from langchain.schema import HumanMessage, SystemMessage, AIMessage
 from utils.dependencies import get_db
 from utils.logging import setup_logging
 from utils.backend_logger import BackendLogger
+from utils.vectordb.rag import RetrievalTask, build_retrieval_prompt, merge_prompt
+from utils.token_utils import estimate_tokens
+from utils.chat_sessions import record_turn, record_response, session_version, backfill_chat_sessions_if_empty
+from utils.session_cache import session_cache
+from utils.chat_search import ensure_search_index
+from utils.read_routing import replica_router, write_keys
+from utils.usage_rollup import is_first_turn_of_day, record_usage, is_error_message
+from utils.sqlite_profile import run_write
+from utils.json_codec import FastJSONRoute, chat_to_dict
+from utils.token_quota import (
+    token_quota,
+    estimate_request_tokens,
+    QuotaReservation,
+    TokenQuotaExceeded
+)
 
 from dotenv import load_dotenv
 
 load_dotenv()
 models.Base.metadata.create_all(bind=engine)
+backfill_chat_sessions_if_empty(engine)
+ensure_search_index(engine)
 
 setup_logging()
 logger = BackendLogger("chat_routes").logger
 backend_logger = BackendLogger().logger
 
-router = APIRouter()
+router = APIRouter(route_class=FastJSONRoute)
 
 async def stream_and_save(
     db: Session,
     chat_request: schemas.ChatRequest,
     api_call: callable,
+    reservation: Optional[QuotaReservation] = None,
 ) -> AsyncGenerator[str, None]:
+    turn_start = time.perf_counter()
+    timings = {}
+
+    # 檢索與寫入使用者訊息同時進行，避免額外的往返延遲
+    retrieval_task = None
+    if chat_request.retrieval and chat_request.retrieval.enabled:
+        retrieval_task = RetrievalTask(chat_request.session_id, chat_request.message, chat_request.retrieval)
+
     db_chat = models.Chat(
         session_id=chat_request.session_id,
         turn_id=uuid.uuid4(),
@@ -41,9 +71,37 @@ async def stream_and_save(
         assistant_message="",
         timestamp=datetime.now()
     )
-    db.add(db_chat)
-    db.commit()
-    db.refresh(db_chat)
+
+    def save_user_turn(write_db: Session) -> tuple:
+        write_db.add(db_chat)
+        new_session = is_first_turn_of_day(write_db, db_chat.session_id, db_chat.timestamp)
+        previous_version = session_version(write_db, db_chat.session_id)
+        record_turn(write_db, db_chat)
+        return new_session, previous_version, session_version(write_db, db_chat.session_id), chat_to_dict(db_chat)
+
+    # SQLite 正式環境下由單一寫入執行緒執行，與其他請求的寫入合併 commit
+    new_session_today, previous_version, version, turn = await run_write(db, save_user_turn)
+    # 寫入後同步更新對話記錄快取，開啟 session 時不需再查詢資料庫
+    session_cache.write_through(chat_request.session_id, turn, previous_version, version)
+    # 讀己之寫：之後一段時間內讀取此 session / user 的請求改走主資料庫
+    written_keys = write_keys(chat_request.session_id, chat_request.user_id)
+    replica_router.mark_write(written_keys)
+
+    prompt = chat_request.prompt
+    if retrieval_task is not None:
+        documents, timings["retrieval_ms"] = await retrieval_task.result()
+        timings["retrieved_docs"] = len(documents)
+        prompt = merge_prompt(
+            prompt,
+            build_retrieval_prompt(documents, chat_request.retrieval.max_tokens)
+        )
+        if reservation is not None:
+            # 以實際注入的檢索內容取代預留的檢索預算
+            reservation.input_tokens += (
+                estimate_tokens(prompt)
+                - estimate_tokens(chat_request.prompt)
+                - chat_request.retrieval.max_tokens
+            )
 
     full_response = ""
     try:
@@ -51,7 +109,7 @@ async def stream_and_save(
             stream = api_call(
                 chat_request.message,
                 chat_request.context,
-                chat_request.prompt,
+                prompt,
                 chat_request.model
             )
         elif chat_request.api_type == 'openai':
@@ -61,7 +119,7 @@ async def stream_and_save(
                 chat_request.temperature,
                 chat_request.max_tokens,
                 chat_request.context,
-                chat_request.prompt,
+                prompt,
                 chat_request.images
             )
         else:
@@ -71,11 +129,13 @@ async def stream_and_save(
                 temperature=chat_request.temperature,
                 max_tokens=chat_request.max_tokens,
                 context=chat_request.context,
-                prompt=chat_request.prompt
+                prompt=prompt
             )
 
         async for chunk in stream:
             if chunk:
+                if "first_chunk_ms" not in timings:
+                    timings["first_chunk_ms"] = (time.perf_counter() - turn_start) * 1000
                 full_response += chunk
                 yield chunk
                 logger.debug(f"Stream chunk: {chunk}")
@@ -87,12 +147,51 @@ async def stream_and_save(
     finally:
         if not db_chat.assistant_message.startswith("Error:"):
             db_chat.assistant_message = full_response
-        db.add(db_chat)
-        db.commit()
-        db.refresh(db_chat)
+
+        def save_response(write_db: Session) -> tuple:
+            write_db.add(db_chat)
+            previous_version = session_version(write_db, db_chat.session_id)
+            record_response(write_db, db_chat)
+            if reservation is not None:
+                try:
+                    # reconcile 在 SAVEPOINT 中寫入配額用量，失敗只回滾這一步，不影響同一交易中的回應與每日統計
+                    timings["tokens"] = token_quota.reconcile(write_db, reservation, estimate_tokens(full_response))
+                except Exception as e:
+                    logger.error(f"Failed to record token usage: {str(e)}")
+            record_usage(
+                write_db,
+                chat_request.user_id,
+                db_chat.timestamp,
+                chat_request.model,
+                tokens=timings.get("tokens", estimate_tokens(chat_request.message) + estimate_tokens(full_response)),
+                error=is_error_message(db_chat.assistant_message),
+                latency_ms=(time.perf_counter() - turn_start) * 1000,
+                new_session=new_session_today
+            )
+            return previous_version, session_version(write_db, db_chat.session_id), chat_to_dict(db_chat)
+
+        previous_version, version, turn = await run_write(db, save_response)
+        session_cache.write_through(chat_request.session_id, turn, previous_version, version)
+        replica_router.mark_write(written_keys)
         logger.info(f"Streaming finished. Full response saved for turn {db_chat.turn_id}.")
+        timings["total_ms"] = (time.perf_counter() - turn_start) * 1000
+        backend_logger.info(f"Turn timings | turn_id: {db_chat.turn_id} | " + ", ".join(
+            f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}"
+            for key, value in timings.items()
+        ))
         backend_logger.debug(f"session_id: {chat_request.session_id}, turn_id: {db_chat.turn_id}, api_type: {chat_request.api_type}, model: {chat_request.model}, temperature: {chat_request.temperature}, max_tokens: {chat_request.max_tokens}, user_message: {chat_request.message}, assistant_message: {full_response}")
 
+async def release_unreconciled(
+    stream: AsyncGenerator[str, None],
+    reservation: QuotaReservation
+) -> AsyncGenerator[str, None]:
+    """串流因例外中止（例如寫入使用者訊息失敗）而未執行 reconcile 時釋放預留的配額"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        token_quota.release(reservation)
+
 @router.post("/")
 async def create_chat(chat: schemas.ChatRequest, db: Session = Depends(get_db)):
     """
@@ -126,14 +225,39 @@ async def create_chat(chat: schemas.ChatRequest, db: Session = Depends(get_db)):
         else:
             raise HTTPException(status_code=400, detail="Invalid api_type specified")
 
+        # 在呼叫模型前預留 token 配額（可能查詢資料庫，不在事件迴圈中執行）
+        reservation = await run_in_threadpool(
+            token_quota.reserve, chat.user_id, estimate_request_tokens(chat), chat.max_tokens
+        )
+
+        # 客戶端在串流開始前斷線時生成器不會執行，由 background task 釋放預留；
+        # 已 reconcile 的預留不會重複釋放
         return StreamingResponse(
-            stream_and_save(db, chat, api_call),
-            media_type="text/plain"
+            release_unreconciled(stream_and_save(db, chat, api_call, reservation), reservation),
+            media_type="text/plain",
+            background=BackgroundTask(token_quota.release, reservation)
+        )
+    except TokenQuotaExceeded as e:
+        logger.warning(f"Token quota exceeded for user: {chat.user_id}")
+        raise HTTPException(
+            status_code=429,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)}
         )
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/usage/{user_id}")
+def read_token_usage(user_id: UUID):
+    """
+    獲取用戶的 token 用量與配額
+
+    - **user_id**: 用戶ID
+    - 返回: 滾動視窗與當日的 token 用量及對應配額
+    """
+    return token_quota.get_usage(user_id)
+
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
@@ -145,7 +269,7 @@ async def call_openai_api(
     model: str,
     temperature: float = 0.7,
     max_tokens: int = 1000,
-    context: list = [],
+    context: List[schemas.ContextMessage] = [],
     prompt: str = "",
     images: list = None,
 ) -> AsyncGenerator[str, None]:
@@ -167,17 +291,10 @@ async def call_openai_api(
         )
 
         # Process context messages
-        if len(context) > 0:
-            for h in context:
-                user_message = h["user_message"]
-                if h.get("file_content"):
-                    user_message = (
-                        f"FileContent:\n{h['file_content']}\n\nQuestion: {h['user_message']}"
-                    )
-
-                messages.append(HumanMessage(content=user_message))
-                if h.get("assistant_message") and h["assistant_message"] != "":
-                    messages.append(AIMessage(content=h["assistant_message"]))
+        for h in context:
+            messages.append(HumanMessage(content=h.user_content()))
+            if h.assistant_message:
+                messages.append(AIMessage(content=h.assistant_message))
 
         # Create the current user message
         if images and len(images) > 0:
@@ -215,7 +332,7 @@ async def call_openai_api(
 
 async def call_gemini_api(
     message: str, 
-    context: list = [], 
+    context: List[schemas.ContextMessage] = [], 
     prompt: str = "", 
     model: str = "gemini-2.0-flash-exp"
 ) -> AsyncGenerator[str, None]:
@@ -227,14 +344,9 @@ async def call_gemini_api(
 
         if context:
             for h in context:
-                user_message_ctx = h["user_message"]
-                if h.get("file_content"):
-                    user_message_ctx = (
-                        f"FileContent:\n{h['file_content']}\n\nQuestion: {h['user_message']}"
-                    )
-                chat_history.append({"role": "user", "parts": [user_message_ctx]})
-                if h.get("assistant_message") and h["assistant_message"] != "":
-                    chat_history.append({"role": "model", "parts": [h["assistant_message"]]})
+                chat_history.append({"role": "user", "parts": [h.user_content()]})
+                if h.assistant_message:
+                    chat_history.append({"role": "model", "parts": [h.assistant_message]})
         
         # Add the current user message to the chat history
         chat_history.append({"role": "user", "parts": [message]})
@@ -262,7 +374,7 @@ async def call_gemini_api(
 
 async def call_openrouter_api(
     message: str,
-    context: list = [],
+    context: List[schemas.ContextMessage] = [],
     prompt: str = "",
     model: str = "deepseek/deepseek-chat-v3-0324:free",
     temperature: float = 0.7,
@@ -285,15 +397,9 @@ async def call_openrouter_api(
             messages.append(HumanMessage(content=message))
         else:
             for h in context:
-                user_message = h["user_message"]
-                if h.get("file_content"):
-                    user_message = (
-                        f"FileContent:\n{h['file_content']}\n\nQuestion: {h['user_message']}"
-                    )
-
-                messages.append(HumanMessage(content=user_message))
-                if h.get("assistant_message") and h["assistant_message"] != "":
-                    messages.append(AIMessage(content=h["assistant_message"]))
+                messages.append(HumanMessage(content=h.user_content()))
+                if h.assistant_message:
+                    messages.append(AIMessage(content=h.assistant_message))
 
         messages.append(HumanMessage(content=message))
         logger.info(f"User: {message}")
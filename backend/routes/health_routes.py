@@ -1,7 +1,10 @@
 from datetime import datetime
 from fastapi import APIRouter
 from sqlalchemy import text
-from database import engine
+from database import engine, read_engine, write_queue
+from utils.db_pool import get_pool_stats
+from utils.read_routing import replica_router
+from utils.session_cache import session_cache
 
 
 router = APIRouter()
@@ -25,3 +28,21 @@ async def db_activity():
         return {"status": "ok", "message": "Database connection active", "timestamp": datetime.now().isoformat()}
     except Exception as e:
         return {"status": "error", "message": str(e), "timestamp": datetime.now().isoformat()}
+
+@router.get("/db-pool")
+async def db_pool_stats():
+    """
+    連線池統計端點 - 用於依 worker 數量調整連線池大小
+
+    返回使用中/閒置/溢出的連線數與取得連線的等待時間直方圖；
+    SQLite 正式環境另外返回寫入佇列的批次大小與 commit 耗時；
+    session_cache 為對話記錄快取的命中率與記憶體用量
+    """
+    stats = {"primary": get_pool_stats(engine), "timestamp": datetime.now().isoformat()}
+    if read_engine is not engine:
+        stats["replica"] = get_pool_stats(read_engine)
+        stats["replica_routing"] = replica_router.get_stats()
+    if write_queue is not None:
+        stats["sqlite_writer"] = write_queue.get_stats()
+    stats["session_cache"] = session_cache.get_stats()
+    return stats
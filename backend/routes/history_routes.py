@@ -1,15 +1,29 @@
 import models
 import schemas
 import logging
-from typing import List, Optional
-from sqlalchemy import desc, func, text
+from typing import List, Optional, Union
+from datetime import date, datetime
+from sqlalchemy import desc, func, select, text, and_, or_
 from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from uuid import UUID
 
-from utils.dependencies import get_db
+from database import SessionLocal
+from utils.dependencies import get_read_db
+from utils.read_routing import replica_router, write_keys
 from utils.logging import setup_logging
+from utils.pagination import encode_cursor, decode_cursor, InvalidCursorError
+from utils.chat_search import search_chats
+from utils.chat_sessions import PREVIEW_LENGTH, session_version
+from utils.session_cache import session_cache
+from utils.etag import make_etag, etag_matches, not_modified, set_etag
+from utils.chat_export import EXPORT_COLUMNS, build_export_query, stream_export
+from utils.json_codec import FastJSONResponse, chats_to_list
+from utils.chat_import import import_byte_stream
+from utils.chat_archive import load_archived_turns
+from utils.usage_rollup import get_usage_stats
 
 
 setup_logging()
@@ -20,16 +34,26 @@ router = APIRouter()
 # 新增分頁響應模型
 class PaginatedChatHistory(BaseModel):
     items: List[schemas.ChatHistory]
-    total: int
-    page: int
+    total: Optional[int] = None
+    page: Optional[int] = None
     limit: int
     has_more: bool
+    next_cursor: Optional[str] = None
+
+class PaginatedSessionPreview(BaseModel):
+    items: List[schemas.SessionPreview]
+    total: Optional[int] = None
+    page: Optional[int] = None
+    limit: int
+    has_more: bool
+    next_cursor: Optional[str] = None
 
 @router.get("/session/{session_id}", response_model=List[schemas.ChatHistory])
 def read_session_chat_history(
-    session_id: str,
+    session_id: UUID,
+    request: Request,
     user_id: Optional[UUID] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     獲取特定 session_id 的所有聊天記錄
@@ -37,87 +61,368 @@ def read_session_chat_history(
     - **session_id**: 聊天 session 的唯一識別碼
     - **user_id**: 可選的用戶ID, 如果提供則只返回該用戶的聊天記錄
     - 返回: 該 session 的所有聊天記錄，按時間順序排列
+    - 支援 If-None-Match，內容未變更時返回 304
+    - 最近的 session 由程序內快取返回（以 session 版本驗證），不需查詢對話
     """
+    version = session_version(db, session_id)
+    etag = make_etag("session", version, user_id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    # 不在 chat_sessions 中的 session 沒有可驗證的版本，不使用快取
+    chats = session_cache.get(session_id, version) if version[0] else None
+    if chats is None:
+        chats = load_session_turns(db, session_id)
+        if version[0]:
+            session_cache.put(session_id, version, chats)
+
+    # 如果提供了 user_id，則只返回該用戶的對話
+    if user_id is not None:
+        chats = [chat for chat in chats if str(chat["user_id"]) == str(user_id)]
+    return history_response(chats, etag)
+
+def load_session_turns(db: Session, session_id: UUID) -> list:
+    """讀取 session 的所有對話（熱表與冷儲存合併），按時間排序"""
     query = (
-        db.query(models.Chat)
+        db.query(*EXPORT_COLUMNS)
         .filter(models.Chat.session_id == session_id)
     )
-    
-    # 如果提供了 user_id，則加入過濾條件
-    if user_id is not None:
-        query = query.filter(models.Chat.user_id == user_id)
-    
-    chats = query.order_by(models.Chat.timestamp).all()
+    chats = chats_to_list(query.order_by(models.Chat.timestamp).all())
+
+    # 已搬移到冷儲存的舊對話，與熱表中的對話合併後返回
+    archived = load_archived_turns(db, session_id)
+    if archived:
+        chats = sorted(chats_to_list(archived) + chats, key=lambda chat: chat["timestamp"])
     return chats
 
-@router.get("/", response_model=PaginatedChatHistory)
+@router.get("/search", response_model=List[schemas.ChatSearchResult])
+def search_chat_history(
+    q: str = Query(..., min_length=1, max_length=200),
+    user_id: Optional[UUID] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """
+    全文檢索聊天記錄
+
+    - **q**: 搜尋字串，以空白分隔的多個詞需同時出現
+    - **user_id**: 可選的用戶ID，只搜尋該用戶的聊天記錄
+    - **start** / **end**: 可選的時間範圍（含 start、不含 end）
+    - **limit**: 返回的最大記錄數量，預設為20
+    - 返回: 依相關性排序的結果，關鍵字以 <mark> 標記
+    - 只搜尋熱表中的對話；已歸檔到冷儲存的對話（見 CHAT_RETENTION_DAYS）不在索引中
+    """
+    results = search_chats(db, q, user_id=user_id, start=start, end=end, limit=limit)
+    logger.info(f"History search executed: term='{q}', user_id={user_id}, count={len(results)}")
+    return results
+
+@router.get("/stats", response_model=schemas.UsageStats)
+def read_usage_stats(
+    user_id: UUID,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    db: Session = Depends(get_read_db)
+):
+    """
+    獲取用戶的用量統計（由每日彙總表提供，不掃描聊天記錄）
+
+    - **user_id**: 用戶ID
+    - **start** / **end**: 可選的日期範圍（含兩端）
+    - 返回: 總輪數、token、錯誤數、平均耗時，以及每日每個模型的明細
+    - 明細的 sessions 是當天第一輪使用該模型的 session 數，當天中途換模型的 session 不會重複計入後來的模型
+    """
+    return get_usage_stats(db, user_id, start, end)
+
+@router.get("/export")
+def export_chat_history(
+    user_id: Optional[UUID] = None,
+    session_id: Optional[UUID] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    compress: Optional[str] = Query(None, pattern="^gzip$")
+):
+    """
+    以 NDJSON 串流匯出聊天記錄（每行一輪對話）
+
+    - **user_id** / **session_id**: 可選的過濾條件
+    - **start** / **end**: 可選的時間範圍（含 start、不含 end）
+    - **compress**: 設為 gzip 時以 gzip 壓縮輸出
+    - 返回: NDJSON 串流，記憶體用量與匯出列數無關；先輸出已歸檔到冷儲存的對話，
+      再輸出熱表中的對話，兩部分各自依時間排序
+    """
+    filters = {"user_id": user_id, "session_id": session_id, "start": start, "end": end}
+    query = build_export_query(**filters)
+    session_factory = replica_router.choose(write_keys(session_id, user_id))
+    logger.info(f"History export started: user_id={user_id}, session_id={session_id}, compress={compress}")
+
+    if compress == "gzip":
+        return StreamingResponse(
+            stream_export(session_factory, query, compress=True, archive_filters=filters),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="chat_history.ndjson.gz"'}
+        )
+    return StreamingResponse(
+        stream_export(session_factory, query, archive_filters=filters),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="chat_history.ndjson"'}
+    )
+
+@router.post("/import")
+async def import_chat_history(request: Request):
+    """
+    匯入 NDJSON 格式的聊天記錄（格式與 /history/export 相同）
+
+    - 請求內容為 NDJSON；設定 Content-Encoding: gzip 時以 gzip 解壓
+    - 已存在的 (session_id, turn_id) 會被略過（包含已歸檔到冷儲存的對話），可重複匯入
+    - 匯入的對話同時計入每日用量彙總（/history/stats）
+    - 受請求大小限制，大量資料請使用 `python -m utils.chat_import`
+    - 返回: 匯入、略過、錯誤的行數與受影響的 session 數量
+    """
+    compressed = request.headers.get("content-encoding", "").lower() == "gzip"
+    result = await import_byte_stream(SessionLocal, request.stream(), compressed=compressed)
+    replica_router.mark_write(key for session_id in result.sessions for key in write_keys(session_id))
+    logger.info(f"History import finished: {result.to_dict()}")
+    return result.to_dict()
+
+@router.get("/", response_model=Union[PaginatedChatHistory, PaginatedSessionPreview])
 def read_chat_history(
+    request: Request,
     skip: int = 0, 
     limit: int = 20,
     user_id: Optional[UUID] = None,
-    db: Session = Depends(get_db)
+    pagination: str = Query("offset", pattern="^(offset|cursor)$"),
+    cursor: Optional[str] = None,
+    include_total: Optional[bool] = None,
+    view: str = Query("full", pattern="^(full|preview)$"),
+    preview_length: int = Query(PREVIEW_LENGTH, ge=1, le=PREVIEW_LENGTH),
+    db: Session = Depends(get_read_db)
 ):
     """
     獲取聊天歷史記錄，按照時間倒序排列並依據 session_id 分組
     
-    - **skip**: 跳過前面的記錄數量
+    - **skip**: 跳過前面的記錄數量（offset 模式）
     - **limit**: 返回的最大記錄數量，預設為20
     - **user_id**: 可選的用戶ID，如果提供則只返回該用戶的聊天記錄
+    - **pagination**: 分頁模式，offset（預設）或 cursor
+    - **cursor**: 上一頁返回的 next_cursor，提供時自動使用 cursor 模式
+    - **include_total**: cursor 模式下是否計算總數，預設為 false（offset 模式一律計算）
+    - **view**: full（預設）返回每個 session 最新一輪的完整對話；
+      preview 只返回 chat_sessions 摘要表中的預覽、對話輪數與時間，適合側邊欄列表
+    - **preview_length**: preview 模式下預覽的最大字元數
     - 返回: 分頁的聊天歷史記錄，包含記錄總數和是否有更多記錄
+    - 支援 If-None-Match，內容未變更時返回 304
     """
-    # 使用子查詢找出每個 session 最新的對話
-    latest_chats_query = (
-        db.query(
-            models.Chat.session_id,
-            func.max(models.Chat.timestamp).label('max_timestamp')
-        )
+    version = history_version(db, user_id)
+    etag = make_etag(
+        "history", version,
+        skip, limit, user_id, pagination, cursor, include_total, view, preview_length
     )
-    
-    # 如果有提供 user_id，則過濾該用戶的聊天記錄
-    if user_id is not None:
-        latest_chats_query = latest_chats_query.filter(models.Chat.user_id == user_id)
-    
-    latest_chats = latest_chats_query.group_by(models.Chat.session_id).subquery()
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-    # 主查詢與子查詢關聯，並按時間倒序排序
-    chats_query = (
-        db.query(models.Chat)
-        .join(
-            latest_chats,
-            (models.Chat.session_id == latest_chats.c.session_id) &
-            (models.Chat.timestamp == latest_chats.c.max_timestamp)
+    # version[0] 為 chat_sessions 的數量，只有 preview 模式的項目與其一一對應
+    total = version[0] if view == "preview" else None
+    if cursor is not None or pagination == "cursor":
+        page = read_chat_history_by_cursor(
+            db, limit, user_id, cursor, bool(include_total), view, preview_length, total=total
         )
-    )
-    
-    # 如果有提供 user_id，在主查詢中也加入過濾
-    if user_id is not None:
-        chats_query = chats_query.filter(models.Chat.user_id == user_id)
-    
+    else:
+        page = read_chat_history_by_offset(db, skip, limit, user_id, view, preview_length, total=total)
+    return history_response(page, etag)
+
+def history_response(content, etag: str) -> FastJSONResponse:
+    """
+    直接以 orjson 序列化查詢結果
+
+    資料來自資料庫、欄位已固定，不再經過 response_model 驗證
+    （response_model 仍保留作為 OpenAPI 文件）。
+    """
+    response = FastJSONResponse(content)
+    set_etag(response, etag)
+    return response
+
+def read_chat_history_by_offset(
+    db: Session,
+    skip: int,
+    limit: int,
+    user_id: Optional[UUID] = None,
+    view: str = "full",
+    preview_length: int = PREVIEW_LENGTH,
+    total: Optional[int] = None
+) -> dict:
+    """
+    以 offset 分頁讀取每個 session 最新一輪的對話（或 session 預覽）
+
+    total 為已知的 session 數量（例如計算 ETag 時已取得），未提供時另外查詢。
+    """
+    # 從 chat_sessions 摘要表取得每個 session 最新一輪的時間，再取回該輪對話
     chats = (
-        chats_query
-        .order_by(desc(models.Chat.timestamp))
+        history_items_query(db, user_id, view, preview_length)
+        .order_by(desc(models.ChatSession.last_timestamp), desc(models.ChatSession.session_id))
         .offset(skip)
         .limit(limit)
         .all()
     )
     
-    # 獲取總記錄數（不同的 session 數量）
-    total_query = db.query(func.count(func.distinct(models.Chat.session_id)))
-    
-    # 如果有提供 user_id，在計數查詢中也加入過濾
-    if user_id is not None:
-        total_query = total_query.filter(models.Chat.user_id == user_id)
-    
-    total_count = total_query.scalar()
+    # 獲取總記錄數（與列表相同條件的 session 數量）
+    total_count = total if total is not None else count_sessions(db, user_id, view)
     
     # 計算是否有更多記錄
     has_more = total_count > skip + limit
     
     # 返回分頁響應
     return {
-        "items": chats,
+        "items": history_items(chats, view),
         "total": total_count,
         "page": skip // limit,
         "limit": limit,
-        "has_more": has_more
+        "has_more": has_more,
+        "next_cursor": None
+    }
+
+def history_version(db: Session, user_id: Optional[UUID] = None) -> tuple:
+    """計算歷史列表的版本（session 數量、最新對話時間與最後更新時間），不讀取對話內容"""
+    query = db.query(
+        func.count(models.ChatSession.session_id),
+        func.max(models.ChatSession.last_timestamp),
+        func.max(models.ChatSession.updated_at)
+    )
+    if user_id is not None:
+        query = query.filter(models.ChatSession.user_id == user_id)
+    return tuple(query.one())
+
+def latest_turn_id():
+    """
+    每個 session 在 chats 熱表中最新一輪的 turn_id（相關子查詢，沿 idx_session_timestamp 取一筆）
+
+    同一時間戳的多輪以 turn_id 決定，每個 session 只對應一輪；
+    對話全部已歸檔的 session 為 NULL。
+    """
+    return (
+        select(models.Chat.turn_id)
+        .where(models.Chat.session_id == models.ChatSession.session_id)
+        .order_by(desc(models.Chat.timestamp), desc(models.Chat.turn_id))
+        .limit(1)
+        .correlate(models.ChatSession)
+        .scalar_subquery()
+    )
+
+def latest_turns_query(db: Session, user_id: Optional[UUID] = None):
+    """
+    返回每個 session 最新一輪對話的查詢（以 chat_sessions 摘要表為索引，只選取輸出的欄位）
+
+    熱表中沒有對話的 session（已全部歸檔）不會出現，count_sessions 以相同條件計算。
+    """
+    query = (
+        db.query(*EXPORT_COLUMNS, models.ChatSession.last_timestamp.label("session_last_timestamp"))
+        .select_from(models.ChatSession)
+        .join(
+            models.Chat,
+            (models.Chat.session_id == models.ChatSession.session_id) &
+            (models.Chat.turn_id == latest_turn_id())
+        )
+    )
+    if user_id is not None:
+        query = query.filter(models.ChatSession.user_id == user_id)
+    return query
+
+def session_previews_query(db: Session, user_id: Optional[UUID] = None, preview_length: int = PREVIEW_LENGTH):
+    """返回 session 預覽的查詢（只讀取 chat_sessions 摘要表，不讀取對話內容）"""
+    def preview(column):
+        if preview_length < PREVIEW_LENGTH:
+            return func.substr(column, 1, preview_length).label(column.key)
+        return column
+
+    query = db.query(
+        models.ChatSession.session_id,
+        models.ChatSession.user_id,
+        models.ChatSession.first_timestamp,
+        models.ChatSession.last_timestamp,
+        models.ChatSession.turn_count,
+        preview(models.ChatSession.last_user_message_preview),
+        preview(models.ChatSession.last_assistant_message_preview)
+    )
+    if user_id is not None:
+        query = query.filter(models.ChatSession.user_id == user_id)
+    return query
+
+def history_items_query(db: Session, user_id: Optional[UUID], view: str, preview_length: int = PREVIEW_LENGTH):
+    if view == "preview":
+        return session_previews_query(db, user_id, preview_length)
+    return latest_turns_query(db, user_id)
+
+def history_items(rows, view: str) -> list:
+    if view == "preview":
+        return [row._asdict() for row in rows]
+    return chats_to_list(rows)
+
+def count_sessions(db: Session, user_id: Optional[UUID] = None, view: str = "full") -> int:
+    """計算列表中的 session 數量（full 模式與 latest_turns_query 相同，只計算熱表中有對話的 session）"""
+    total_query = db.query(func.count(models.ChatSession.session_id))
+    if view != "preview":
+        total_query = total_query.filter(latest_turn_id().isnot(None))
+    if user_id is not None:
+        total_query = total_query.filter(models.ChatSession.user_id == user_id)
+    return total_query.scalar()
+
+def read_chat_history_by_cursor(
+    db: Session,
+    limit: int,
+    user_id: Optional[UUID] = None,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
+    view: str = "full",
+    preview_length: int = PREVIEW_LENGTH,
+    total: Optional[int] = None
+):
+    """
+    以 (最新時間戳, session_id) 為鍵的游標分頁
+
+    直接沿著 chat_sessions 的 (user_id, last_timestamp, session_id) 索引從游標位置往下讀取，
+    每頁的成本與頁數深度無關。
+    """
+    query = history_items_query(db, user_id, view, preview_length)
+
+    if cursor is not None:
+        try:
+            cursor_timestamp, cursor_session_id = decode_cursor(cursor)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.filter(
+            models.ChatSession.last_timestamp <= cursor_timestamp,
+            or_(
+                models.ChatSession.last_timestamp < cursor_timestamp,
+                and_(
+                    models.ChatSession.last_timestamp == cursor_timestamp,
+                    models.ChatSession.session_id < cursor_session_id
+                )
+            )
+        )
+
+    # 多取一筆以判斷是否還有下一頁
+    rows = (
+        query
+        .order_by(desc(models.ChatSession.last_timestamp), desc(models.ChatSession.session_id))
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    chats = rows[:limit]
+
+    next_cursor = None
+    if has_more and chats:
+        last = chats[-1]
+        next_cursor = encode_cursor(
+            last.last_timestamp if view == "preview" else last.session_last_timestamp, last.session_id
+        )
+
+    return {
+        "items": history_items(chats, view),
+        "total": (total if total is not None else count_sessions(db, user_id, view)) if include_total else None,
+        "page": None,
+        "limit": limit,
+        "has_more": has_more,
+        "next_cursor": next_cursor
     }
@@ -1,43 +1,25 @@
 import os
 import uuid
 import shutil
-import hashlib
 from typing import List, Optional, Dict, Any, Union
 from datetime import datetime, timezone, timedelta
-from fastapi import APIRouter, Query, HTTPException, status, Body, Depends
+from fastapi import APIRouter, Query, HTTPException, status, Body, Depends, Request
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from utils.vectordb.chromadb_connecter import ChromaDBConnecter
+from utils.vectordb.client_registry import client_registry
+from utils.vectordb.embedding import embedding_service
+from utils.vectordb.embedding_cache import embedding_cache
+from utils.vectordb.executor import VectorExecutorBusy, busy_exception, vector_executor
+from utils.vectordb.chunking import validate_chunk_params
+from utils.vectordb.hashing import deterministic_uuid
+from utils.vectordb.ingest import IngestOptions, IngestTooLarge, ingest_byte_stream
 from utils.backend_logger import BackendLogger
-from models import Chat
+from models import ChatSession
 from utils.dependencies import get_db
 
 router = APIRouter()
 backend_logger = BackendLogger().logger
 
-def deterministic_uuid(content: Union[str, bytes]) -> str:
-    """Creates deterministic UUID on hash value of string or byte content.
-
-    Args:
-        content: String or byte representation of data.
-
-    Returns:
-        UUID of the content.
-    """
-    if isinstance(content, str):
-        content_bytes = content.encode("utf-8")
-    elif isinstance(content, bytes):
-        content_bytes = content
-    else:
-        raise ValueError(f"Content type {type(content)} not supported !")
-
-    hash_object = hashlib.sha256(content_bytes)
-    hash_hex = hash_object.hexdigest()
-    namespace = uuid.UUID("00000000-0000-0000-0000-000000000000")
-    content_uuid = str(uuid.uuid5(namespace, hash_hex))
-
-    return content_uuid
-
 def get_db_path(session_id: uuid.UUID) -> str:
     """獲取向量數據庫路徑並確保目錄存在
 
@@ -57,16 +39,21 @@ async def init_vectordb(session_id: uuid.UUID):
     """
     初始化向量數據庫
     """
+    def init(path: str) -> None:
+        collection_name = "documents"
+        with client_registry.acquire(path, ChromaDBConnecter) as connecter:
+            connecter.create_collection(name=collection_name)
+
     try:
         path = get_db_path(session_id)
-        connecter = ChromaDBConnecter(path)
-        collection_name = "documents"
-        connecter.create_collection(name=collection_name)
+        await vector_executor.run(init, path)
 
         backend_logger.info(f"Init VectorDB for session: {session_id}")
         
         return {"status": "success", "message": f"Init VectorDB at {path}"}
 
+    except VectorExecutorBusy as e:
+        raise busy_exception(e)
     except Exception as e:
         backend_logger.error(f"Error initializing VectorDB: {e}")
         raise HTTPException(
@@ -81,10 +68,16 @@ async def add_documents(
     document_id: Optional[str] = Body(None),
     chunk_size: int = Body(1000), 
     chunk_overlap: int = Body(200),
+    chunk_unit: str = Body("chars", pattern="^(chars|tokens)$"),
     type: str = Body("txt")
 ):
     """
     添加數據到向量數據庫
+
+    相同 document_id 的文件會被取代：只嵌入內容改變的區塊並刪除不再存在的區塊。
+    未指定 document_id 時以完整內容的雜湊作為 ID，因此編輯後的內容會成為另一份文件，
+    舊的區塊不會被取代；需要增量更新時，請在下次更新時傳入回應中的 document_id。
+    寫入失敗（任何區塊新增失敗）時返回 500，文件原有的區塊保留不變。
     """
     if not document:
         backend_logger.warning(f"Document cannot be empty for session: {session_id}")
@@ -92,22 +85,28 @@ async def add_documents(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Document cannot be empty for session: {session_id}"
         )
+    try:
+        validate_chunk_params(chunk_size, chunk_overlap, chunk_unit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
         
+    def add(path: str, document_id: str) -> bool:
+        # 分塊、嵌入推論與寫入都在向量執行緒池中進行，不阻塞其他請求的串流
+        collection_name = "documents"
+        with client_registry.acquire(path, ChromaDBConnecter) as connecter:
+            return connecter.add_document_with_chunking(collection_name, document, document_id,
+                                                       chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                                       metadata={"source": "API", "type": type}, chunk_unit=chunk_unit)
+
     try:
         path = get_db_path(session_id)
-        connecter = ChromaDBConnecter(path)
-        collection_name = "documents"
 
-        document_id = document_id or deterministic_uuid(document[:10])
+        document_id = document_id or deterministic_uuid(document)
 
-        connecter.add_document_with_chunking(collection_name, document, document_id,
-                                            chunk_size=chunk_size, chunk_overlap=chunk_overlap,
-                                            metadata={"source": "API", "type": type})
-        
-        backend_logger.info(f"Add documents to VectorDB | session: {session_id} | document_id: {document_id} | chunk_size: {chunk_size} | chunk_overlap: {chunk_overlap}")
-        
-        return {"status": "success", "message": f"Add documents to VectorDB | session: {session_id} | document_id: {document_id} | chunk_size: {chunk_size} | chunk_overlap: {chunk_overlap}"}
+        added = await vector_executor.run(add, path, document_id)
 
+    except VectorExecutorBusy as e:
+        raise busy_exception(e)
     except Exception as e:
         backend_logger.error(f"Failed to add document to VectorDB: {str(e)}")
         raise HTTPException(
@@ -115,6 +114,64 @@ async def add_documents(
             detail=f"Failed to add document to VectorDB: {str(e)}"
         )
 
+    if not added:
+        backend_logger.error(f"Failed to add document to VectorDB | session: {session_id} | document_id: {document_id}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to add document to VectorDB: document_id {document_id}"
+        )
+
+    backend_logger.info(f"Add documents to VectorDB | session: {session_id} | document_id: {document_id} | chunk_size: {chunk_size} | chunk_overlap: {chunk_overlap}")
+
+    return {
+        "status": "success",
+        "document_id": document_id,
+        "message": f"Add documents to VectorDB | session: {session_id} | document_id: {document_id} | chunk_size: {chunk_size} | chunk_overlap: {chunk_overlap}"
+    }
+
+@router.post("/ingest")
+async def ingest_documents(
+    request: Request,
+    session_id: uuid.UUID,
+    chunk_size: int = Query(1000, gt=0, description="每個文本塊的字符數"),
+    chunk_overlap: int = Query(200, ge=0, description="連續文本塊重疊的字符數"),
+    chunk_unit: str = Query("chars", pattern="^(chars|tokens)$", description="分塊大小的單位：字符數或估算的 token 數"),
+    type: str = Query("txt", description="文件未指定 type 時使用的類型")
+):
+    """
+    以 NDJSON 批次添加多份文件到向量數據庫
+
+    - 請求內容每行一份文件：{"document": "...", "document_id": "...", "type": "txt"}，
+      document_id 未指定時以完整內容的雜湊產生；設定 Content-Encoding: gzip 時以 gzip 解壓
+    - 邊接收邊分塊，多份文件的區塊合併為大批進行嵌入推論與寫入，記憶體用量與上傳大小無關
+    - 上傳大小上限為 INGEST_MAX_BYTES（不受全域 10MB 限制），超過時返回 413，已完成的批次保留
+    - 返回: 每份文件（依行號）的結果與區塊數，單份文件失敗不影響其他文件
+    """
+    try:
+        validate_chunk_params(chunk_size, chunk_overlap, chunk_unit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    compressed = request.headers.get("content-encoding", "").lower() == "gzip"
+    options = IngestOptions(chunk_size=chunk_size, chunk_overlap=chunk_overlap, chunk_unit=chunk_unit, type=type)
+    try:
+        path = get_db_path(session_id)
+        result = (await ingest_byte_stream(path, request.stream(), options, compressed=compressed)).to_dict()
+
+        backend_logger.info(f"Ingest documents to VectorDB | session: {session_id} | documents: {result['documents']} | failed: {result['failed']} | chunks: {result['chunks']}")
+
+        return {"status": "success", **result}
+
+    except VectorExecutorBusy as e:
+        raise busy_exception(e)
+    except IngestTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except Exception as e:
+        backend_logger.error(f"Failed to ingest documents to VectorDB: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to ingest documents to VectorDB: {str(e)}"
+        )
+
 @router.get("/retrieve")
 async def retrieve_documents(
     session_id: uuid.UUID,
@@ -137,15 +194,17 @@ async def retrieve_documents(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"VectorDB not found for session: {session_id}"
         )
-    try:            
-        connecter = ChromaDBConnecter(path)
+    def retrieve() -> Optional[Dict[str, Any]]:
         collection_name = "documents"
-        
-        results = connecter.retrieve_similar_documents(
-            collection_name=collection_name,
-            query=query,
-            n_results=n_results
-        )
+        with client_registry.acquire(path, ChromaDBConnecter) as connecter:
+            return connecter.retrieve_similar_documents(
+                collection_name=collection_name,
+                query=query,
+                n_results=n_results
+            )
+
+    try:            
+        results = await vector_executor.run(retrieve)
         
         backend_logger.info(f"Retrieved documents from VectorDB | session: {session_id} | query: {query[:50]}")
         
@@ -155,6 +214,8 @@ async def retrieve_documents(
             "count": len(results)
         }
         
+    except VectorExecutorBusy as e:
+        raise busy_exception(e)
     except Exception as e:
         backend_logger.error(f"Failed to retrieve documents: {str(e)}")
         raise HTTPException(
@@ -174,14 +235,20 @@ async def delete_collection(session_id: uuid.UUID):
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"VectorDB not found for session: {session_id}"
         )
-    try:
-        
+    def delete() -> None:
+        # 先關閉開啟中的客戶端，避免之後重新建立時沿用已刪除檔案的連線
+        client_registry.invalidate(path)
         shutil.rmtree(path)
+
+    try:
+        await vector_executor.run(delete)
         
         backend_logger.info(f"Deleted VectorDB | session: {session_id}")
         
         return {"status": "success", "message": f"Deleted VectorDB for session: {session_id}"}
     
+    except VectorExecutorBusy as e:
+        raise busy_exception(e)
     except Exception as e:
         backend_logger.error(f"Failed to delete vector database: {str(e)}")
         raise HTTPException(
@@ -197,27 +264,42 @@ async def cleanup_old_sessions(db: Session = Depends(get_db)):
     cutoff_date = datetime.now(timezone.utc) - timedelta(days=5)
     try:
         # 查詢session_id，最新聊天時間早於cutoff_date
-        subquery = (
-            db.query(Chat.session_id, func.max(Chat.timestamp).label("last_timestamp"))
-            .group_by(Chat.session_id)
-            .subquery()
-        )
         old_sessions = (
-            db.query(subquery.c.session_id)
-            .filter(subquery.c.last_timestamp < cutoff_date)
+            db.query(ChatSession.session_id)
+            .filter(ChatSession.last_timestamp < cutoff_date)
             .all()
         )
-        deleted_sessions = []
-        for (session_id,) in old_sessions:
-            path = f"./data/chromadb_data/{session_id}"
-            if os.path.exists(path):
-                shutil.rmtree(path)
-                deleted_sessions.append(str(session_id))
-                backend_logger.info(f"Deleted VectorDB for old session: {session_id}")
+        def cleanup() -> List[str]:
+            deleted_sessions = []
+            for (session_id,) in old_sessions:
+                path = f"./data/chromadb_data/{session_id}"
+                if os.path.exists(path):
+                    client_registry.invalidate(path)
+                    shutil.rmtree(path)
+                    deleted_sessions.append(str(session_id))
+                    backend_logger.info(f"Deleted VectorDB for old session: {session_id}")
+            return deleted_sessions
+
+        deleted_sessions = await vector_executor.run(cleanup)
         return {"status": "success", "deleted_sessions": deleted_sessions}
+    except VectorExecutorBusy as e:
+        raise busy_exception(e)
     except Exception as e:
         backend_logger.error(f"Failed to cleanup old sessions: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to cleanup old sessions: {str(e)}"
         )
+
+@router.get("/stats")
+async def vectordb_stats():
+    """
+    向量數據庫統計 - 開啟中的客戶端數量、估計記憶體用量與命中率，
+    以及嵌入模型的載入耗時、每批推論耗時、嵌入快取命中率與向量執行緒池的排隊狀況
+    """
+    return {
+        "clients": client_registry.get_stats(),
+        "embedding": embedding_service.get_stats(),
+        "embedding_cache": embedding_cache.get_stats(),
+        "executor": vector_executor.get_stats(),
+    }
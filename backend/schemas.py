@@ -1,6 +1,6 @@
 # schemas.py
-from pydantic import BaseModel, ConfigDict
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from datetime import date, datetime
 from uuid import UUID
 from typing import Optional, List
 
@@ -9,10 +9,40 @@ class ImageData(BaseModel):
     name: str
     type: str
 
+# 上下文的大小限制：請求只解析與驗證一次，超過限制直接返回 422
+MAX_CONTEXT_MESSAGES = 200
+MAX_CONTEXT_MESSAGE_CHARS = 100_000
+MAX_FILE_CONTENT_CHARS = 1_000_000
+
+class ContextMessage(BaseModel):
+    """上下文中的一輪對話（前端送出的格式）"""
+    user_message: str = Field("", max_length=MAX_CONTEXT_MESSAGE_CHARS)
+    assistant_message: str = Field("", max_length=MAX_CONTEXT_MESSAGE_CHARS)
+    file_content: str = Field("", max_length=MAX_FILE_CONTENT_CHARS)
+
+    @field_validator("user_message", "assistant_message", "file_content", mode="before")
+    @classmethod
+    def _none_as_empty(cls, value):
+        return "" if value is None else value
+
+    def user_content(self) -> str:
+        """送給模型的使用者訊息（附加檔案內容時放在問題前面）"""
+        if self.file_content:
+            return f"FileContent:\n{self.file_content}\n\nQuestion: {self.user_message}"
+        return self.user_message
+
+class RetrievalOptions(BaseModel):
+    enabled: bool = True
+    collection_name: str = "documents"
+    n_chunks_per_doc: int = Field(5, ge=1, le=20)
+    max_docs: int = Field(3, ge=1, le=10)
+    max_tokens: int = Field(1500, ge=0, le=8000)  # 注入提示詞的參考資料 token 預算
+    timeout: float = Field(2.0, gt=0, le=10.0)  # 檢索的硬性逾時（秒）
+
 class ChatRequest(BaseModel):
     session_id: UUID
     message: str
-    context: list = []
+    context: List[ContextMessage] = Field(default_factory=list, max_length=MAX_CONTEXT_MESSAGES)
     model: str = "gpt-4o-mini"
     temperature: float = 0.7
     max_tokens: int = 1000
@@ -20,6 +50,7 @@ class ChatRequest(BaseModel):
     api_type: str = "openai"
     user_id: UUID | None = None
     images: Optional[List[ImageData]] = None
+    retrieval: Optional[RetrievalOptions] = None
 
 class ChatResponse(BaseModel):
     turn_id: UUID
@@ -30,6 +61,44 @@ class ChatResponse(BaseModel):
         from_attributes=True
     )
 
+class ChatSearchResult(BaseModel):
+    session_id: UUID
+    turn_id: UUID
+    user_id: UUID | None = None
+    timestamp: datetime
+    rank: float
+    user_snippet: str
+    assistant_snippet: str
+
+class UsageDay(BaseModel):
+    day: date
+    model: str
+    turns: int
+    sessions: int
+    tokens: int
+    errors: int
+    avg_latency_ms: float
+
+class UsageStats(BaseModel):
+    user_id: UUID
+    total_turns: int
+    total_tokens: int
+    total_errors: int
+    avg_latency_ms: float
+    today_turns: int
+    latest_activity: datetime | None = None
+    days: List[UsageDay]
+
+class SessionPreview(BaseModel):
+    """歷史列表的 session 摘要（只含預覽，完整內容於開啟 session 時讀取）"""
+    session_id: UUID
+    user_id: UUID | None = None
+    first_timestamp: datetime
+    last_timestamp: datetime
+    turn_count: int
+    last_user_message_preview: str | None = None
+    last_assistant_message_preview: str | None = None
+
 class ChatHistory(BaseModel):
     session_id: UUID
     turn_id: UUID
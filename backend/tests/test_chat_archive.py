@@ -0,0 +1,140 @@
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from fastapi import status
+
+import models
+from main import app
+from database import SessionLocal
+from utils import chat_archive
+from utils.chat_archive import archive_cold_turns, load_archived_turns, compress_frame, decompress_frame
+from utils.chat_sessions import rebuild_chat_sessions
+from utils.database_optimizations import ChatQueryOptimizer
+
+client = TestClient(app)
+
+OLD_TURNS = 5
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(chat_archive, "ARCHIVE_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def old_session():
+    """建立一個有多輪舊對話、且最新一輪也很舊的 session"""
+    session_id = uuid.uuid4()
+    user_id = uuid.uuid4()
+    db = SessionLocal()
+    base_time = datetime.now() - timedelta(days=400)
+    for t in range(OLD_TURNS + 1):
+        db.add(models.Chat(
+            session_id=session_id,
+            turn_id=uuid.uuid4(),
+            user_id=user_id,
+            user_message=f"old question {t}",
+            assistant_message=f"old answer {t}",
+            timestamp=base_time + timedelta(minutes=t)
+        ))
+    db.commit()
+    rebuild_chat_sessions(db, [session_id])
+
+    yield {"session_id": session_id, "user_id": user_id}
+
+    db.query(models.Chat).filter(models.Chat.session_id == session_id).delete()
+    db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).delete()
+    db.query(models.ChatArchive).filter(models.ChatArchive.session_id == session_id).delete()
+    db.commit()
+    db.close()
+
+
+class TestChatArchive:
+    def test_archive_moves_cold_turns_but_keeps_latest(self, old_session, archive_dir):
+        db = SessionLocal()
+        result = archive_cold_turns(db, datetime.now() - timedelta(days=30))
+
+        assert result["turns"] >= OLD_TURNS
+        hot = db.query(models.Chat).filter(models.Chat.session_id == old_session["session_id"]).all()
+        assert [chat.user_message for chat in hot] == [f"old question {OLD_TURNS}"]
+
+        archived = load_archived_turns(db, old_session["session_id"])
+        assert [turn["user_message"] for turn in archived] == [f"old question {t}" for t in range(OLD_TURNS)]
+
+        # 再次執行時沒有可歸檔的資料
+        assert archive_cold_turns(db, datetime.now() - timedelta(days=30))["turns"] == 0
+        db.close()
+
+    def test_session_history_reads_archive(self, old_session, archive_dir):
+        """測試讀取 session 時透明合併冷儲存與熱表的對話"""
+        db = SessionLocal()
+        archive_cold_turns(db, datetime.now() - timedelta(days=30))
+        db.close()
+
+        response = client.get(f"/history/session/{old_session['session_id']}")
+
+        assert response.status_code == status.HTTP_200_OK
+        messages = [chat["user_message"] for chat in response.json()]
+        assert messages == [f"old question {t}" for t in range(OLD_TURNS + 1)]
+
+        # 歷史列表仍可看到此 session
+        response = client.get("/history/", params={"user_id": str(old_session["user_id"])})
+        assert response.json()["total"] == 1
+
+    def test_concurrent_archive_does_not_duplicate(self, old_session, archive_dir, monkeypatch):
+        """測試兩個 worker 同時歸檔同一批 session 時，冷儲存中不會出現重複的對話"""
+        cutoff = datetime.now() - timedelta(days=30)
+        original = chat_archive.compress_frame
+        raced = []
+
+        def racing_compress(data):
+            # 第一個 worker 寫入檔案時，另一個 worker 完成了同一批的歸檔
+            if not raced:
+                raced.append(True)
+                other = SessionLocal()
+                archive_cold_turns(other, cutoff)
+                other.close()
+            return original(data)
+
+        monkeypatch.setattr(chat_archive, "compress_frame", racing_compress)
+        db = SessionLocal()
+        archive_cold_turns(db, cutoff)
+        archived = load_archived_turns(db, old_session["session_id"])
+        db.close()
+
+        assert [turn["user_message"] for turn in archived] == [f"old question {t}" for t in range(OLD_TURNS)]
+
+    def test_archived_turns_in_other_read_paths(self, old_session, archive_dir):
+        """測試匯出、查詢優化器與摘要重建都包含已歸檔的對話"""
+        db = SessionLocal()
+        archive_cold_turns(db, datetime.now() - timedelta(days=30))
+        rebuild_chat_sessions(db, [old_session["session_id"]])
+        summary = db.query(models.ChatSession).filter(
+            models.ChatSession.session_id == old_session["session_id"]
+        ).one()
+        history = ChatQueryOptimizer.get_session_history(db, old_session["session_id"])
+        db.close()
+
+        assert summary.turn_count == OLD_TURNS + 1
+        assert summary.last_user_message_preview == f"old question {OLD_TURNS}"
+        assert [chat.user_message for chat in history] == [f"old question {t}" for t in range(OLD_TURNS + 1)]
+
+        response = client.get("/history/export", params={"session_id": str(old_session["session_id"])})
+        assert response.status_code == status.HTTP_200_OK
+        exported = [line for line in response.text.splitlines() if line]
+        assert len(exported) == OLD_TURNS + 1
+
+    def test_recent_turns_are_not_archived(self, old_session, archive_dir):
+        db = SessionLocal()
+        result = archive_cold_turns(db, datetime.now() - timedelta(days=1000))
+        db.close()
+        assert result["turns"] == 0
+
+    def test_gzip_frames_without_zstandard(self):
+        with patch.object(chat_archive, "zstandard", None):
+            frame = compress_frame(b"line\n")
+            assert frame.startswith(chat_archive.GZIP_MAGIC)
+            assert decompress_frame(frame) == b"line\n"
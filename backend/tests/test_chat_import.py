@@ -0,0 +1,149 @@
+import gzip
+import json
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from fastapi import status
+
+import models
+from main import app
+from database import SessionLocal
+from utils import chat_archive, chat_import
+from utils.chat_archive import archive_cold_turns
+from utils.chat_import import import_file, import_lines
+
+client = TestClient(app)
+
+
+def make_lines(user_id, n_sessions=3, turns=4):
+    base_time = datetime(2024, 5, 1, 9, 0, 0)
+    lines = []
+    for s in range(n_sessions):
+        session_id = uuid.uuid4()
+        for t in range(turns):
+            lines.append(json.dumps({
+                "session_id": str(session_id),
+                "turn_id": str(uuid.uuid4()),
+                "user_id": str(user_id),
+                "timestamp": (base_time + timedelta(minutes=s * 10 + t)).isoformat(),
+                "user_message": f"匯入問題 {s}-{t}\t含有\n特殊字元",
+                "assistant_message": f"answer {s}-{t}",
+            }, ensure_ascii=False))
+    return lines
+
+
+@pytest.fixture
+def user_id():
+    user_id = uuid.uuid4()
+    yield user_id
+    db = SessionLocal()
+    db.query(models.Chat).filter(models.Chat.user_id == user_id).delete()
+    db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).delete()
+    db.query(models.ChatArchive).filter(models.ChatArchive.user_id == user_id).delete()
+    db.query(models.UserDailyUsage).filter(models.UserDailyUsage.user_id == user_id).delete()
+    db.commit()
+    db.close()
+
+
+class TestChatImport:
+    def test_import_deduplicates_and_builds_summaries(self, user_id):
+        lines = make_lines(user_id)
+        db = SessionLocal()
+        # 重複的行與格式錯誤的行
+        result = import_lines(db, lines + lines[:2] + ["{not json"], batch_size=5)
+
+        assert result.imported == len(lines)
+        assert result.skipped == 2
+        assert result.errors == 1
+
+        again = import_lines(db, lines)
+        assert again.imported == 0
+        assert again.skipped == len(lines)
+
+        summaries = db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).all()
+        db.close()
+        assert len(summaries) == 3
+        assert all(summary.turn_count == 4 for summary in summaries)
+
+    def test_import_updates_usage_rollup(self, user_id):
+        """測試匯入的對話計入每日用量彙總，重複匯入不會重複累加"""
+        lines = make_lines(user_id, n_sessions=2, turns=3)
+        db = SessionLocal()
+        import_lines(db, lines, batch_size=4)
+        import_lines(db, lines)
+        db.close()
+
+        response = client.get("/history/stats", params={"user_id": str(user_id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["total_turns"] == 6
+        assert [(day["day"], day["turns"], day["sessions"]) for day in data["days"]] == [("2024-05-01", 6, 2)]
+
+    def test_reimport_skips_archived_turns(self, user_id, tmp_path, monkeypatch):
+        """測試已歸檔到冷儲存的對話再次匯入時被略過，不會在熱表產生重複"""
+        monkeypatch.setattr(chat_archive, "ARCHIVE_DIR", str(tmp_path))
+        lines = make_lines(user_id, n_sessions=1, turns=4)
+        db = SessionLocal()
+        import_lines(db, lines)
+        archive_cold_turns(db, datetime(2025, 1, 1))
+
+        again = import_lines(db, lines)
+        hot = db.query(models.Chat).filter(models.Chat.user_id == user_id).count()
+        summary = db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).one()
+        db.close()
+
+        assert again.imported == 0
+        assert again.skipped == len(lines)
+        assert hot == 1
+        assert summary.turn_count == len(lines)
+
+    def test_import_file_resumes_from_progress(self, user_id, tmp_path):
+        """測試中斷後以進度檔續傳，已完成的行不會重新處理"""
+        lines = make_lines(user_id)
+        source = tmp_path / "history.ndjson.gz"
+        with gzip.open(source, "wt", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        progress_path = tmp_path / "progress.json"
+        progress_path.write_text(json.dumps({"source": str(source), "line": 8, "imported": 8}))
+
+        db = SessionLocal()
+        progress = import_file(db, str(source), batch_size=3, progress_path=str(progress_path))
+        count = db.query(models.Chat).filter(models.Chat.user_id == user_id).count()
+        db.close()
+
+        assert count == len(lines) - 8
+        assert progress.imported == len(lines)
+        assert json.loads(progress_path.read_text())["line"] == len(lines)
+
+    def test_import_endpoint_round_trip(self, user_id):
+        """測試匯出的內容可以透過匯入端點寫回"""
+        lines = make_lines(user_id, n_sessions=2, turns=2)
+        body = gzip.compress(("\n".join(lines)).encode("utf-8"))
+        response = client.post(
+            "/history/import",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"imported": 4, "skipped": 0, "errors": 0, "sessions": 2}
+
+        exported = client.get("/history/export", params={"user_id": str(user_id)}).text.splitlines()
+        assert sorted(json.loads(line)["user_message"] for line in exported) == \
+            sorted(json.loads(line)["user_message"] for line in lines)
+
+    def test_import_endpoint_bounds_oversized_lines(self, user_id, monkeypatch):
+        """測試高壓縮比的 gzip 內容逐段解壓，超長的行（含結尾沒有換行的行）記為錯誤而不累積"""
+        monkeypatch.setattr(chat_import, "IMPORT_MAX_LINE_BYTES", 1000)
+        monkeypatch.setattr(chat_import, "DECOMPRESS_CHUNK_BYTES", 64)
+        lines = make_lines(user_id, n_sessions=1, turns=2)
+        body = "\n".join([lines[0], "x" * 5_000_000, lines[1], "y" * 5_000_000]).encode("utf-8")
+        response = client.post(
+            "/history/import", content=gzip.compress(body),
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"imported": 2, "skipped": 0, "errors": 2, "sessions": 1}
@@ -0,0 +1,100 @@
+import time
+import uuid
+import pytest
+from unittest.mock import patch
+
+import models
+import schemas
+from database import SessionLocal
+from routes.chat_routes import stream_and_save
+from utils.token_utils import estimate_tokens
+from utils.vectordb.rag import build_retrieval_prompt, merge_prompt
+
+TEST_DOCUMENTS = [
+    {"document_id": "doc1", "content": "第一份文件的內容。" * 50, "relevance": 0.9},
+    {"document_id": "doc2", "content": "Second document content. " * 50, "relevance": 0.5},
+]
+
+
+@pytest.fixture
+def db_session():
+    db = SessionLocal()
+    yield db
+    db.close()
+
+
+def cleanup_session(db, session_id):
+    db.query(models.Chat).filter(models.Chat.session_id == session_id).delete()
+    db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).delete()
+    db.commit()
+
+
+def collect_prompt_api(captured):
+    async def api_call(message, model, temperature, max_tokens, context, prompt, images):
+        captured["prompt"] = prompt
+        yield "ok"
+    return api_call
+
+
+class TestRetrievalPrompt:
+    def test_build_retrieval_prompt_respects_budget(self):
+        """測試參考資料不超過 token 預算"""
+        prompt = build_retrieval_prompt(TEST_DOCUMENTS, max_tokens=100)
+        assert prompt
+        assert estimate_tokens(prompt) <= 100 + 5
+
+    def test_build_retrieval_prompt_empty(self):
+        """測試沒有文件或沒有預算時不注入內容"""
+        assert build_retrieval_prompt([], max_tokens=100) == ""
+        assert build_retrieval_prompt(TEST_DOCUMENTS, max_tokens=0) == ""
+
+    def test_merge_prompt(self):
+        assert merge_prompt("", "") == ""
+        assert merge_prompt("system", "") == "system"
+        assert merge_prompt("", "docs") == "docs"
+        assert merge_prompt("system", "docs") == "system\n\ndocs"
+
+
+class TestStreamWithRetrieval:
+    @pytest.mark.asyncio
+    async def test_retrieved_documents_injected_into_prompt(self, db_session):
+        """測試檢索結果被注入到傳給模型的提示詞中"""
+        captured = {}
+        chat_request = schemas.ChatRequest(
+            session_id=uuid.uuid4(),
+            message="文件在說什麼？",
+            prompt="You are helpful.",
+            retrieval=schemas.RetrievalOptions(max_tokens=200),
+        )
+        with patch("utils.vectordb.rag.retrieve_session_documents", return_value=TEST_DOCUMENTS):
+            chunks = [c async for c in stream_and_save(db_session, chat_request, collect_prompt_api(captured))]
+
+        assert chunks == ["ok"]
+        assert captured["prompt"].startswith("You are helpful.")
+        assert "第一份文件的內容" in captured["prompt"]
+        cleanup_session(db_session, chat_request.session_id)
+
+    @pytest.mark.asyncio
+    async def test_retrieval_timeout_does_not_block_chat(self, db_session):
+        """測試檢索逾時時仍使用原始提示詞繼續對話"""
+        captured = {}
+        chat_request = schemas.ChatRequest(
+            session_id=uuid.uuid4(),
+            message="hello",
+            prompt="You are helpful.",
+            retrieval=schemas.RetrievalOptions(timeout=0.1),
+        )
+
+        def slow_retrieval(*args, **kwargs):
+            time.sleep(0.5)
+            return TEST_DOCUMENTS
+
+        with patch("utils.vectordb.rag.retrieve_session_documents", side_effect=slow_retrieval):
+            start = time.perf_counter()
+            chunks = [c async for c in stream_and_save(db_session, chat_request, collect_prompt_api(captured))]
+            elapsed = time.perf_counter() - start
+
+        assert chunks == ["ok"]
+        assert captured["prompt"] == "You are helpful."
+        assert elapsed < 0.5
+        cleanup_session(db_session, chat_request.session_id)
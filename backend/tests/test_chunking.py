@@ -0,0 +1,75 @@
+import types
+import pytest
+
+from utils.token_utils import estimate_tokens
+from utils.vectordb.chunking import iter_chunks, validate_chunk_params
+
+
+def reassemble(chunks, overlap_lengths):
+    """去除每塊開頭的重疊部分後重組原文"""
+    return chunks[0] + "".join(chunk[overlap:] for chunk, overlap in zip(chunks[1:], overlap_lengths))
+
+
+def overlaps(chunks):
+    result = []
+    for previous, chunk in zip(chunks, chunks[1:]):
+        length = min(len(previous), len(chunk))
+        while length and not previous.endswith(chunk[:length]):
+            length -= 1
+        result.append(length)
+    return result
+
+
+class TestChunking:
+    def test_is_generator_and_short_text_single_chunk(self):
+        chunks = iter_chunks("短文字。", chunk_size=100, chunk_overlap=10)
+        assert isinstance(chunks, types.GeneratorType)
+        assert list(chunks) == ["短文字。"]
+        assert list(iter_chunks("", 100, 10)) == []
+
+    def test_splits_on_cjk_sentence_end(self):
+        text = "這是第一句話，內容比較長一些。" * 3 + "最後一句沒有標點但很長很長很長"
+        chunks = list(iter_chunks(text, chunk_size=40, chunk_overlap=0))
+        assert chunks[0].endswith("。")
+        assert "".join(chunks) == text
+        assert all(len(chunk) <= 40 for chunk in chunks)
+
+    def test_prefers_paragraph_over_sentence(self):
+        text = "First sentence here. " * 2 + "\n\n" + "Second paragraph. Another sentence. More text follows."
+        chunks = list(iter_chunks(text, chunk_size=70, chunk_overlap=0))
+        assert chunks[0].endswith("\n\n")
+        assert "".join(chunks) == text
+
+    def test_latin_sentence_end_requires_whitespace(self):
+        text = "Version 3.11 is used here and more words follow! Then the rest of the text continues on."
+        chunks = list(iter_chunks(text, chunk_size=60, chunk_overlap=0))
+        assert chunks[0] == "Version 3.11 is used here and more words follow! "
+
+    def test_overlap_and_size_limits(self):
+        text = "".join(f"這是第 {i} 段用於測試的文字。This is sentence {i} for testing.\n\n" for i in range(200))
+        chunks = list(iter_chunks(text, chunk_size=120, chunk_overlap=30))
+        assert all(len(chunk) <= 120 for chunk in chunks)
+        assert all(chunk[:30] == previous[-30:] for previous, chunk in zip(chunks, chunks[1:]))
+        assert reassemble(chunks, [30] * (len(chunks) - 1)) == text
+
+    def test_hard_cut_without_boundaries(self):
+        text = "x" * 250
+        assert list(iter_chunks(text, chunk_size=100, chunk_overlap=20)) == ["x" * 100, "x" * 100, "x" * 90]
+
+    def test_token_sizing(self):
+        text = "".join(
+            "".join(f"中文內容{i}測試{j}。" for j in range(10)) + "".join(f"English words {i} {j}. " for j in range(10))
+            + "\n\n" for i in range(20)
+        )
+        chunks = list(iter_chunks(text, chunk_size=100, chunk_overlap=10, unit="tokens"))
+        assert all(estimate_tokens(chunk) <= 101 for chunk in chunks)
+        assert max(len(chunk) for chunk in chunks) > 100
+        assert reassemble(chunks, overlaps(chunks)) == text
+
+    @pytest.mark.parametrize("size, overlap, unit", [(0, 0, "chars"), (100, -1, "chars"), (100, 100, "chars"),
+                                                     (100, 150, "chars"), (100, 10, "words")])
+    def test_invalid_params(self, size, overlap, unit):
+        with pytest.raises(ValueError):
+            validate_chunk_params(size, overlap, unit)
+        with pytest.raises(ValueError):
+            next(iter_chunks("text", size, overlap, unit))
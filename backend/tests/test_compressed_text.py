@@ -0,0 +1,117 @@
+import uuid
+import pytest
+from datetime import datetime
+from sqlalchemy import text
+
+import models
+from database import SessionLocal, engine
+from utils import compressed_text
+from utils.compressed_text import (
+    CompressionSettings, compress_text, decompress_text, migrate_messages, HEADER_ZLIB, HEADER_ZSTD
+)
+from utils.chat_search import search_chats
+from utils.chat_sessions import rebuild_chat_sessions
+
+LONG_MESSAGE = "這是一段很長的回答，包含 zebra 關鍵字。" + "Lorem ipsum dolor sit amet. " * 100
+
+
+@pytest.fixture
+def compression_on(monkeypatch):
+    monkeypatch.setattr(compressed_text.compression_settings, "mode", "zlib")
+    monkeypatch.setattr(compressed_text.compression_settings, "min_bytes", 256)
+
+
+@pytest.fixture
+def session_id():
+    session_id = uuid.uuid4()
+    yield session_id
+    db = SessionLocal()
+    db.query(models.Chat).filter(models.Chat.session_id == session_id).delete()
+    db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).delete()
+    db.commit()
+    db.close()
+
+
+def add_chat(session_id, assistant_message):
+    db = SessionLocal()
+    db.add(models.Chat(
+        session_id=session_id,
+        turn_id=uuid.uuid4(),
+        user_message="short question",
+        assistant_message=assistant_message,
+        timestamp=datetime.now()
+    ))
+    db.commit()
+    db.close()
+
+
+def stored_type(session_id):
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT typeof(assistant_message) FROM chats WHERE session_id = :sid"),
+            {"sid": session_id.hex}
+        ).scalar()
+
+
+class TestCompressText:
+    @pytest.mark.parametrize("mode,header", [("zlib", HEADER_ZLIB), ("zstd", HEADER_ZSTD)])
+    def test_round_trip(self, mode, header):
+        settings = CompressionSettings(mode=mode, min_bytes=100)
+        compressed = compress_text(LONG_MESSAGE, settings)
+        assert isinstance(compressed, bytes)
+        assert compressed[0] == header
+        assert len(compressed) < len(LONG_MESSAGE.encode("utf-8"))
+        assert decompress_text(compressed) == LONG_MESSAGE
+
+    def test_small_or_disabled_values_stay_text(self):
+        assert compress_text("short", CompressionSettings(mode="zlib", min_bytes=100)) == "short"
+        assert compress_text(LONG_MESSAGE, CompressionSettings(mode="off")) == LONG_MESSAGE
+        assert decompress_text("legacy text") == "legacy text"
+        assert decompress_text(None) is None
+
+
+    def test_zstd_without_zstandard_falls_back_with_warning(self, monkeypatch):
+        monkeypatch.setenv("CHAT_COMPRESSION", "zstd")
+        monkeypatch.setattr(compressed_text, "zstandard", None)
+        warnings = []
+        monkeypatch.setattr(compressed_text.backend_logger, "warning", warnings.append)
+
+        assert CompressionSettings.from_env().mode == "zlib"
+        assert "zstandard is not installed" in warnings[0]
+
+
+class TestCompressedColumn:
+    def test_compressed_message_is_transparent(self, compression_on, session_id):
+        """測試壓縮儲存的訊息可正常讀取、搜尋並產生摘要預覽"""
+        add_chat(session_id, LONG_MESSAGE)
+        assert stored_type(session_id) == "blob"
+
+        db = SessionLocal()
+        chat = db.query(models.Chat).filter(models.Chat.session_id == session_id).one()
+        assert chat.assistant_message == LONG_MESSAGE
+
+        results = search_chats(db, "zebra 關鍵字")
+        assert [r["session_id"] for r in results] == [session_id]
+        assert "<mark>" in results[0]["assistant_snippet"]
+        # 少於三個字元的詞改用子字串比對
+        assert [r["session_id"] for r in search_chats(db, "zebra 很長")] == [session_id]
+
+        rebuild_chat_sessions(db, [session_id])
+        summary = db.get(models.ChatSession, session_id)
+        assert summary.last_assistant_message_preview == LONG_MESSAGE[:200]
+        db.close()
+
+    def test_migrate_existing_rows(self, monkeypatch, session_id):
+        add_chat(session_id, LONG_MESSAGE)
+        assert stored_type(session_id) == "text"
+
+        monkeypatch.setattr(compressed_text.compression_settings, "mode", "zstd")
+        assert migrate_messages(engine) >= 1
+        assert stored_type(session_id) == "blob"
+
+        db = SessionLocal()
+        assert [r["session_id"] for r in search_chats(db, "zebra")] == [session_id]
+        db.close()
+
+        migrate_messages(engine, decompress=True)
+        assert stored_type(session_id) == "text"
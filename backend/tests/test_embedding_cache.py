@@ -0,0 +1,128 @@
+import uuid
+import numpy as np
+import pytest
+
+from utils.vectordb.chromadb_connecter import ChromaDBConnecter
+from utils.vectordb.embedding_cache import EmbeddingCache, CachedEmbeddingFunction, KEY_BYTES
+from utils.vectordb.hashing import sha256_digest, deterministic_uuid
+
+DIM = 8
+
+
+class CountingEmbedding:
+    """記錄實際推論文字的嵌入函數替身"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, input):
+        self.calls.append(list(input))
+        return [np.full(DIM, len(text), dtype=np.float32) for text in input]
+
+
+def make_cache(tmp_path, entries=100, dtype="float16"):
+    max_bytes = entries * (DIM * np.dtype(dtype).itemsize + KEY_BYTES)
+    return EmbeddingCache(str(tmp_path), "test-model", max_bytes=max_bytes, dtype=dtype)
+
+
+class TestEmbeddingCache:
+    def test_only_missing_chunks_embedded(self, tmp_path):
+        inner = CountingEmbedding()
+        embed = CachedEmbeddingFunction(inner, make_cache(tmp_path))
+
+        first = embed(["alpha", "beta", "alpha"])
+        second = embed(["beta", "gamma!"])
+
+        assert inner.calls == [["alpha", "beta"], ["gamma!"]]
+        assert np.allclose(first[0], 5) and np.allclose(first[2], 5)
+        assert np.allclose(second[0], 4) and np.allclose(second[1], 6)
+        stats = embed.cache.get_stats()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 4, 3)
+        assert stats["hit_rate"] == pytest.approx(1 / 5)
+
+    def test_persisted_across_instances(self, tmp_path):
+        cache = make_cache(tmp_path)
+        cache.put_many([sha256_digest("alpha")], [np.arange(DIM, dtype=np.float32)])
+        cache.flush()
+
+        inner = CountingEmbedding()
+        embed = CachedEmbeddingFunction(inner, make_cache(tmp_path))
+        result = embed(["alpha"])
+        assert inner.calls == []
+        assert np.array_equal(result[0], np.arange(DIM, dtype=np.float32))
+
+        # 容量設定改變時重新建立快取
+        resized = make_cache(tmp_path, entries=50)
+        assert resized.get_many([sha256_digest("alpha")]) == [None]
+
+    def test_clock_eviction_keeps_referenced_entries(self, tmp_path):
+        cache = make_cache(tmp_path, entries=3)
+        keys = [sha256_digest(str(i)) for i in range(4)]
+        vectors = [np.full(DIM, i, dtype=np.float32) for i in range(4)]
+        cache.put_many(keys[:3], vectors[:3])
+        assert cache.get_many([keys[0]])[0] is not None
+
+        cache.put_many([keys[3]], [vectors[3]])
+        found = cache.get_many(keys)
+        assert found[1] is None
+        assert [v[0] for v in (found[0], found[2], found[3])] == [0, 2, 3]
+        stats = cache.get_stats()
+        assert (stats["entries"], stats["capacity"], stats["evictions"]) == (3, 3, 1)
+        assert stats["bytes"] <= stats["max_bytes"]
+
+    def test_overwritten_slot_treated_as_miss(self, tmp_path):
+        cache = make_cache(tmp_path)
+        key = sha256_digest("alpha")
+        cache.put_many([key], [np.ones(DIM, dtype=np.float32)])
+        # 模擬另一個 worker：在寫入前已開啟快取，不知道該槽位已被使用
+        other = make_cache(tmp_path)
+        other.get_many([key])
+        other._free.append(other._index.pop(key))
+        other.put_many([sha256_digest("beta")], [np.zeros(DIM, dtype=np.float32)])
+
+        assert cache.get_many([key]) == [None]
+        assert cache.get_stats()["conflicts"] == 1
+
+    def test_concurrent_creation_reuses_existing_files(self, tmp_path):
+        """測試兩個 worker 都在檔案建立前開啟時，後寫入的一方使用已建立的檔案而不是重新建立"""
+        first, second = make_cache(tmp_path), make_cache(tmp_path)
+        first.get_many([sha256_digest("alpha")])
+        second.get_many([sha256_digest("alpha")])
+
+        first.put_many([sha256_digest("alpha")], [np.ones(DIM, dtype=np.float32)])
+        second.put_many([sha256_digest("beta")], [np.zeros(DIM, dtype=np.float32)])
+
+        assert first.get_many([sha256_digest("alpha")])[0] is not None
+        assert second.get_many([sha256_digest("alpha")])[0] is not None
+        assert (tmp_path / "test-model" / "create.lock").exists()
+
+    def test_queries_not_cached(self, tmp_path):
+        """測試檢索時的查詢向量直接推論，不寫入區塊的嵌入快取"""
+        inner = CountingEmbedding()
+        connecter = ChromaDBConnecter()
+        connecter.embedding_function = CachedEmbeddingFunction(inner, make_cache(tmp_path))
+        name = f"test-{uuid.uuid4().hex}"
+        connecter.create_collection(name)
+        try:
+            assert connecter.add_document_with_chunking(name, "Alpha sentence.", "doc")
+            stored = connecter.embedding_function.cache.get_stats()["entries"]
+            for _ in range(2):
+                results = connecter.retrieve_similar_documents(name, "unique question?", n_results=1)
+                assert results["ids"][0]
+        finally:
+            connecter.client.delete_collection(name)
+
+        assert inner.calls[-2:] == [["unique question?"], ["unique question?"]]
+        assert connecter.embedding_function.cache.get_stats()["entries"] == stored
+
+    def test_disabled_cache_passes_through(self, tmp_path):
+        inner = CountingEmbedding()
+        embed = CachedEmbeddingFunction(inner, EmbeddingCache(str(tmp_path), "test-model", max_bytes=0))
+        embed(["alpha"])
+        embed(["alpha"])
+        assert len(inner.calls) == 2
+        assert not (tmp_path / "test-model").exists()
+
+    def test_document_id_hash_unchanged(self):
+        assert deterministic_uuid("alpha") == deterministic_uuid(b"alpha")
+        assert sha256_digest("alpha").hex() == "8ed3f6ad685b959ead7022518e1af76cd816f8e8ec7ccdda1ed4018e8f2223f8"
@@ -0,0 +1,94 @@
+import threading
+import pytest
+from types import SimpleNamespace
+import numpy as np
+
+from utils.vectordb import embedding as embedding_module
+from utils.vectordb.embedding import EmbeddingService, ThreadLimitedMiniLM, warm_up_embedding
+
+
+class FakeMiniLM:
+    """不需要下載模型的 MiniLM 替身"""
+    loads = 0
+
+    def __init__(self, num_threads):
+        FakeMiniLM.loads += 1
+        self.num_threads = num_threads
+
+    def _download_model_if_not_exists(self):
+        pass
+
+    tokenizer = None
+    model = None
+
+    def __call__(self, input):
+        return [np.ones(4, dtype=np.float32) for _ in input]
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    FakeMiniLM.loads = 0
+    monkeypatch.setattr(embedding_module, "ThreadLimitedMiniLM", FakeMiniLM)
+
+
+class TestEmbeddingService:
+    def test_model_loaded_once_and_batches_recorded(self, fake_model):
+        service = EmbeddingService(num_threads=2)
+        threads = [threading.Thread(target=service, args=(["a", "b"],)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = service.get_stats()
+        assert FakeMiniLM.loads == 1
+        assert stats["loaded"] is True
+        assert stats["num_threads"] == 2
+        assert (stats["batches"], stats["texts"]) == (8, 16)
+        assert stats["load_seconds"] is not None
+        assert stats["batch_median_ms"] <= stats["batch_p95_ms"] <= stats["batch_max_ms"]
+
+    def test_warm_up_not_counted_as_batch(self, fake_model):
+        service = EmbeddingService(num_threads=1)
+        service.warm_up()
+        stats = service.get_stats()
+        assert stats["loaded"] is True
+        assert stats["warmup_ms"] is not None
+        assert stats["batches"] == 0
+
+    def test_warm_up_failure_only_logged(self, monkeypatch):
+        def fail():
+            raise ConnectionError("no network")
+        monkeypatch.setattr(embedding_module.embedding_service, "warm_up", fail)
+        warm_up_embedding()
+
+    def test_onnx_session_uses_configured_threads(self):
+        created = {}
+
+        class Options:
+            pass
+
+        def inference_session(path, providers, sess_options):
+            created.update(path=path, options=sess_options)
+            return "session"
+
+        model = ThreadLimitedMiniLM(num_threads=3)
+        model.ort = SimpleNamespace(
+            SessionOptions=Options, InferenceSession=inference_session,
+            get_available_providers=lambda: ["CPUExecutionProvider"]
+        )
+        assert model.model == "session"
+        assert created["path"].endswith("model.onnx")
+        assert created["options"].intra_op_num_threads == 3
+        assert created["options"].inter_op_num_threads == 1
+
+    def test_default_threads_split_across_workers_and_executor(self, monkeypatch):
+        monkeypatch.setattr(embedding_module.os, "cpu_count", lambda: 16)
+        monkeypatch.setattr(embedding_module, "VECTORDB_WORKERS", 2)
+        monkeypatch.setenv("WEB_CONCURRENCY", "8")
+        monkeypatch.setenv("WORKERS", "4")
+        assert embedding_module.default_num_threads() == 2
+        monkeypatch.delenv("WORKERS")
+        assert embedding_module.default_num_threads() == 1
+        monkeypatch.delenv("WEB_CONCURRENCY")
+        assert embedding_module.default_num_threads() == 8
@@ -0,0 +1,370 @@
+import gzip
+import json
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from fastapi import status
+from sqlalchemy import desc, text
+
+import models
+import schemas
+from main import app
+from database import SessionLocal
+from utils.chat_sessions import rebuild_chat_sessions
+from utils.chat_export import build_export_query, stream_export
+from routes.chat_routes import stream_and_save
+
+client = TestClient(app)
+
+N_SESSIONS = 7
+TURNS_PER_SESSION = 3
+
+
+@pytest.fixture
+def history_data():
+    """建立一位用戶的多個 session，每個 session 有多輪對話"""
+    user_id = uuid.uuid4()
+    db = SessionLocal()
+    base_time = datetime(2024, 1, 1, 12, 0, 0)
+    session_ids = []
+    for s in range(N_SESSIONS):
+        session_id = uuid.uuid4()
+        session_ids.append(session_id)
+        for t in range(TURNS_PER_SESSION):
+            db.add(models.Chat(
+                session_id=session_id,
+                turn_id=uuid.uuid4(),
+                user_id=user_id,
+                user_message=f"question {s}-{t}",
+                assistant_message=f"answer {s}-{t}",
+                timestamp=base_time + timedelta(minutes=s * 10 + t)
+            ))
+    db.commit()
+    rebuild_chat_sessions(db, session_ids)
+
+    yield {"user_id": user_id, "session_ids": session_ids}
+
+    db.query(models.Chat).filter(models.Chat.user_id == user_id).delete()
+    db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).delete()
+    db.commit()
+    db.close()
+
+
+class TestHistoryRoutes:
+    def test_offset_pagination(self, history_data):
+        response = client.get("/history/", params={"user_id": str(history_data["user_id"]), "limit": 5})
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["total"] == N_SESSIONS
+        assert data["page"] == 0
+        assert data["has_more"] is True
+        assert len(data["items"]) == 5
+        # 每個 session 只返回最新的一輪，並按時間倒序
+        assert data["items"][0]["user_message"] == f"question {N_SESSIONS - 1}-{TURNS_PER_SESSION - 1}"
+
+    def test_cursor_pagination_walks_all_sessions(self, history_data):
+        """測試 cursor 模式逐頁取得所有 session，且與 offset 模式順序一致"""
+        params = {"user_id": str(history_data["user_id"]), "limit": 3, "pagination": "cursor"}
+        seen = []
+        response = client.get("/history/", params=params)
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            data = response.json()
+            assert data["total"] is None
+            seen.extend(item["session_id"] for item in data["items"])
+            if not data["has_more"]:
+                assert data["next_cursor"] is None
+                break
+            response = client.get("/history/", params={**params, "cursor": data["next_cursor"]})
+
+        expected = [str(session_id) for session_id in reversed(history_data["session_ids"])]
+        assert seen == expected
+
+    def test_cursor_pagination_include_total(self, history_data):
+        params = {"user_id": str(history_data["user_id"]), "pagination": "cursor", "include_total": True}
+        response = client.get("/history/", params=params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["total"] == N_SESSIONS
+
+    def test_one_row_per_session_and_total_matches_page(self, history_data):
+        """測試最新兩輪時間戳相同時只返回一列，熱表中沒有對話的 session 不列出也不計入總數"""
+        user_id = history_data["user_id"]
+        db = SessionLocal()
+        tied = db.query(models.Chat).filter(models.Chat.session_id == history_data["session_ids"][0]) \
+            .order_by(desc(models.Chat.timestamp)).first()
+        db.add(models.Chat(session_id=tied.session_id, turn_id=uuid.uuid4(), user_id=user_id,
+                           user_message="tie", assistant_message="tie", timestamp=tied.timestamp))
+        # 模擬對話已全部歸檔的 session：只有摘要，熱表中沒有對話
+        archived_time = datetime(2024, 6, 1)
+        db.add(models.ChatSession(session_id=uuid.uuid4(), user_id=user_id, first_timestamp=archived_time,
+                                  last_timestamp=archived_time, turn_count=2, updated_at=archived_time))
+        db.commit()
+        db.close()
+
+        for params in ({"limit": 50}, {"limit": 50, "pagination": "cursor", "include_total": True}):
+            data = client.get("/history/", params={"user_id": str(user_id), **params}).json()
+            session_ids = [item["session_id"] for item in data["items"]]
+            assert len(session_ids) == len(set(session_ids)) == N_SESSIONS
+            assert data["total"] == N_SESSIONS
+
+        # preview 模式只讀取摘要表，包含已歸檔的 session
+        preview = client.get("/history/", params={"user_id": str(user_id), "view": "preview"}).json()
+        assert preview["total"] == len(preview["items"]) == N_SESSIONS + 1
+
+    def test_session_summary_matches_turns(self, history_data):
+        """測試重建後的摘要表包含正確的輪數與預覽"""
+        db = SessionLocal()
+        summary = db.get(models.ChatSession, history_data["session_ids"][2])
+        db.close()
+
+        assert summary.turn_count == TURNS_PER_SESSION
+        assert summary.user_id == history_data["user_id"]
+        assert summary.last_user_message_preview == f"question 2-{TURNS_PER_SESSION - 1}"
+        assert summary.last_timestamp > summary.first_timestamp
+
+    def test_preview_view(self, history_data):
+        """測試 preview 模式只返回摘要欄位，順序與 full 模式一致"""
+        params = {"user_id": str(history_data["user_id"]), "limit": 5}
+        full = client.get("/history/", params=params).json()
+        response = client.get("/history/", params={**params, "view": "preview", "preview_length": 8})
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["total"] == N_SESSIONS
+        assert [item["session_id"] for item in data["items"]] == [item["session_id"] for item in full["items"]]
+        first = data["items"][0]
+        assert "user_message" not in first
+        assert first["turn_count"] == TURNS_PER_SESSION
+        assert first["last_user_message_preview"] == f"question {N_SESSIONS - 1}-{TURNS_PER_SESSION - 1}"[:8]
+        assert first["last_timestamp"] == full["items"][0]["timestamp"]
+
+    def test_preview_view_cursor_pagination(self, history_data):
+        params = {"user_id": str(history_data["user_id"]), "limit": 4, "pagination": "cursor", "view": "preview"}
+        first = client.get("/history/", params=params).json()
+        second = client.get("/history/", params={**params, "cursor": first["next_cursor"]}).json()
+
+        seen = [item["session_id"] for item in first["items"] + second["items"]]
+        assert len(set(seen)) == N_SESSIONS
+        assert second["has_more"] is False
+
+    def test_invalid_cursor(self):
+        response = client.get("/history/", params={"cursor": "not-a-cursor"})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestConditionalGet:
+    def test_session_history_not_modified(self, history_data):
+        """測試 session 未變更時以 If-None-Match 取得 304"""
+        url = f"/history/session/{history_data['session_ids'][0]}"
+        response = client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == TURNS_PER_SESSION
+        etag = response.headers["ETag"]
+
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    def test_session_etag_changes_after_new_turn(self, history_data):
+        session_id = history_data["session_ids"][0]
+        url = f"/history/session/{session_id}"
+        etag = client.get(url).headers["ETag"]
+
+        db = SessionLocal()
+        summary = db.get(models.ChatSession, session_id)
+        summary.turn_count += 1
+        summary.updated_at = datetime.now()
+        db.commit()
+        db.close()
+
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["ETag"] != etag
+
+    def test_history_list_etag_depends_on_params(self, history_data):
+        """測試不同分頁參數產生不同的 ETag"""
+        params = {"user_id": str(history_data["user_id"]), "limit": 3}
+        first_page = client.get("/history/", params=params)
+        etag = first_page.headers["ETag"]
+
+        response = client.get("/history/", params=params, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        response = client.get("/history/", params={**params, "skip": 3}, headers={"If-None-Match": etag})
+        assert response.status_code == status.HTTP_200_OK
+
+
+class TestHistoryExport:
+    def test_export_ndjson_by_user(self, history_data):
+        response = client.get("/history/export", params={"user_id": str(history_data["user_id"])})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert len(rows) == N_SESSIONS * TURNS_PER_SESSION
+        assert rows[0]["user_message"] == "question 0-0"
+        assert [row["timestamp"] for row in rows] == sorted(row["timestamp"] for row in rows)
+
+    def test_export_gzip_with_filters(self, history_data):
+        """測試 gzip 匯出與 session、時間範圍過濾"""
+        params = {
+            "session_id": str(history_data["session_ids"][1]),
+            "start": "2024-01-01T12:11:00",
+            "compress": "gzip",
+        }
+        response = client.get("/history/export", params=params)
+
+        assert response.status_code == status.HTTP_200_OK
+        lines = gzip.decompress(response.content).decode("utf-8").splitlines()
+        assert [json.loads(line)["user_message"] for line in lines] == ["question 1-1", "question 1-2"]
+
+    def test_export_streams_in_batches(self, history_data):
+        """測試匯出依批次大小分段輸出"""
+        query = build_export_query(user_id=history_data["user_id"])
+        chunks = list(stream_export(SessionLocal, query, batch_size=5))
+
+        assert len(chunks) == -(-N_SESSIONS * TURNS_PER_SESSION // 5)
+        assert sum(chunk.count(b"\n") for chunk in chunks) == N_SESSIONS * TURNS_PER_SESSION
+
+
+class TestSessionSummaryMaintenance:
+    @pytest.mark.asyncio
+    async def test_stream_and_save_updates_summary(self):
+        """測試每次寫入對話時增量更新 chat_sessions"""
+        async def api_call(message, model, temperature, max_tokens, context, prompt, images):
+            yield f"reply to {message}"
+
+        session_id = uuid.uuid4()
+        user_id = uuid.uuid4()
+        db = SessionLocal()
+        for message in ["first", "second"]:
+            chat_request = schemas.ChatRequest(session_id=session_id, message=message, user_id=user_id)
+            _ = [chunk async for chunk in stream_and_save(db, chat_request, api_call)]
+
+        summary = db.get(models.ChatSession, session_id)
+        db.refresh(summary)
+        assert summary.turn_count == 2
+        assert summary.user_id == user_id
+        assert summary.last_user_message_preview == "second"
+        assert summary.last_assistant_message_preview == "reply to second"
+
+        db.query(models.Chat).filter(models.Chat.session_id == session_id).delete()
+        db.query(models.ChatSession).filter(models.ChatSession.session_id == session_id).delete()
+        db.query(models.UserDailyUsage).filter(models.UserDailyUsage.user_id == user_id).delete()
+        db.commit()
+        db.close()
+
+
+@pytest.fixture
+def search_data():
+    user_id = uuid.uuid4()
+    other_user_id = uuid.uuid4()
+    db = SessionLocal()
+    rows = [
+        (user_id, "How do I build a partial index in PostgreSQL?", "Use CREATE INDEX ... WHERE.", datetime(2024, 3, 1)),
+        (user_id, "向量資料庫如何做分塊？", "可以依照段落與句號切分文件。", datetime(2024, 3, 2)),
+        (user_id, "unrelated question", "unrelated answer", datetime(2024, 3, 3)),
+        (other_user_id, "Another partial index question", "Same topic.", datetime(2024, 3, 4)),
+    ]
+    for owner, user_message, assistant_message, timestamp in rows:
+        db.add(models.Chat(
+            session_id=uuid.uuid4(),
+            turn_id=uuid.uuid4(),
+            user_id=owner,
+            user_message=user_message,
+            assistant_message=assistant_message,
+            timestamp=timestamp
+        ))
+    db.commit()
+
+    yield {"user_id": user_id, "other_user_id": other_user_id}
+
+    db.query(models.Chat).filter(models.Chat.user_id.in_([user_id, other_user_id])).delete()
+    db.commit()
+    db.close()
+
+
+class TestHistorySearch:
+    def test_search_filters_by_user(self, search_data):
+        response = client.get("/history/search", params={"q": "partial index", "user_id": str(search_data["user_id"])})
+
+        assert response.status_code == status.HTTP_200_OK
+        results = response.json()
+        assert len(results) == 1
+        assert results[0]["user_id"] == str(search_data["user_id"])
+        assert "<mark>" in results[0]["user_snippet"]
+
+    def test_search_cjk_text(self, search_data):
+        response = client.get("/history/search", params={"q": "資料庫", "user_id": str(search_data["user_id"])})
+
+        assert response.status_code == status.HTTP_200_OK
+        results = response.json()
+        assert len(results) == 1
+        assert "<mark>資料庫</mark>" in results[0]["user_snippet"]
+
+    def test_search_short_term_falls_back(self, search_data):
+        """測試少於三個字元的詞仍可搜尋"""
+        response = client.get("/history/search", params={"q": "句號", "user_id": str(search_data["user_id"])})
+
+        assert response.status_code == status.HTTP_200_OK
+        results = response.json()
+        assert len(results) == 1
+        assert "<mark>句號</mark>" in results[0]["assistant_snippet"]
+
+    def test_search_date_range(self, search_data):
+        params = {"q": "partial index", "start": "2024-03-03T00:00:00", "end": "2024-03-05T00:00:00"}
+        response = client.get("/history/search", params=params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [r["user_id"] for r in response.json()] == [str(search_data["other_user_id"])]
+
+    def test_search_index_follows_updates(self, search_data):
+        """測試更新訊息後索引同步更新"""
+        db = SessionLocal()
+        chat = db.query(models.Chat).filter(models.Chat.user_message == "unrelated question").one()
+        chat.assistant_message = "now mentions zebra crossings"
+        db.commit()
+        db.close()
+
+        response = client.get("/history/search", params={"q": "zebra", "user_id": str(search_data["user_id"])})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.json()) == 1
+
+    def test_search_survives_rowid_renumbering(self, search_data):
+        """測試 chats 的隱含 rowid 改變（例如 VACUUM 重新編號）後，檢索結果仍指向正確的對話"""
+        db = SessionLocal()
+        db.execute(text("UPDATE chats SET rowid = rowid + 100000 WHERE user_id = :user_id"),
+                   {"user_id": search_data["user_id"].hex})
+        db.commit()
+        db.close()
+
+        response = client.get("/history/search", params={"q": "資料庫", "user_id": str(search_data["user_id"])})
+
+        assert response.status_code == status.HTTP_200_OK
+        results = response.json()
+        assert len(results) == 1
+        assert "<mark>資料庫</mark>" in results[0]["user_snippet"]
+
+    def test_search_reuses_existing_map_id(self, search_data):
+        """測試寫入對話時對照表已有同一鍵，沿用原本的 FTS id 而不是換成新的 id"""
+        session_id, turn_id = uuid.uuid4(), uuid.uuid4()
+        db = SessionLocal()
+        db.execute(text("INSERT INTO chats_fts_map(id, session_id, turn_id) VALUES (987654, :session_id, :turn_id)"),
+                   {"session_id": session_id.hex, "turn_id": turn_id.hex})
+        db.add(models.Chat(session_id=session_id, turn_id=turn_id, user_id=search_data["user_id"],
+                           user_message="giraffe habitats", assistant_message="savanna", timestamp=datetime(2024, 3, 6)))
+        db.commit()
+        map_ids = db.execute(text("SELECT id FROM chats_fts_map WHERE session_id = :session_id"),
+                             {"session_id": session_id.hex}).scalars().all()
+        db.close()
+
+        assert map_ids == [987654]
+        response = client.get("/history/search", params={"q": "giraffe", "user_id": str(search_data["user_id"])})
+        assert [r["turn_id"] for r in response.json()] == [str(turn_id)]
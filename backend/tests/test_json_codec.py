@@ -0,0 +1,84 @@
+import json
+import uuid
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+import schemas
+from main import app
+from utils import json_codec
+from utils.json_codec import chat_to_dict, dumps, loads
+
+client = TestClient(app)
+
+
+def make_chat(**overrides):
+    values = {
+        "session_id": uuid.uuid4(),
+        "turn_id": uuid.uuid4(),
+        "user_id": None,
+        "user_message": "你好 \"quoted\"\n",
+        "assistant_message": "hello",
+        "timestamp": datetime(2024, 5, 1, 12, 30, 15, 123456),
+    }
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+class TestCodec:
+    def test_fast_path_matches_pydantic_output(self):
+        """測試不經 pydantic 的輸出與 ChatHistory 序列化結果一致"""
+        for chat in (make_chat(), make_chat(user_id=uuid.uuid4(), timestamp=datetime(2024, 5, 1))):
+            expected = json.loads(schemas.ChatHistory.model_validate(chat).model_dump_json())
+            assert loads(dumps(chat_to_dict(chat))) == expected
+
+    def test_stdlib_fallback_produces_same_bytes(self, monkeypatch):
+        payload = {"items": [chat_to_dict(make_chat(user_id=uuid.uuid4()))], "total": 1, "page": None}
+        fast = dumps(payload)
+        monkeypatch.setattr(json_codec, "orjson", None)
+        assert dumps(payload) == fast
+        assert loads(fast) == json.loads(fast)
+
+
+class TestContextSchema:
+    def test_context_parsed_into_messages(self):
+        request = schemas.ChatRequest(
+            session_id=uuid.uuid4(),
+            message="question",
+            context=[
+                {"user_message": "q1", "assistant_message": None},
+                {"user_message": "q2", "assistant_message": "a2", "file_content": "data"},
+            ]
+        )
+        first, second = request.context
+        assert first.assistant_message == ""
+        assert first.user_content() == "q1"
+        assert second.user_content() == "FileContent:\ndata\n\nQuestion: q2"
+
+    def test_context_size_limits(self):
+        with pytest.raises(ValidationError):
+            schemas.ContextMessage(user_message="x" * (schemas.MAX_CONTEXT_MESSAGE_CHARS + 1))
+        with pytest.raises(ValidationError):
+            schemas.ChatRequest(
+                session_id=uuid.uuid4(),
+                message="question",
+                context=[{"user_message": "q"}] * (schemas.MAX_CONTEXT_MESSAGES + 1)
+            )
+
+    def test_invalid_request_rejected_before_streaming(self):
+        """測試以 orjson 解析的請求在格式錯誤或超過限制時返回 422"""
+        response = client.post(
+            "/chat/",
+            content=b'{"session_id": ',
+            headers={"Content-Type": "application/json"}
+        )
+        assert response.status_code == 422
+
+        response = client.post("/chat/", json={
+            "session_id": str(uuid.uuid4()),
+            "message": "question",
+            "context": [{"user_message": "q"}] * (schemas.MAX_CONTEXT_MESSAGES + 1),
+        })
+        assert response.status_code == 422
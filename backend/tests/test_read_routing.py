@@ -0,0 +1,94 @@
+import uuid
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from fastapi.testclient import TestClient
+from fastapi import status
+
+import models
+from main import app
+from database import SessionLocal
+from utils.read_routing import ReplicaRouter, write_keys
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def replica(tmp_path):
+    """以另一個 SQLite 檔案模擬唯讀副本"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def add_chat(session_factory, session_id, message):
+    db = session_factory()
+    db.add(models.Chat(
+        session_id=session_id,
+        turn_id=uuid.uuid4(),
+        user_message=message,
+        assistant_message="answer",
+        timestamp=datetime.now()
+    ))
+    db.commit()
+    db.close()
+
+
+class TestReplicaRouter:
+    def test_without_replica_uses_primary(self):
+        router = ReplicaRouter(primary=SessionLocal)
+        assert router.choose(write_keys(uuid.uuid4())) is SessionLocal
+
+    def test_reads_use_replica_until_write(self, replica):
+        router = ReplicaRouter(primary=SessionLocal, replica=replica)
+        keys = write_keys(uuid.uuid4(), uuid.uuid4())
+
+        assert router.choose(keys) is replica
+        router.mark_write(keys[:1])
+        assert router.choose(keys) is SessionLocal
+        assert router.choose(write_keys(uuid.uuid4())) is replica
+        assert router.choose(consistent=True) is SessionLocal
+
+    def test_read_your_writes_window_expires(self, replica):
+        router = ReplicaRouter(primary=SessionLocal, replica=replica, read_your_writes_seconds=0)
+        keys = write_keys(uuid.uuid4())
+        router.mark_write(keys)
+        assert router.choose(keys) is replica
+
+    def test_fallback_when_replica_lagging(self, replica):
+        router = ReplicaRouter(primary=SessionLocal, replica=replica, max_lag_seconds=5, check_interval=0)
+        with patch.object(router, "measure_lag", return_value=30.0):
+            assert router.choose() is SessionLocal
+        assert router.choose() is replica
+
+    def test_fallback_when_replica_unavailable(self, tmp_path):
+        broken = sessionmaker(bind=create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}"))
+        router = ReplicaRouter(primary=SessionLocal, replica=broken, check_interval=0)
+        assert router.choose() is SessionLocal
+        assert router.get_stats()["replica_healthy"] is False
+
+
+class TestReadRoutingEndpoints:
+    def test_history_reads_follow_router(self, replica):
+        """測試歷史查詢讀取副本，而剛寫入的 session 讀取主資料庫"""
+        session_id = uuid.uuid4()
+        add_chat(replica, session_id, "from replica")
+        add_chat(SessionLocal, session_id, "from primary")
+        router = ReplicaRouter(primary=SessionLocal, replica=replica)
+
+        with patch("utils.read_routing.replica_router", router):
+            response = client.get(f"/history/session/{session_id}")
+            assert response.status_code == status.HTTP_200_OK
+            assert [chat["user_message"] for chat in response.json()] == ["from replica"]
+
+            router.mark_write(write_keys(session_id))
+            response = client.get(f"/history/session/{session_id}")
+            assert [chat["user_message"] for chat in response.json()] == ["from primary"]
+
+        db = SessionLocal()
+        db.query(models.Chat).filter(models.Chat.session_id == session_id).delete()
+        db.commit()
+        db.close()
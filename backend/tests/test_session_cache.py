@@ -0,0 +1,155 @@
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from fastapi import status
+
+import models
+import schemas
+from main import app
+from database import SessionLocal
+from routes.chat_routes import stream_and_save
+from utils.chat_sessions import rebuild_chat_sessions
+from utils.session_cache import SessionHistoryCache, TURN_OVERHEAD_BYTES, estimate_turns_size, session_cache
+
+client = TestClient(app)
+
+
+def make_turn(message: str, minutes: int = 0) -> dict:
+    return {
+        "session_id": uuid.uuid4(),
+        "turn_id": uuid.uuid4(),
+        "user_id": None,
+        "user_message": message,
+        "assistant_message": "",
+        "timestamp": datetime(2024, 1, 1) + timedelta(minutes=minutes),
+    }
+
+
+async def reply_api(message, model, temperature, max_tokens, context, prompt, images):
+    yield f"reply to {message}"
+
+
+@pytest.fixture
+def user_id():
+    user_id = uuid.uuid4()
+    yield user_id
+    db = SessionLocal()
+    db.query(models.Chat).filter(models.Chat.user_id == user_id).delete()
+    db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).delete()
+    db.query(models.UserDailyUsage).filter(models.UserDailyUsage.user_id == user_id).delete()
+    db.commit()
+    db.close()
+
+
+class TestSessionHistoryCache:
+    def test_version_mismatch_and_stats(self):
+        cache = SessionHistoryCache(max_bytes=10_000)
+        session_id = uuid.uuid4()
+        cache.put(session_id, (1, None), [make_turn("a")])
+
+        assert cache.get(session_id, (1, None))[0]["user_message"] == "a"
+        assert cache.get(session_id, (2, None)) is None
+        assert cache.get(session_id, (1, None)) is None
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["stale"], stats["misses"], stats["sessions"]) == (1, 1, 1, 0)
+        assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = SessionHistoryCache(max_bytes=3 * estimate_turns_size([make_turn("x" * 100)]))
+        sessions = [uuid.uuid4() for _ in range(3)]
+        for session_id in sessions:
+            cache.put(session_id, (1, None), [make_turn("x" * 100)])
+        cache.get(sessions[0], (1, None))
+        cache.put(uuid.uuid4(), (1, None), [make_turn("y" * 100)])
+
+        assert cache.get(sessions[1], (1, None)) is None
+        assert cache.get(sessions[0], (1, None)) is not None
+        stats = cache.get_stats()
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= stats["max_bytes"]
+
+    def test_size_counts_string_width(self):
+        """測試中文訊息依實際佔用的位元組估算，而非字元數"""
+        latin = estimate_turns_size([make_turn("x" * 1000)])
+        cjk = estimate_turns_size([make_turn("中" * 1000)])
+        assert latin >= TURN_OVERHEAD_BYTES + 1000
+        assert cjk >= TURN_OVERHEAD_BYTES + 2000
+
+    def test_write_through_only_extends_complete_entries(self):
+        cache = SessionHistoryCache(max_bytes=10_000)
+        session_id = uuid.uuid4()
+        first, second = make_turn("first"), make_turn("second", minutes=1)
+
+        # 新的 session 直接建立快取，之後的寫入依版本接續
+        cache.write_through(session_id, first, (0, None), (1, "t1"))
+        cache.write_through(session_id, second, (1, "t1"), (2, "t2"))
+        cache.write_through(session_id, {**second, "assistant_message": "done"}, (2, "t2"), (2, "t3"))
+        turns = cache.get(session_id, (2, "t3"))
+        assert [(t["user_message"], t["assistant_message"]) for t in turns] == [("first", ""), ("second", "done")]
+
+        # 寫入前的版本與快取不符（其他 worker 寫入過）時移除快取
+        cache.write_through(session_id, make_turn("third", minutes=2), (3, "other"), (4, "t4"))
+        assert cache.get_stats()["sessions"] == 0
+        # 未快取的既有 session 不會以不完整的內容建立快取
+        cache.write_through(session_id, make_turn("fourth", minutes=3), (4, "t4"), (5, "t5"))
+        assert cache.get_stats()["sessions"] == 0
+
+    def test_invalidate_and_disabled_cache(self):
+        cache = SessionHistoryCache(max_bytes=10_000)
+        sessions = [uuid.uuid4() for _ in range(3)]
+        for session_id in sessions:
+            cache.put(session_id, (1, None), [make_turn("a")])
+        cache.invalidate([sessions[0]])
+        assert cache.get_stats()["sessions"] == 2
+        cache.invalidate()
+        assert cache.get_stats()["sessions"] == 0 and cache.get_stats()["bytes"] == 0
+
+        disabled = SessionHistoryCache(max_bytes=0)
+        disabled.put(sessions[0], (1, None), [make_turn("a")])
+        assert disabled.get(sessions[0], (1, None)) is None
+
+
+class TestSessionHistoryCacheRoutes:
+    @pytest.mark.asyncio
+    async def test_written_turns_served_from_cache(self, user_id):
+        """測試 stream_and_save 寫入後開啟 session 直接命中快取，且內容與資料庫一致"""
+        session_id = uuid.uuid4()
+        db = SessionLocal()
+        for message in ["first", "second"]:
+            chat_request = schemas.ChatRequest(session_id=session_id, message=message, user_id=user_id)
+            _ = [chunk async for chunk in stream_and_save(db, chat_request, reply_api)]
+        db.close()
+
+        hits = session_cache.hits
+        response = client.get(f"/history/session/{session_id}", params={"user_id": str(user_id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert session_cache.hits == hits + 1
+        assert [(c["user_message"], c["assistant_message"]) for c in response.json()] == \
+            [("first", "reply to first"), ("second", "reply to second")]
+        assert client.get(f"/history/session/{session_id}", params={"user_id": str(uuid.uuid4())}).json() == []
+
+        session_cache.invalidate([session_id])
+        uncached = client.get(f"/history/session/{session_id}", params={"user_id": str(user_id)})
+        assert uncached.json() == response.json()
+        assert uncached.headers["ETag"] == response.headers["ETag"]
+
+    def test_rebuild_invalidates_cached_session(self, user_id):
+        """測試直接修改資料後重建摘要時移除快取"""
+        session_id = uuid.uuid4()
+        db = SessionLocal()
+        db.add(models.Chat(
+            session_id=session_id, turn_id=uuid.uuid4(), user_id=user_id,
+            user_message="old", assistant_message="answer", timestamp=datetime(2024, 1, 1)
+        ))
+        db.commit()
+        rebuild_chat_sessions(db, [session_id])
+        assert client.get(f"/history/session/{session_id}").json()[0]["user_message"] == "old"
+
+        db.query(models.Chat).filter(models.Chat.session_id == session_id).update({"user_message": "new"})
+        db.commit()
+        rebuild_chat_sessions(db, [session_id])
+        db.close()
+
+        assert client.get(f"/history/session/{session_id}").json()[0]["user_message"] == "new"
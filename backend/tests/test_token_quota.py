@@ -0,0 +1,139 @@
+import uuid
+import pytest
+from unittest.mock import MagicMock, patch
+from fastapi.testclient import TestClient
+from fastapi import status
+
+import models
+from main import app
+from database import SessionLocal
+from utils.token_quota import TokenQuotaManager, TokenQuotaExceeded, token_quota
+from routes import chat_routes
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def user_id():
+    user_id = uuid.uuid4()
+    yield user_id
+    db = SessionLocal()
+    db.query(models.TokenUsage).filter(models.TokenUsage.user_id == user_id).delete()
+    db.commit()
+    db.close()
+
+
+class TestTokenQuotaManager:
+    def test_reserve_within_limit(self, user_id):
+        manager = TokenQuotaManager(window_limit=1000, daily_limit=5000)
+        reservation = manager.reserve(user_id, input_tokens=100, max_output_tokens=200)
+        assert reservation.reserved_tokens == 300
+        assert manager.get_usage(user_id)["reserved_tokens"] == 300
+
+    def test_reserve_exceeds_window_limit(self, user_id):
+        manager = TokenQuotaManager(window_limit=1000, daily_limit=5000)
+        manager.reserve(user_id, input_tokens=400, max_output_tokens=400)
+        with pytest.raises(TokenQuotaExceeded) as exc_info:
+            manager.reserve(user_id, input_tokens=100, max_output_tokens=200)
+        assert exc_info.value.retry_after > 0
+
+    def test_reserve_exceeds_daily_limit(self, user_id):
+        manager = TokenQuotaManager(window_limit=0, daily_limit=500)
+        with pytest.raises(TokenQuotaExceeded):
+            manager.reserve(user_id, input_tokens=400, max_output_tokens=200)
+
+    def test_anonymous_requests_not_limited(self):
+        manager = TokenQuotaManager(window_limit=1, daily_limit=1)
+        reservation = manager.reserve(None, input_tokens=100, max_output_tokens=100)
+        assert reservation.reserved_tokens == 0
+
+    def test_reconcile_persists_across_restart(self, user_id):
+        """測試實際用量寫入資料庫後，新的管理器實例可以恢復用量"""
+        manager = TokenQuotaManager(window_limit=10000, daily_limit=10000)
+        reservation = manager.reserve(user_id, input_tokens=100, max_output_tokens=1000)
+
+        db = SessionLocal()
+        actual = manager.reconcile(db, reservation, output_tokens=50)
+        db.commit()
+        db.close()
+
+        assert actual == 150
+        usage = manager.get_usage(user_id)
+        assert usage["window_tokens"] == 150
+        assert usage["reserved_tokens"] == 0
+
+        # 已 reconcile 的預留不會再被 release 重複扣除
+        other = manager.reserve(user_id, input_tokens=10, max_output_tokens=10)
+        manager.release(reservation)
+        assert manager.get_usage(user_id)["reserved_tokens"] == other.reserved_tokens
+
+        restarted = TokenQuotaManager(window_limit=10000, daily_limit=10000)
+        usage = restarted.get_usage(user_id)
+        assert usage["window_tokens"] == 150
+        assert usage["daily_tokens"] == 150
+
+    def test_unlimited_reserve_skips_database(self, user_id):
+        """測試未設定配額時預留不查詢資料庫"""
+        session_factory = MagicMock(side_effect=AssertionError("database queried"))
+        manager = TokenQuotaManager(window_limit=0, daily_limit=0, session_factory=session_factory)
+        reservation = manager.reserve(user_id, input_tokens=100, max_output_tokens=100)
+        assert (reservation.reserved_tokens, reservation.settled) == (0, True)
+        session_factory.assert_not_called()
+
+    def test_failed_reconcile_leaves_counters_unchanged(self, user_id):
+        """測試用量寫入失敗時記憶體中的計數不變，預留仍可由 release 歸還"""
+        manager = TokenQuotaManager(window_limit=10000, daily_limit=10000)
+        reservation = manager.reserve(user_id, input_tokens=100, max_output_tokens=1000)
+
+        db = SessionLocal()
+        try:
+            with patch.object(db, "execute", side_effect=RuntimeError("write failed")):
+                with pytest.raises(RuntimeError):
+                    manager.reconcile(db, reservation, output_tokens=50)
+        finally:
+            db.rollback()
+            db.close()
+
+        usage = manager.get_usage(user_id)
+        assert (usage["window_tokens"], usage["reserved_tokens"]) == (0, 1100)
+        manager.release(reservation)
+        assert manager.get_usage(user_id)["reserved_tokens"] == 0
+
+
+class TestTokenQuotaRoutes:
+    def test_chat_rejected_when_quota_exceeded(self, user_id):
+        """測試超過配額的請求在呼叫模型前返回 429"""
+        payload = {
+            "session_id": str(uuid.uuid4()),
+            "message": "hello",
+            "max_tokens": 4000,
+            "user_id": str(user_id),
+        }
+        with patch.object(token_quota, "window_limit", 100):
+            response = client.post("/chat/", json=payload)
+
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert "Retry-After" in response.headers
+
+    def test_reservation_released_when_stream_fails(self, user_id):
+        """測試串流在 reconcile 前中止時，預留的配額會被釋放"""
+        async def broken_stream(db, chat, api_call, reservation):
+            raise RuntimeError("database unavailable")
+            yield
+
+        payload = {"session_id": str(uuid.uuid4()), "message": "hello", "user_id": str(user_id)}
+        with patch.object(token_quota, "window_limit", 100000), \
+                patch.object(chat_routes, "stream_and_save", broken_stream):
+            with pytest.raises(RuntimeError):
+                client.post("/chat/", json=payload)
+
+        assert token_quota.get_usage(user_id)["reserved_tokens"] == 0
+
+    def test_read_token_usage(self, user_id):
+        response = client.get(f"/chat/usage/{user_id}")
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["user_id"] == str(user_id)
+        assert data["window_tokens"] == 0
+        assert data["daily_tokens"] == 0
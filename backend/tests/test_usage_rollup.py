@@ -0,0 +1,122 @@
+import uuid
+import pytest
+from datetime import datetime, date, timedelta
+from fastapi.testclient import TestClient
+from fastapi import status
+
+import models
+import schemas
+from main import app
+from database import SessionLocal
+from routes.chat_routes import stream_and_save
+from utils.usage_rollup import backfill_usage, check_usage, UNKNOWN_MODEL
+from utils.database_optimizations import ChatQueryOptimizer
+
+client = TestClient(app)
+
+
+async def ok_api(message, model, temperature, max_tokens, context, prompt, images):
+    yield "fine"
+
+
+async def failing_api(message, model, temperature, max_tokens, context, prompt, images):
+    raise RuntimeError("upstream down")
+    yield
+
+
+@pytest.fixture
+def user_id():
+    user_id = uuid.uuid4()
+    yield user_id
+    db = SessionLocal()
+    db.query(models.Chat).filter(models.Chat.user_id == user_id).delete()
+    db.query(models.ChatSession).filter(models.ChatSession.user_id == user_id).delete()
+    db.query(models.UserDailyUsage).filter(models.UserDailyUsage.user_id == user_id).delete()
+    db.commit()
+    db.close()
+
+
+class TestUsageRollup:
+    @pytest.mark.asyncio
+    async def test_rollup_updated_on_write(self, user_id):
+        """測試每輪對話增量更新每日彙總，並可由 /history/stats 讀取"""
+        session_id = uuid.uuid4()
+        db = SessionLocal()
+        for api_call in (ok_api, ok_api, failing_api):
+            chat_request = schemas.ChatRequest(session_id=session_id, message="hello", user_id=user_id)
+            _ = [chunk async for chunk in stream_and_save(db, chat_request, api_call)]
+        other_session = schemas.ChatRequest(session_id=uuid.uuid4(), message="hi", user_id=user_id, model="gpt-4o")
+        _ = [chunk async for chunk in stream_and_save(db, other_session, ok_api)]
+        db.close()
+
+        response = client.get("/history/stats", params={"user_id": str(user_id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["total_turns"] == 4
+        assert data["total_errors"] == 1
+        assert data["today_turns"] == 4
+        assert data["total_tokens"] > 0
+        assert data["avg_latency_ms"] > 0
+        assert sorted((day["model"], day["turns"], day["sessions"]) for day in data["days"]) == \
+            [("gpt-4o", 1, 1), ("gpt-4o-mini", 3, 1)]
+
+        db = SessionLocal()
+        assert [m for m in check_usage(db, since=date.today()) if m["user_id"] == user_id] == []
+        stats = ChatQueryOptimizer.get_user_statistics(db, user_id)
+        db.close()
+        assert stats["total_messages"] == 4
+        assert stats["total_sessions"] == 2
+        assert stats["today_messages"] == 4
+
+    @pytest.mark.asyncio
+    async def test_session_counted_once_when_switching_models(self, user_id):
+        """測試 session 當天中途換模型時只記在第一輪的模型下"""
+        session_id = uuid.uuid4()
+        db = SessionLocal()
+        for model in ("gpt-4o-mini", "gpt-4o"):
+            chat_request = schemas.ChatRequest(session_id=session_id, message="hello", user_id=user_id, model=model)
+            _ = [chunk async for chunk in stream_and_save(db, chat_request, ok_api)]
+        db.close()
+
+        response = client.get("/history/stats", params={"user_id": str(user_id)})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert sorted((day["model"], day["turns"], day["sessions"]) for day in response.json()["days"]) == \
+            [("gpt-4o", 1, 0), ("gpt-4o-mini", 1, 1)]
+        db = SessionLocal()
+        assert [m for m in check_usage(db, since=date.today()) if m["user_id"] == user_id] == []
+        db.close()
+
+    def test_backfill_and_check(self, user_id):
+        db = SessionLocal()
+        base_time = datetime(2024, 6, 1, 10, 0, 0)
+        for s in range(2):
+            session_id = uuid.uuid4()
+            for t in range(3):
+                db.add(models.Chat(
+                    session_id=session_id,
+                    turn_id=uuid.uuid4(),
+                    user_id=user_id,
+                    user_message="question",
+                    assistant_message="Error: timeout" if t == 2 else "answer",
+                    timestamp=base_time + timedelta(days=s, minutes=t)
+                ))
+        db.commit()
+
+        since = date(2024, 6, 1)
+        mismatches = [m for m in check_usage(db, since) if m["user_id"] == user_id]
+        assert len(mismatches) == 2
+
+        assert backfill_usage(db, since) >= 2
+        rows = db.query(models.UserDailyUsage).filter(models.UserDailyUsage.user_id == user_id).all()
+        assert {(row.day, row.model, row.turns, row.sessions, row.errors) for row in rows} == {
+            (date(2024, 6, 1), UNKNOWN_MODEL, 3, 1, 1),
+            (date(2024, 6, 2), UNKNOWN_MODEL, 3, 1, 1),
+        }
+        assert [m for m in check_usage(db, since) if m["user_id"] == user_id] == []
+
+        # 已有資料的日期不會重複回填
+        backfill_usage(db, since)
+        assert db.query(models.UserDailyUsage).filter(models.UserDailyUsage.user_id == user_id).count() == 2
+        db.close()
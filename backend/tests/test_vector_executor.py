@@ -0,0 +1,115 @@
+import os
+import shutil
+import asyncio
+import threading
+import time
+import pytest
+import httpx
+from unittest.mock import patch
+
+from main import app
+from utils.vectordb.chromadb_connecter import ChromaDBConnecter
+from utils.vectordb.client_registry import client_registry
+from utils.vectordb.executor import VectorExecutor, VectorExecutorBusy, vector_executor
+
+TEST_SESSION_ID = "87654321-4321-8765-4321-876543218765"
+TEST_DB_PATH = f"./data/chromadb_data/{TEST_SESSION_ID}"
+# 模擬一次嵌入推論與寫入的阻塞時間
+INGEST_BLOCKING_SECONDS = 0.5
+
+
+class BlockingConnecter:
+    """以真實的分塊加上阻塞等待模擬大型文件的寫入（不需要下載嵌入模型）"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def add_document_with_chunking(self, collection_name, document, document_id, chunk_size, chunk_overlap, metadata,
+                                   chunk_unit="chars"):
+        ChromaDBConnecter._split_text_into_chunks(self, document, chunk_size, chunk_overlap, chunk_unit)
+        time.sleep(INGEST_BLOCKING_SECONDS)
+        return True
+
+    def close(self):
+        pass
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """在 stop 設定前持續量測事件迴圈的最大延遲（秒）"""
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - start - interval)
+    return max_lag
+
+
+class TestVectorExecutor:
+    @pytest.mark.asyncio
+    async def test_queue_limit_and_stats(self):
+        executor = VectorExecutor(workers=1, max_queue=2)
+        release = threading.Event()
+        first = executor.submit(release.wait)
+        second = executor.submit(lambda: "done")
+        with pytest.raises(VectorExecutorBusy):
+            executor.submit(lambda: None)
+
+        release.set()
+        assert await first is True
+        assert await second == "done"
+        stats = executor.get_stats()
+        assert (stats["submitted"], stats["completed"], stats["rejected"]) == (2, 2, 1)
+        assert (stats["queued"], stats["running"]) == (0, 0)
+        assert stats["queue_wait"]["max_ms"] is not None
+
+    @pytest.mark.asyncio
+    async def test_failed_operation_counted(self):
+        executor = VectorExecutor(workers=1, max_queue=2)
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await executor.run(fail)
+        assert executor.get_stats()["failed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_large_ingest_does_not_block_event_loop(self):
+        """測試大型文件寫入期間事件迴圈仍能及時排程（串流不會停頓）"""
+        client_registry.clear()
+        document = "這是一段用於測試的文字。This is a sentence for testing.\n\n" * 40000
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(measure_loop_lag(stop))
+        try:
+            with patch("routes.vectordb_routes.ChromaDBConnecter", BlockingConnecter):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                    start = time.perf_counter()
+                    response = await client.post(
+                        f"/vectordb/add?session_id={TEST_SESSION_ID}",
+                        json={"document": document, "chunk_size": 500, "chunk_overlap": 50}
+                    )
+                    elapsed = time.perf_counter() - start
+        finally:
+            stop.set()
+            max_lag = await lag_task
+            client_registry.clear()
+            if os.path.exists(TEST_DB_PATH):
+                shutil.rmtree(TEST_DB_PATH)
+
+        assert response.status_code == 200
+        assert elapsed >= INGEST_BLOCKING_SECONDS
+        # 未移出事件迴圈時延遲約等於整個寫入時間
+        assert max_lag < INGEST_BLOCKING_SECONDS / 5
+        assert vector_executor.get_stats()["completed"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_busy_executor_returns_503(self):
+        with patch.object(vector_executor, "max_queue", 0):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post(f"/vectordb/init?session_id={TEST_SESSION_ID}")
+        if os.path.exists(TEST_DB_PATH):
+            shutil.rmtree(TEST_DB_PATH)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,134 @@
+import os
+import shutil
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+from utils.vectordb import client_registry as registry_module
+from utils.vectordb.chromadb_connecter import ChromaDBConnecter
+from utils.vectordb.client_registry import ChromaClientRegistry
+
+
+@pytest.fixture
+def fixed_size(monkeypatch):
+    """以固定大小估算客戶端記憶體，方便測試記憶體上限"""
+    monkeypatch.setattr(registry_module, "estimate_client_bytes", lambda path: 100)
+
+
+class TestChromaClientRegistry:
+    def test_reuses_connecter_per_path(self, fixed_size):
+        registry = ChromaClientRegistry(max_clients=4, max_bytes=10_000)
+        factory = MagicMock(side_effect=lambda path: MagicMock())
+
+        with registry.acquire("./data/a", factory) as first:
+            pass
+        with registry.acquire("data/a", factory) as second:
+            assert second is first
+        assert factory.call_count == 1
+        stats = registry.get_stats()
+        assert (stats["hits"], stats["misses"], stats["clients"]) == (1, 1, 1)
+
+    def test_evicts_least_recently_used_by_count_and_bytes(self, fixed_size):
+        registry = ChromaClientRegistry(max_clients=2, max_bytes=10_000)
+        connecters = {}
+        factory = lambda path: connecters.setdefault(path, MagicMock())
+        for path in ("a", "b", "c"):
+            with registry.acquire(path, factory):
+                pass
+        connecters["a"].close.assert_called_once()
+        assert registry.get_stats()["clients"] == 2
+
+        registry.max_bytes = 100
+        with registry.acquire("b", factory):
+            pass
+        connecters["c"].close.assert_called_once()
+        connecters["b"].close.assert_not_called()
+        assert registry.get_stats()["evictions"] == 2
+
+    def test_in_use_connecter_is_not_closed(self, fixed_size):
+        registry = ChromaClientRegistry(max_clients=1, max_bytes=10_000)
+        factory = lambda path: MagicMock()
+
+        with registry.acquire("a", factory) as in_use:
+            # 超過上限時不淘汰使用中的連接器
+            with registry.acquire("b", factory):
+                pass
+            in_use.close.assert_not_called()
+            # 使用中被失效時，釋放後才關閉
+            registry.invalidate("a")
+            in_use.close.assert_not_called()
+        in_use.close.assert_called_once()
+        assert registry.get_stats()["clients"] == 0
+
+    def test_open_happens_outside_global_lock(self, fixed_size):
+        """測試開啟較慢的路徑時，其他路徑不需等待，同一路徑只開啟一次"""
+        registry = ChromaClientRegistry(max_clients=4, max_bytes=10_000)
+        opening, release = threading.Event(), threading.Event()
+        calls = []
+
+        def factory(path):
+            calls.append(path)
+            if path == "slow":
+                opening.set()
+                assert release.wait(5)
+            return MagicMock()
+
+        results = []
+
+        def use_slow():
+            with registry.acquire("slow", factory) as connecter:
+                results.append(connecter)
+
+        threads = [threading.Thread(target=use_slow) for _ in range(2)]
+        threads[0].start()
+        assert opening.wait(5)
+        threads[1].start()
+        with registry.acquire("fast", factory):
+            pass
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert calls.count("slow") == 1
+        assert results[0] is results[1]
+
+    def test_failed_open_is_not_cached(self, fixed_size):
+        registry = ChromaClientRegistry(max_clients=4, max_bytes=10_000)
+        with pytest.raises(RuntimeError):
+            with registry.acquire("a", MagicMock(side_effect=RuntimeError("boom"))):
+                pass
+        assert registry.get_stats()["clients"] == 0
+        with registry.acquire("a", lambda path: MagicMock()) as connecter:
+            assert connecter is not None
+
+    def test_size_reestimated_periodically(self, monkeypatch):
+        sizes = []
+        monkeypatch.setattr(registry_module, "estimate_client_bytes", lambda path: sizes.append(path) or 100)
+        registry = ChromaClientRegistry(max_clients=4, max_bytes=10_000)
+        for _ in range(3):
+            with registry.acquire("a", lambda path: MagicMock()):
+                pass
+        # 開啟時估算一次，間隔內釋放不再走訪目錄
+        assert len(sizes) == 1
+
+        monkeypatch.setattr(registry_module, "VECTORDB_SIZE_REFRESH_SECONDS", 0)
+        with registry.acquire("a", lambda path: MagicMock()):
+            pass
+        assert len(sizes) == 2
+
+    def test_invalidate_allows_reopening_deleted_directory(self, tmp_path):
+        """測試刪除目錄前失效後，同一路徑可以重新建立集合"""
+        registry = ChromaClientRegistry()
+        path = str(tmp_path / "session")
+        with registry.acquire(path, ChromaDBConnecter) as connecter:
+            assert connecter.create_collection("documents") is not None
+
+        registry.invalidate(path)
+        shutil.rmtree(path)
+        os.makedirs(path)
+        with registry.acquire(path, ChromaDBConnecter) as connecter:
+            assert connecter.create_collection("documents") is not None
+            assert connecter.get_collection("documents").count() == 0
+        # 未關閉舊的 System 時會繼續寫入已刪除的檔案，新目錄中不會有資料庫
+        assert os.path.exists(os.path.join(path, "chroma.sqlite3"))
+        registry.clear()
@@ -0,0 +1,162 @@
+import gzip
+import json
+import os
+import shutil
+import numpy as np
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+from main import app
+from utils.vectordb import ingest as ingest_module
+from utils.vectordb.chromadb_connecter import ChromaDBConnecter
+from utils.vectordb.client_registry import client_registry
+from utils.vectordb.executor import vector_executor
+from utils.vectordb.ingest import IngestOptions, ingest_byte_stream
+
+client = TestClient(app)
+TEST_SESSION_ID = "11223344-5566-7788-99aa-bbccddeeff00"
+TEST_DB_PATH = f"./data/chromadb_data/{TEST_SESSION_ID}"
+
+
+class FakeEmbedding:
+    """記錄每批推論大小的嵌入函數（不需要下載模型）"""
+    batches = []
+
+    def __call__(self, input):
+        FakeEmbedding.batches.append(len(input))
+        return [np.full(8, len(text), dtype=np.float32) for text in input]
+
+
+class FakeEmbeddingConnecter(ChromaDBConnecter):
+    def __init__(self, path=None):
+        super().__init__(path)
+        self.embedding_function = FakeEmbedding()
+
+
+@pytest.fixture
+def vectordb(monkeypatch):
+    FakeEmbedding.batches = []
+    client_registry.clear()
+    monkeypatch.setattr(ingest_module, "ChromaDBConnecter", FakeEmbeddingConnecter)
+    yield
+    client_registry.clear()
+    if os.path.exists(TEST_DB_PATH):
+        shutil.rmtree(TEST_DB_PATH)
+
+
+def ndjson(*rows) -> bytes:
+    return b"".join((row if isinstance(row, bytes) else json.dumps(row).encode()) + b"\n" for row in rows)
+
+
+def stored_ids() -> list:
+    with client_registry.acquire(TEST_DB_PATH, FakeEmbeddingConnecter) as connecter:
+        return connecter.get_collection("documents").get()["ids"]
+
+
+class TestVectorDBIngest:
+    def test_ingest_reports_per_document_results(self, vectordb, monkeypatch):
+        monkeypatch.setattr(ingest_module, "INGEST_BATCH_BYTES", 200)
+        monkeypatch.setattr(ingest_module, "INGEST_ADD_BATCH", 4)
+        body = ndjson(
+            {"document": "Alpha sentence. " * 10, "document_id": "alpha"},
+            b"not json",
+            {"document": ""},
+            {"document": "Beta sentence. " * 10},
+            {"document": "Gamma", "document_id": "alpha"},
+            {"document": "Delta", "type": "md"},
+        )
+        response = client.post(
+            f"/vectordb/ingest?session_id={TEST_SESSION_ID}&chunk_size=50&chunk_overlap=10", content=body
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        results = data["results"]
+        assert [r["line"] for r in results] == [1, 2, 3, 4, 5, 6]
+        assert [r["status"] for r in results] == ["success", "error", "error", "success", "error", "success"]
+        assert results[4]["error"] == "Duplicate document_id in upload"
+        assert (data["documents"], data["succeeded"], data["failed"]) == (6, 3, 3)
+
+        ids = stored_ids()
+        assert len(ids) == data["chunks"] == sum(r.get("chunks", 0) for r in results)
+        assert sum(id.startswith("alpha_chunk_") for id in ids) == results[0]["chunks"]
+        # 多份文件的區塊合併後分批推論
+        assert max(FakeEmbedding.batches) == 4
+        assert sum(FakeEmbedding.batches) == len(ids)
+
+    def test_gzip_body(self, vectordb):
+        body = gzip.compress(ndjson({"document": "Alpha"}, {"document": "Beta"}))
+        response = client.post(
+            f"/vectordb/ingest?session_id={TEST_SESSION_ID}", content=body, headers={"Content-Encoding": "gzip"}
+        )
+        assert response.json()["succeeded"] == 2
+        assert len(stored_ids()) == 2
+
+    @pytest.mark.asyncio
+    async def test_gzip_decompressed_in_bounded_chunks(self, vectordb, monkeypatch):
+        monkeypatch.setattr(ingest_module, "DECOMPRESS_CHUNK_BYTES", 7)
+        monkeypatch.setattr(ingest_module, "INGEST_MAX_DOCUMENT_BYTES", 100)
+        # 高壓縮比的超大文件逐段解壓後丟棄，不會一次展開
+        body = gzip.compress(ndjson({"document": "Alpha"}, {"document": "z" * 1_000_000}, {"document": "Beta"}))
+
+        async def stream():
+            for start in range(0, len(body), 64):
+                yield body[start:start + 64]
+
+        os.makedirs(TEST_DB_PATH, exist_ok=True)
+        result = (await ingest_byte_stream(TEST_DB_PATH, stream(), IngestOptions(), compressed=True)).to_dict()
+        assert [(r["line"], r["status"]) for r in result["results"]] == [(1, "success"), (2, "error"), (3, "success")]
+
+    def test_ingest_not_limited_by_global_request_size(self, vectordb, monkeypatch):
+        monkeypatch.setattr(ingest_module, "INGEST_MAX_DOCUMENT_BYTES", 100)
+        body = ndjson({"document": "x" * (11 * 1024 * 1024)}, {"document": "Alpha"})
+        response = client.post(f"/vectordb/ingest?session_id={TEST_SESSION_ID}", content=body)
+        assert response.status_code == 200
+        assert (response.json()["failed"], response.json()["succeeded"]) == (1, 1)
+
+    def test_upload_over_ingest_limit_returns_413(self, vectordb, monkeypatch):
+        monkeypatch.setattr(ingest_module, "INGEST_MAX_BYTES", 20)
+        response = client.post(
+            f"/vectordb/ingest?session_id={TEST_SESSION_ID}", content=ndjson({"document": "Alpha" * 10})
+        )
+        assert response.status_code == 413
+
+    @pytest.mark.asyncio
+    async def test_oversized_document_skipped_while_streaming(self, vectordb, monkeypatch):
+        monkeypatch.setattr(ingest_module, "INGEST_MAX_DOCUMENT_BYTES", 100)
+        body = ndjson({"document": "x" * 500}, {"document": "small"}, {"document": "y" * 200})
+
+        async def stream():
+            for start in range(0, len(body), 16):
+                yield body[start:start + 16]
+
+        os.makedirs(TEST_DB_PATH, exist_ok=True)
+        result = (await ingest_byte_stream(TEST_DB_PATH, stream(), IngestOptions())).to_dict()
+        assert [(r["line"], r["status"]) for r in result["results"]] == [(1, "error"), (2, "success"), (3, "error")]
+        assert "exceeds" in result["results"][0]["error"]
+
+    def test_invalid_chunk_overlap(self, vectordb):
+        response = client.post(
+            f"/vectordb/ingest?session_id={TEST_SESSION_ID}&chunk_size=100&chunk_overlap=100", content=b""
+        )
+        assert response.status_code == 400
+
+    def test_busy_executor_returns_503(self, vectordb):
+        with patch.object(vector_executor, "max_queue", 0):
+            response = client.post(
+                f"/vectordb/ingest?session_id={TEST_SESSION_ID}", content=ndjson({"document": "Alpha"})
+            )
+        assert response.status_code == 503
+
+    def test_reingest_replaces_document_incrementally(self, vectordb):
+        paragraphs = [f"Paragraph {i}. " + "Some sentence for testing. " * 15 for i in range(20)]
+        url = f"/vectordb/ingest?session_id={TEST_SESSION_ID}&chunk_size=500&chunk_overlap=50"
+        first = client.post(url, content=ndjson({"document": "\n\n".join(paragraphs), "document_id": "doc"})).json()
+
+        paragraphs[10] = "Edited paragraph. " + paragraphs[10]
+        second = client.post(url, content=ndjson({"document": "\n\n".join(paragraphs), "document_id": "doc"})).json()
+
+        assert first["embedded"] == first["chunks"]
+        assert 0 < second["embedded"] <= 3
+        assert len(stored_ids()) == second["chunks"]
@@ -9,6 +9,8 @@ from fastapi import status
 
 # 導入應用程式
 from main import app
+from utils.vectordb.client_registry import client_registry
+from utils.vectordb.hashing import deterministic_uuid
 
 client = TestClient(app)
 
@@ -19,11 +21,14 @@ TEST_DB_PATH = f"./data/chromadb_data/{TEST_SESSION_ID}"
 @pytest.fixture
 def mock_chromadb_connector():
     """模擬 ChromaDBConnecter 的實例"""
+    # 登錄表會保留已開啟的連接器，測試前後清空以免沿用其他測試的 mock
+    client_registry.clear()
     with patch("routes.vectordb_routes.ChromaDBConnecter") as mock_class:
         # 設置返回的 mock 對象
         mock_instance = MagicMock()
         mock_class.return_value = mock_instance
         yield mock_instance
+    client_registry.clear()
 
 @pytest.fixture
 def cleanup_test_data():
@@ -85,7 +90,7 @@ class TestVectorDBRoutes:
 
     def test_add_documents_success(self, mock_chromadb_connector, cleanup_test_data):
         """測試成功添加文件到向量資料庫"""
-        mock_chromadb_connector.add_document_with_chunking.return_value = None  # 假設無回傳
+        mock_chromadb_connector.add_document_with_chunking.return_value = True
         
         payload = {
             "document": "This is a test document.",
@@ -99,6 +104,8 @@ class TestVectorDBRoutes:
         assert response.status_code == status.HTTP_200_OK
         assert response.json()["status"] == "success"
         assert "Add documents to VectorDB" in response.json()["message"]
+        # 未指定 document_id 時返回以內容產生的 ID，供下次更新使用
+        assert response.json()["document_id"] == str(deterministic_uuid(payload["document"]))
 
         # 驗證呼叫參數是否正確
         mock_chromadb_connector.add_document_with_chunking.assert_called_once()
@@ -117,6 +124,27 @@ class TestVectorDBRoutes:
 
         assert response.status_code == status.HTTP_400_BAD_REQUEST
 
+    def test_add_documents_invalid_chunk_overlap(self, mock_chromadb_connector):
+        """測試 chunk_overlap 不小於 chunk_size 時直接返回 400"""
+        payload = {
+            "document": "This is a test document.",
+            "chunk_size": 100,
+            "chunk_overlap": 100,
+        }
+
+        response = client.post(f"/vectordb/add?session_id={TEST_SESSION_ID}", json=payload)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        mock_chromadb_connector.add_document_with_chunking.assert_not_called()
+
+    def test_add_documents_returns_500_when_add_fails(self, mock_chromadb_connector):
+        """測試區塊新增失敗（add_document_with_chunking 返回 False）時不回報成功"""
+        mock_chromadb_connector.add_document_with_chunking.return_value = False
+
+        response = client.post(f"/vectordb/add?session_id={TEST_SESSION_ID}", json={"document": "Text."})
+
+        assert response.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR
+
     def test_add_documents_failure(self, mock_chromadb_connector):
         """測試添加文檔失敗（模擬內部錯誤）"""
         mock_chromadb_connector.add_document_with_chunking.side_effect = Exception("Mock insert error")
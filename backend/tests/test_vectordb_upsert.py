@@ -0,0 +1,124 @@
+import uuid
+import numpy as np
+import pytest
+
+from utils.vectordb.chromadb_connecter import ChromaDBConnecter, chunk_ids
+
+
+class FakeEmbedding:
+    """記錄實際嵌入的區塊內容（不需要下載模型）"""
+
+    def __init__(self):
+        self.embedded = []
+
+    def __call__(self, input):
+        self.embedded.extend(input)
+        return [np.full(8, len(text), dtype=np.float32) for text in input]
+
+
+@pytest.fixture
+def connecter():
+    connecter = ChromaDBConnecter()
+    connecter.embedding_function = FakeEmbedding()
+    connecter.collection_name = f"test-{uuid.uuid4().hex}"
+    connecter.create_collection(connecter.collection_name)
+    yield connecter
+    connecter.client.delete_collection(connecter.collection_name)
+
+
+def make_document(paragraphs: int, edited: int = -1) -> str:
+    return "\n\n".join(
+        f"第 {i} 段{'（已修改）' if i == edited else ''}。" + "這是一段用於測試增量索引的內容。" * 10
+        for i in range(paragraphs)
+    )
+
+
+def stored(connecter, document_id):
+    return connecter.get_collection(connecter.collection_name).get(
+        where={"base_document_id": document_id}, include=["metadatas", "documents"]
+    )
+
+
+def add(connecter, document, document_id="doc"):
+    return connecter.add_document_with_chunking(
+        connecter.collection_name, document, document_id, chunk_size=500, chunk_overlap=50
+    )
+
+
+class TestIncrementalReindex:
+    def test_edit_only_embeds_changed_chunks(self, connecter):
+        original = make_document(100)
+        assert add(connecter, original)
+        total = len(stored(connecter, "doc")["ids"])
+        assert total >= 50
+        connecter.embedding_function.embedded.clear()
+
+        assert add(connecter, make_document(100, edited=50))
+        embedded = connecter.embedding_function.embedded
+        assert 0 < len(embedded) <= 3
+        assert all("已修改" in text for text in embedded[:1])
+
+        result = stored(connecter, "doc")
+        expected_ids, expected_chunks, _ = connecter.build_chunks(
+            make_document(100, edited=50), "doc", chunk_size=500, chunk_overlap=50
+        )
+        assert sorted(result["ids"]) == sorted(expected_ids)
+        by_index = sorted(zip(result["metadatas"], result["documents"]), key=lambda m: m[0]["chunk_index"])
+        assert [chunk for _, chunk in by_index] == expected_chunks
+
+    def test_readding_same_document_embeds_nothing(self, connecter):
+        document = make_document(20)
+        assert add(connecter, document)
+        connecter.embedding_function.embedded.clear()
+        assert add(connecter, document)
+        assert connecter.embedding_function.embedded == []
+
+    def test_shrinking_document_deletes_stale_chunks_and_updates_metadata(self, connecter):
+        assert add(connecter, make_document(20))
+        connecter.embedding_function.embedded.clear()
+        shorter = make_document(10)
+        assert add(connecter, shorter)
+
+        result = stored(connecter, "doc")
+        expected_ids, _, _ = connecter.build_chunks(shorter, "doc", chunk_size=500, chunk_overlap=50)
+        assert sorted(result["ids"]) == sorted(expected_ids)
+        assert {m["total_chunks"] for m in result["metadatas"]} == {len(expected_ids)}
+        assert len(connecter.embedding_function.embedded) <= 1
+
+    def test_other_documents_untouched(self, connecter):
+        assert add(connecter, make_document(5), "first")
+        assert add(connecter, make_document(5, edited=2), "second")
+        assert add(connecter, "Replaced.", "first")
+        assert len(stored(connecter, "first")["ids"]) == 1
+        assert len(stored(connecter, "second")["ids"]) > 1
+
+    def test_default_document_id_uses_full_content(self, connecter):
+        ids_a, _, _ = connecter.build_chunks("Same prefix, first document.")
+        ids_b, _, _ = connecter.build_chunks("Same prefix, second document.")
+        assert ids_a[0].split("_chunk_")[0] != ids_b[0].split("_chunk_")[0]
+
+    def test_repeated_chunks_get_distinct_ids(self):
+        ids = chunk_ids("doc", ["same", "other", "same"])
+        assert len(set(ids)) == 3
+        assert ids[2] == f"{ids[0]}_1"
+
+    def test_failed_add_keeps_previous_chunks(self, connecter, monkeypatch):
+        """測試新增失敗時保留文件原有的塊，同一批中其他文件照常取代"""
+        assert add(connecter, make_document(10), "first")
+        assert add(connecter, make_document(10), "second")
+        before = sorted(stored(connecter, "first")["ids"])
+
+        first = connecter.build_chunks(make_document(10, edited=3), "first", chunk_size=500, chunk_overlap=50)
+        second = connecter.build_chunks("Replaced.", "second", chunk_size=500, chunk_overlap=50)
+        add_documents = connecter.add_documents
+        monkeypatch.setattr(connecter, "add_documents", lambda name, ids, docs, metadatas: (
+            not ids[0].startswith("first") and add_documents(name, ids, docs, metadatas)
+        ))
+        result = connecter.upsert_chunks(
+            connecter.collection_name, ["first", "second"],
+            *[a + b for a, b in zip(first, second)], batch_size=1
+        )
+
+        assert result.failed and result.added
+        assert sorted(stored(connecter, "first")["ids"]) == before
+        assert stored(connecter, "second")["ids"] == second[0]
@@ -0,0 +1,342 @@
+# utils/chat_archive.py - 將冷資料搬移到壓縮檔案，保持 chats 熱表精簡
+import argparse
+import asyncio
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+from uuid import UUID
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from models import Chat, ChatArchive, ChatSession
+from utils.chat_export import EXPORT_COLUMNS, row_to_json
+from utils.backend_logger import BackendLogger
+from utils.session_cache import session_cache
+from utils.sqlite_profile import run_write_sync
+
+try:
+    import zstandard
+except ImportError:  # 未安裝時改用 gzip
+    zstandard = None
+
+backend_logger = BackendLogger().logger
+
+# 歸檔檔案目錄；多台伺服器部署時應指向共用的儲存空間
+ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "./data/chat_archive")
+# 超過多少天的對話搬移到冷儲存，0 表示停用背景歸檔
+RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", "0"))
+# 背景歸檔的執行間隔（秒）
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("CHAT_ARCHIVE_INTERVAL_SECONDS", "3600"))
+# 每個歸檔檔案包含的 session 數量（每批一個交易）
+ARCHIVE_BATCH_SESSIONS = 200
+# PostgreSQL advisory lock 的鍵，確保多個 worker 中同時只有一個執行歸檔
+ARCHIVE_LOCK_KEY = 0x63686174
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def compress_frame(data: bytes) -> bytes:
+    """壓縮單一區塊（每個區塊可獨立解壓）"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data)
+
+
+def decompress_frame(data: bytes) -> bytes:
+    """依區塊開頭的魔術數字選擇解壓方式"""
+    if data.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this archive")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if data.startswith(GZIP_MAGIC):
+        return gzip.decompress(data)
+    raise ValueError("Unknown archive frame format")
+
+
+class _ArchiveConflict(Exception):
+    """同一批中的對話已被其他 worker 歸檔"""
+
+
+def _archivable_filter(cutoff: datetime):
+    """早於 cutoff 且不是 session 最新一輪的對話（最新一輪保留在熱表，供歷史列表使用）"""
+    return (
+        (Chat.session_id == ChatSession.session_id) &
+        (Chat.timestamp < cutoff) &
+        (Chat.timestamp < ChatSession.last_timestamp)
+    )
+
+
+def find_archivable_sessions(db: Session, cutoff: datetime, limit: int) -> List[UUID]:
+    """找出仍有可歸檔對話的 session"""
+    rows = db.execute(
+        select(Chat.session_id).join(ChatSession, _archivable_filter(cutoff)).distinct().limit(limit)
+    ).all()
+    return [row.session_id for row in rows]
+
+
+def _archive_batch(db: Session, session_ids: List[UUID], cutoff: datetime, archive_dir: str) -> Dict[str, int]:
+    rows = db.execute(
+        select(*EXPORT_COLUMNS)
+        .join(ChatSession, _archivable_filter(cutoff))
+        .where(Chat.session_id.in_(session_ids))
+        .order_by(Chat.session_id, Chat.timestamp)
+    ).all()
+    if not rows:
+        # 查詢 session 後其他 worker 已將它們歸檔
+        return {"sessions": 0, "turns": 0}
+    by_session: Dict[UUID, list] = {}
+    for row in rows:
+        by_session.setdefault(row.session_id, []).append(row)
+
+    now = datetime.now()
+    extension = "zst" if zstandard is not None else "gz"
+    file_name = f"chats_{now:%Y%m%d_%H%M%S_%f}.ndjson.{extension}"
+    file_path = os.path.join(archive_dir, file_name)
+    entries = []
+
+    # 先寫入並同步檔案，再於同一個交易中刪除熱資料並寫入索引；
+    # 中途失敗時資料仍在熱表，下次執行會重新歸檔（孤立的檔案不影響讀取）
+    with open(file_path, "wb") as f:
+        for session_id, turns in by_session.items():
+            frame = compress_frame(("\n".join(row_to_json(turn) for turn in turns) + "\n").encode("utf-8"))
+            entries.append(ChatArchive(
+                session_id=session_id,
+                user_id=turns[-1].user_id,
+                archive_file=file_name,
+                byte_offset=f.tell(),
+                byte_length=len(frame),
+                turn_count=len(turns),
+                first_timestamp=turns[0].timestamp,
+                last_timestamp=turns[-1].timestamp,
+                archived_at=now
+            ))
+            f.write(frame)
+        f.flush()
+        os.fsync(f.fileno())
+
+    def write(write_db: Session) -> None:
+        # 先刪除熱資料並確認刪除的列數：其他 worker 同時歸檔了其中的對話時
+        # （刪除會等待對方的交易結束後重新檢查），放棄這一批，避免冷儲存中出現重複的對話
+        deleted = 0
+        for session_id, turns in by_session.items():
+            deleted += write_db.query(Chat).filter(
+                Chat.session_id == session_id,
+                Chat.turn_id.in_([turn.turn_id for turn in turns])
+            ).delete(synchronize_session=False)
+        if deleted != len(rows):
+            raise _ArchiveConflict()
+        write_db.add_all(entries)
+
+    try:
+        run_write_sync(db, write)
+    except _ArchiveConflict:
+        db.rollback()
+        os.remove(file_path)
+        backend_logger.warning(f"Chat archive batch skipped, turns were archived concurrently | {file_name}")
+        return {"sessions": 0, "turns": 0}
+    session_cache.invalidate(by_session)
+    return {"sessions": len(by_session), "turns": len(rows)}
+
+
+def archive_cold_turns(
+    db: Session,
+    cutoff: datetime,
+    archive_dir: Optional[str] = None,
+    batch_sessions: int = ARCHIVE_BATCH_SESSIONS
+) -> Dict[str, int]:
+    """
+    將早於 cutoff 的對話搬移到壓縮的 NDJSON 冷儲存
+
+    每個 session 的對話壓縮為一個獨立區塊，chat_archive_index 記錄區塊所在的檔案與位置，
+    讀取單一 session 時只需解壓該區塊。每個 session 最新的一輪保留在熱表。
+
+    Args:
+        db: 資料庫 session
+        cutoff: 早於此時間的對話會被歸檔
+        archive_dir: 歸檔目錄，默認為 CHAT_ARCHIVE_DIR
+        batch_sessions: 每個檔案 / 交易包含的 session 數量
+
+    Returns:
+        歸檔的 session 數、對話數與檔案數
+    """
+    archive_dir = archive_dir or ARCHIVE_DIR
+    os.makedirs(archive_dir, exist_ok=True)
+    totals = {"sessions": 0, "turns": 0, "files": 0}
+    while True:
+        session_ids = find_archivable_sessions(db, cutoff, batch_sessions)
+        if not session_ids:
+            break
+        result = _archive_batch(db, session_ids, cutoff, archive_dir)
+        totals["sessions"] += result["sessions"]
+        totals["turns"] += result["turns"]
+        totals["files"] += int(result["sessions"] > 0)
+    backend_logger.info(f"Chat archive finished | cutoff: {cutoff.isoformat()} | {totals}")
+    return totals
+
+
+def load_archived_turns(
+    db: Session,
+    session_id: UUID,
+    user_id: Optional[UUID] = None,
+    archive_dir: Optional[str] = None
+) -> List[dict]:
+    """
+    從冷儲存讀取 session 已歸檔的對話
+
+    Returns:
+        與 ChatHistory 欄位相同的字典，按時間排序；沒有歸檔時返回空列表
+    """
+    entries = (
+        db.query(ChatArchive)
+        .filter(ChatArchive.session_id == session_id)
+        .order_by(ChatArchive.first_timestamp)
+        .all()
+    )
+    turns = [
+        turn for turn in _read_entries(entries, archive_dir)
+        if user_id is None or turn["user_id"] == str(user_id)
+    ]
+    turns.sort(key=lambda turn: turn["timestamp"])
+    return turns
+
+
+def _read_entries(entries: List[ChatArchive], archive_dir: Optional[str] = None) -> Iterator[dict]:
+    """逐一解壓索引指向的區塊，產生其中的對話"""
+    archive_dir = archive_dir or ARCHIVE_DIR
+    for entry in entries:
+        with open(os.path.join(archive_dir, entry.archive_file), "rb") as f:
+            f.seek(entry.byte_offset)
+            frame = f.read(entry.byte_length)
+        for line in decompress_frame(frame).decode("utf-8").splitlines():
+            turn = json.loads(line)
+            turn["timestamp"] = datetime.fromisoformat(turn["timestamp"])
+            yield turn
+
+
+def archived_turn_keys(db: Session, session_ids: Iterable[UUID], archive_dir: Optional[str] = None) -> Set[tuple]:
+    """
+    指定 session 中已歸檔對話的 (session_id, turn_id)（例如匯入時略過已在冷儲存的對話）
+
+    只解壓有歸檔記錄的 session 的區塊；沒有任何歸檔時只需一次索引查詢。
+    """
+    session_ids = list(session_ids)
+    entries = []
+    for i in range(0, len(session_ids), ARCHIVE_BATCH_SESSIONS):
+        entries += db.query(ChatArchive).filter(
+            ChatArchive.session_id.in_(session_ids[i:i + ARCHIVE_BATCH_SESSIONS])
+        ).all()
+    return {(UUID(turn["session_id"]), UUID(turn["turn_id"])) for turn in _read_entries(entries, archive_dir)}
+
+
+def iter_archived_turns(
+    db: Session,
+    user_id: Optional[UUID] = None,
+    session_id: Optional[UUID] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    archive_dir: Optional[str] = None
+) -> Iterator[dict]:
+    """
+    依條件逐一產生已歸檔的對話（匯出使用），每次只解壓一個區塊
+
+    Args:
+        db: 資料庫 session
+        user_id / session_id: 可選的過濾條件
+        start / end: 可選的時間範圍（含 start、不含 end）
+        archive_dir: 歸檔目錄，默認為 CHAT_ARCHIVE_DIR
+    """
+    query = db.query(ChatArchive)
+    if user_id is not None:
+        query = query.filter(ChatArchive.user_id == user_id)
+    if session_id is not None:
+        query = query.filter(ChatArchive.session_id == session_id)
+    if start is not None:
+        query = query.filter(ChatArchive.last_timestamp >= start)
+    if end is not None:
+        query = query.filter(ChatArchive.first_timestamp < end)
+    for entry in query.order_by(ChatArchive.first_timestamp, ChatArchive.id).all():
+        for turn in _read_entries([entry], archive_dir):
+            if user_id is not None and turn["user_id"] != str(user_id):
+                continue
+            if (start is not None and turn["timestamp"] < start) or (end is not None and turn["timestamp"] >= end):
+                continue
+            yield turn
+
+
+def _claim_archive_job(connection) -> bool:
+    """
+    取得歸檔的執行權（每個 uvicorn worker 都會啟動背景歸檔）
+
+    PostgreSQL 以 session 層級的 advisory lock 讓同時只有一個 worker 執行；
+    SQLite 的寫入本身是序列化的，重複的工作由 _archive_batch 的刪除列數檢查排除。
+    """
+    if connection.dialect.name != "postgresql":
+        return True
+    claimed = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": ARCHIVE_LOCK_KEY}).scalar()
+    connection.commit()
+    return bool(claimed)
+
+
+def run_archive_job(days: int = RETENTION_DAYS, archive_dir: Optional[str] = None) -> Dict[str, int]:
+    """以新的資料庫 session 執行一次歸檔（其他 worker 正在歸檔時直接略過）"""
+    from database import SessionLocal, engine
+
+    with engine.connect() as lock_connection:
+        if not _claim_archive_job(lock_connection):
+            backend_logger.info("Chat archive job is running in another worker, skipped")
+            return {"sessions": 0, "turns": 0, "files": 0}
+        db = SessionLocal()
+        try:
+            return archive_cold_turns(db, datetime.now() - timedelta(days=days), archive_dir)
+        finally:
+            db.close()
+            if lock_connection.dialect.name == "postgresql":
+                lock_connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ARCHIVE_LOCK_KEY})
+                lock_connection.commit()
+
+
+async def archive_loop(days: int = RETENTION_DAYS, interval: int = ARCHIVE_INTERVAL_SECONDS) -> None:
+    """背景歸檔迴圈（在執行緒池中執行，避免阻塞事件迴圈）"""
+    while True:
+        try:
+            await run_in_threadpool(run_archive_job, days)
+        except Exception as e:
+            backend_logger.error(f"Chat archive job failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_archive_job() -> Optional[asyncio.Task]:
+    """CHAT_RETENTION_DAYS 大於 0 時啟動背景歸檔，返回可於關閉時取消的 task"""
+    if RETENTION_DAYS <= 0:
+        return None
+    backend_logger.info(f"Chat archive job enabled | retention: {RETENTION_DAYS} days")
+    return asyncio.create_task(archive_loop())
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="將舊對話搬移到冷儲存")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="歸檔早於指定天數的對話")
+    run_parser.add_argument("--days", type=int, default=RETENTION_DAYS or 180)
+    run_parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    read_parser = subparsers.add_parser("read", help="以 NDJSON 輸出 session 已歸檔的對話")
+    read_parser.add_argument("--session-id", type=UUID, required=True)
+    read_parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print(run_archive_job(args.days, args.archive_dir))
+    else:
+        db = SessionLocal()
+        try:
+            for turn in load_archived_turns(db, args.session_id, archive_dir=args.archive_dir):
+                print(json.dumps({**turn, "timestamp": turn["timestamp"].isoformat()}, ensure_ascii=False))
+        finally:
+            db.close()
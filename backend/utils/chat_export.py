@@ -0,0 +1,130 @@
+# utils/chat_export.py - 以串流方式匯出聊天記錄（NDJSON，可選 gzip）
+import itertools
+import json
+import zlib
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import Chat
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# 每次從資料庫游標取回的列數，也是每個輸出區塊包含的行數
+EXPORT_BATCH_SIZE = 1000
+# gzip 格式（wbits=31 產生帶 gzip 標頭的串流）
+GZIP_WBITS = 31
+
+EXPORT_COLUMNS = (
+    Chat.session_id,
+    Chat.turn_id,
+    Chat.user_id,
+    Chat.timestamp,
+    Chat.user_message,
+    Chat.assistant_message,
+)
+
+
+def build_export_query(
+    user_id: Optional[UUID] = None,
+    session_id: Optional[UUID] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """建立匯出查詢（只選取需要的欄位，不建立 ORM 物件）"""
+    query = select(*EXPORT_COLUMNS)
+    if user_id is not None:
+        query = query.where(Chat.user_id == user_id)
+    if session_id is not None:
+        query = query.where(Chat.session_id == session_id)
+    if start is not None:
+        query = query.where(Chat.timestamp >= start)
+    if end is not None:
+        query = query.where(Chat.timestamp < end)
+    return query.order_by(Chat.timestamp, Chat.session_id, Chat.turn_id)
+
+
+def row_to_json(row) -> str:
+    """將一輪對話轉為一行 JSON（匯出、匯入與冷儲存共用此格式）"""
+    return json.dumps({
+        "session_id": str(row.session_id),
+        "turn_id": str(row.turn_id),
+        "user_id": str(row.user_id) if row.user_id is not None else None,
+        "timestamp": row.timestamp.isoformat() if row.timestamp is not None else None,
+        "user_message": row.user_message,
+        "assistant_message": row.assistant_message,
+    }, ensure_ascii=False)
+
+
+def iter_ndjson(db: Session, query, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    以伺服器端游標分批讀取並輸出 NDJSON 區塊
+
+    使用 yield_per（PostgreSQL 上會啟用 server-side cursor），
+    記憶體用量只與 batch_size 有關，與匯出的總列數無關。
+
+    Args:
+        db: 資料庫 session
+        query: build_export_query 建立的查詢
+        batch_size: 每批的列數
+
+    Yields:
+        每批資料編碼後的 NDJSON 位元組
+    """
+    result = db.execute(query.execution_options(yield_per=batch_size))
+    exported = 0
+    for rows in result.partitions():
+        exported += len(rows)
+        yield ("\n".join(row_to_json(row) for row in rows) + "\n").encode("utf-8")
+    backend_logger.info(f"History export finished | rows: {exported}")
+
+
+def iter_archived_ndjson(db: Session, filters: dict, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """以與 iter_ndjson 相同的格式輸出已歸檔到冷儲存的對話（filters 同 build_export_query 的參數）"""
+    from utils.chat_archive import iter_archived_turns
+
+    turns = iter_archived_turns(db, **filters)
+    exported = 0
+    while batch := list(itertools.islice(turns, batch_size)):
+        exported += len(batch)
+        yield ("\n".join(
+            json.dumps({**turn, "timestamp": turn["timestamp"].isoformat()}, ensure_ascii=False) for turn in batch
+        ) + "\n").encode("utf-8")
+    backend_logger.info(f"History export finished | archived rows: {exported}")
+
+
+def gzip_stream(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """將位元組串流逐段壓縮為 gzip 格式"""
+    compressor = zlib.compressobj(wbits=GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def stream_export(
+    session_factory: Callable[[], Session],
+    query,
+    compress: bool = False,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    archive_filters: Optional[dict] = None
+) -> Iterator[bytes]:
+    """
+    供 StreamingResponse 使用的匯出產生器
+
+    請求的依賴 session 在開始串流前就會關閉，因此在產生器內部自行開啟 session。
+    提供 archive_filters 時先輸出符合條件、已歸檔到冷儲存的對話，再輸出熱表中的對話。
+    """
+    db = session_factory()
+    try:
+        chunks = iter_ndjson(db, query, batch_size)
+        if archive_filters is not None:
+            chunks = itertools.chain(iter_archived_ndjson(db, archive_filters, batch_size), chunks)
+        yield from (gzip_stream(chunks) if compress else chunks)
+    finally:
+        db.close()
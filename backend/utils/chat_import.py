@@ -0,0 +1,387 @@
+# utils/chat_import.py - 以 NDJSON 批次匯入聊天記錄（PostgreSQL 使用 COPY，SQLite 使用 executemany）
+import argparse
+import gzip
+import io
+import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterable, List, Optional
+from uuid import UUID
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from models import Chat
+from utils.chat_archive import archived_turn_keys
+from utils.chat_sessions import rebuild_session_summaries
+from utils.db_upsert import dialect_insert
+from utils.session_cache import session_cache
+from utils.sqlite_profile import run_write_sync
+from utils.usage_rollup import record_imported_usage
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# 每批寫入的列數（每批一個交易）
+IMPORT_BATCH_SIZE = 5000
+IMPORT_COLUMNS = ("session_id", "turn_id", "user_id", "user_message", "assistant_message", "timestamp")
+# PostgreSQL 的暫存表，交易提交時自動清空
+PG_STAGING_TABLE = "chats_import_staging"
+# 串流匯入時單行（一輪對話）的大小上限，超過的行記為錯誤並丟棄
+IMPORT_MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(16 * 1024 * 1024)))
+# gzip 解壓時每次輸出的位元組上限，避免高壓縮比的內容一次展開佔用大量記憶體
+DECOMPRESS_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class ImportResult:
+    """匯入結果統計"""
+    imported: int = 0
+    skipped: int = 0
+    errors: int = 0
+    sessions: set = field(default_factory=set)
+
+    def merge(self, other: "ImportResult") -> None:
+        self.imported += other.imported
+        self.skipped += other.skipped
+        self.errors += other.errors
+        self.sessions |= other.sessions
+
+    def to_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "sessions": len(self.sessions),
+        }
+
+
+def parse_line(line) -> Optional[dict]:
+    """
+    解析一行 NDJSON（格式與 /history/export 輸出相同）
+
+    Returns:
+        可寫入 chats 表的欄位字典；空白行返回 None
+
+    Raises:
+        ValueError: 缺少必要欄位或格式錯誤
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        data = json.loads(line)
+        return {
+            "session_id": UUID(data["session_id"]),
+            "turn_id": UUID(data["turn_id"]),
+            "user_id": UUID(data["user_id"]) if data.get("user_id") else None,
+            "user_message": data.get("user_message") or "",
+            "assistant_message": data.get("assistant_message") or "",
+            "timestamp": datetime.fromisoformat(data["timestamp"]),
+        }
+    except (KeyError, TypeError, AttributeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid import line: {e}") from e
+
+
+def _copy_value(value) -> str:
+    """轉換為 COPY text 格式的欄位值"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _insert_postgresql(db: Session, rows: List[dict]) -> set:
+    """COPY 到暫存表後以 INSERT ... ON CONFLICT DO NOTHING 併入 chats，返回實際寫入的主鍵"""
+    columns = ", ".join(IMPORT_COLUMNS)
+    db.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {PG_STAGING_TABLE} "
+        f"(LIKE chats INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    ))
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row[column]) for column in IMPORT_COLUMNS))
+        buffer.write("\n")
+    buffer.seek(0)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {PG_STAGING_TABLE} ({columns}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+    result = db.execute(text(
+        f"INSERT INTO chats ({columns}) SELECT {columns} FROM {PG_STAGING_TABLE} "
+        f"ON CONFLICT (session_id, turn_id) DO NOTHING RETURNING session_id, turn_id"
+    ))
+    return {(UUID(str(session_id)), UUID(str(turn_id))) for session_id, turn_id in result}
+
+
+def _insert_executemany(db: Session, rows: List[dict]) -> set:
+    """以單一 executemany 寫入整批資料，重複的 (session_id, turn_id) 直接略過，返回實際寫入的主鍵"""
+    stmt = (
+        dialect_insert(db, Chat.__table__)
+        .on_conflict_do_nothing(index_elements=["session_id", "turn_id"])
+        .returning(Chat.session_id, Chat.turn_id)
+    )
+    return {(session_id, turn_id) for session_id, turn_id in db.execute(stmt, rows)}
+
+
+def import_batch(db: Session, rows: List[dict]) -> ImportResult:
+    """
+    寫入一批對話，並更新受影響 session 的摘要與每日用量彙總（由呼叫端 commit）
+
+    已存在於熱表或已歸檔到冷儲存的對話都會略過，重複匯入不會產生重複的對話或用量。
+
+    Args:
+        db: 資料庫 session
+        rows: parse_line 解析後的資料
+
+    Returns:
+        該批的匯入結果
+    """
+    # 先在批次內去除重複的主鍵
+    unique_rows = list({(row["session_id"], row["turn_id"]): row for row in rows}.values())
+    if not unique_rows:
+        return ImportResult()
+
+    session_ids = {row["session_id"] for row in unique_rows}
+    archived = archived_turn_keys(db, session_ids)
+    new_rows = [row for row in unique_rows if (row["session_id"], row["turn_id"]) not in archived]
+    inserted = set()
+    if new_rows:
+        if db.get_bind().dialect.name == "postgresql":
+            inserted = _insert_postgresql(db, new_rows)
+        else:
+            inserted = _insert_executemany(db, new_rows)
+
+    rebuild_session_summaries(db, session_ids)
+    record_imported_usage(db, [row for row in new_rows if (row["session_id"], row["turn_id"]) in inserted])
+    return ImportResult(imported=len(inserted), skipped=len(rows) - len(inserted), sessions=session_ids)
+
+
+def write_batch(db: Session, rows: List[dict]) -> ImportResult:
+    """以 run_write_sync 寫入並提交一批對話（SQLite 正式環境下交由單一寫入執行緒）"""
+    result = run_write_sync(db, lambda write_db: import_batch(write_db, rows))
+    # 重建摘要後版本可能不變，快取中的對話記錄需要重新載入
+    session_cache.invalidate(result.sessions)
+    return result
+
+
+def import_lines(db: Session, lines: Iterable, batch_size: int = IMPORT_BATCH_SIZE) -> ImportResult:
+    """
+    匯入 NDJSON 行（格式錯誤的行記為 errors 並略過）
+
+    Args:
+        db: 資料庫 session
+        lines: NDJSON 行（str 或 bytes）
+        batch_size: 每批的列數
+
+    Returns:
+        匯入結果
+    """
+    result = ImportResult()
+    batch = []
+    for line in lines:
+        try:
+            row = parse_line(line)
+        except ValueError as e:
+            result.errors += 1
+            backend_logger.warning(str(e))
+            continue
+        if row is None:
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            result.merge(write_batch(db, batch))
+            batch = []
+    if batch:
+        result.merge(write_batch(db, batch))
+    return result
+
+
+async def import_byte_stream(
+    session_factory: Callable[[], Session],
+    stream: AsyncIterator[bytes],
+    compressed: bool = False,
+    batch_size: int = IMPORT_BATCH_SIZE
+) -> ImportResult:
+    """
+    從非同步位元組串流（例如請求內容）匯入 NDJSON
+
+    邊接收邊分批寫入，資料庫操作在執行緒池中進行以免阻塞事件迴圈。
+    gzip 內容以 DECOMPRESS_CHUNK_BYTES 為單位逐段解壓；超過 IMPORT_MAX_LINE_BYTES 的行
+    不會累積在記憶體中，直接丟棄並記為錯誤。
+
+    Args:
+        session_factory: 建立資料庫 session 的函數
+        stream: 位元組串流
+        compressed: 內容是否為 gzip 壓縮
+        batch_size: 每批的列數
+
+    Returns:
+        匯入結果
+    """
+    decompressor = zlib.decompressobj(wbits=31) if compressed else None
+    result = ImportResult()
+    pending: List[bytes] = []
+    buffer = bytearray()
+    oversized = False
+
+    def reject() -> None:
+        result.errors += 1
+        backend_logger.warning(f"Import line exceeds {IMPORT_MAX_LINE_BYTES} bytes, skipped")
+
+    async def feed(chunk: bytes) -> None:
+        nonlocal pending, oversized
+        start = 0
+        while (newline := chunk.find(b"\n", start)) != -1:
+            if oversized:
+                oversized = False
+            else:
+                buffer.extend(chunk[start:newline])
+                pending.append(bytes(buffer))
+            buffer.clear()
+            start = newline + 1
+        if not oversized:
+            buffer.extend(chunk[start:])
+            if len(buffer) > IMPORT_MAX_LINE_BYTES:
+                # 丟棄這一行其餘的內容，直到下一個換行
+                oversized = True
+                buffer.clear()
+                reject()
+        if len(pending) >= batch_size:
+            batch, pending = pending, []
+            result.merge(await run_in_threadpool(import_lines, db, batch, batch_size))
+
+    db = session_factory()
+    try:
+        async for data in stream:
+            if decompressor is None:
+                await feed(data)
+                continue
+            while True:
+                chunk = decompressor.decompress(data, DECOMPRESS_CHUNK_BYTES)
+                data = decompressor.unconsumed_tail
+                await feed(chunk)
+                # 輸入用完且輸出未達上限時，解壓器內已沒有待輸出的內容
+                if not data and len(chunk) < DECOMPRESS_CHUNK_BYTES:
+                    break
+        if decompressor is not None:
+            await feed(decompressor.flush())
+        if not oversized:
+            pending.append(bytes(buffer))
+        result.merge(await run_in_threadpool(import_lines, db, pending, batch_size))
+    finally:
+        db.close()
+    return result
+
+
+class ImportProgress:
+    """
+    記錄匯入進度以便中斷後續傳
+
+    進度檔保存已提交的行數；每批提交後才更新，因此續傳時最多重做一批（重複資料會被略過）。
+    """
+
+    def __init__(self, path: Optional[str], source: str):
+        self.path = path
+        self.source = source
+        self.line = 0
+        self.imported = 0
+        self.skipped = 0
+        self.errors = 0
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("source") == source:
+                self.line = data.get("line", 0)
+                self.imported = data.get("imported", 0)
+                self.skipped = data.get("skipped", 0)
+                self.errors = data.get("errors", 0)
+
+    def update(self, lines_done: int, result: ImportResult) -> None:
+        self.line = lines_done
+        self.imported += result.imported
+        self.skipped += result.skipped
+        self.errors += result.errors
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "source": self.source,
+                "line": self.line,
+                "imported": self.imported,
+                "skipped": self.skipped,
+                "errors": self.errors,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+def import_file(
+    db: Session,
+    path: str,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    progress_path: Optional[str] = None
+) -> ImportProgress:
+    """
+    匯入 NDJSON 檔案（.gz 自動解壓），支援以進度檔續傳
+
+    Args:
+        db: 資料庫 session
+        path: NDJSON 檔案路徑
+        batch_size: 每批的列數
+        progress_path: 進度檔路徑，None 表示不記錄進度
+
+    Returns:
+        最終進度（含累計統計）
+    """
+    progress = ImportProgress(progress_path, os.path.abspath(path))
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        line_no = 0
+        chunk = []
+        for line in f:
+            line_no += 1
+            if line_no <= progress.line:
+                continue
+            chunk.append(line)
+            if len(chunk) >= batch_size:
+                progress.update(line_no, import_lines(db, chunk, batch_size))
+                chunk = []
+                backend_logger.info(f"Import progress | lines: {line_no}, imported: {progress.imported}")
+        if chunk:
+            progress.update(line_no, import_lines(db, chunk, batch_size))
+    backend_logger.info(
+        f"Import finished | imported: {progress.imported}, skipped: {progress.skipped}, errors: {progress.errors}"
+    )
+    return progress
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="從 NDJSON 匯入聊天記錄")
+    parser.add_argument("path", help="NDJSON 檔案（可為 .gz）")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--progress", help="進度檔路徑，中斷後以相同參數重新執行即可續傳")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        progress = import_file(db, args.path, args.batch_size, args.progress)
+        print(f"Imported {progress.imported}, skipped {progress.skipped}, errors {progress.errors}")
+    finally:
+        db.close()
@@ -0,0 +1,369 @@
+# utils/chat_search.py - 聊天記錄全文檢索（SQLite FTS5 / PostgreSQL tsvector 或 pg_trgm）
+import os
+import argparse
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from uuid import UUID
+
+from sqlalchemy import text, select, func, column, table, literal_column, desc, or_
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.types import DateTime, Float, Text
+from sqlalchemy.orm import Session
+
+from models import Chat
+from utils.compressed_text import text_expression
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# SQLite FTS5 斷詞器：trigram 支援中日韓文字的子字串搜尋，unicode61 以空白與標點斷詞
+SQLITE_FTS_TOKENIZER = os.getenv("CHAT_SEARCH_SQLITE_TOKENIZER", "trigram")
+# PostgreSQL 檢索模式：tsvector（全文檢索）或 trigram（pg_trgm，適合中日韓文字）
+PG_SEARCH_MODE = os.getenv("CHAT_SEARCH_PG_MODE", "tsvector")
+# PostgreSQL 全文檢索設定
+PG_TS_CONFIG = os.getenv("CHAT_SEARCH_PG_CONFIG", "simple")
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+SNIPPET_CHARS = 80
+TRIGRAM_MIN_CHARS = 3
+
+# chats 以 (session_id, turn_id) 為主鍵，隱含的 rowid 在 VACUUM 後可能被重新編號，
+# 因此另以 chats_fts_map 的 INTEGER PRIMARY KEY 作為 FTS5 的穩定 rowid
+_SQLITE_FTS_MAP_TABLE = """
+    CREATE TABLE IF NOT EXISTS chats_fts_map (
+        id INTEGER PRIMARY KEY,
+        session_id NOT NULL,
+        turn_id NOT NULL,
+        UNIQUE (session_id, turn_id)
+    )
+"""
+# 訊息可能以壓縮的 BLOB 儲存（見 utils/compressed_text.py），索引與 snippet 一律透過 chat_text() 讀取原文
+_SQLITE_FTS_CONTENT_VIEW = """
+    CREATE VIEW IF NOT EXISTS chats_fts_content AS
+    SELECT m.id AS id, chat_text(c.user_message) AS user_message, chat_text(c.assistant_message) AS assistant_message
+    FROM chats_fts_map AS m JOIN chats AS c ON c.session_id = m.session_id AND c.turn_id = m.turn_id
+"""
+_SQLITE_FTS_TABLE = (
+    "CREATE VIRTUAL TABLE chats_fts USING fts5("
+    "user_message, assistant_message, content='chats_fts_content', content_rowid='id', "
+    "tokenize='{tokenizer}')"
+)
+_SQLITE_FTS_TRIGGER_NAMES = ["chats_fts_ai", "chats_fts_ad", "chats_fts_au"]
+_SQLITE_FTS_MAP_ID = "(SELECT id FROM chats_fts_map WHERE session_id = {row}.session_id AND turn_id = {row}.turn_id)"
+_SQLITE_FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER chats_fts_ai AFTER INSERT ON chats BEGIN
+        -- 對照已存在時沿用原本的 id：REPLACE 會換成新的 id，留下以舊 id 為鍵的 FTS 列
+        INSERT INTO chats_fts_map(session_id, turn_id) VALUES (new.session_id, new.turn_id)
+        ON CONFLICT (session_id, turn_id) DO NOTHING;
+        INSERT INTO chats_fts(rowid, user_message, assistant_message)
+        VALUES ({_SQLITE_FTS_MAP_ID.format(row="new")}, chat_text(new.user_message), chat_text(new.assistant_message));
+    END
+    """,
+    f"""
+    CREATE TRIGGER chats_fts_ad AFTER DELETE ON chats BEGIN
+        INSERT INTO chats_fts(chats_fts, rowid, user_message, assistant_message)
+        VALUES ('delete', {_SQLITE_FTS_MAP_ID.format(row="old")},
+                chat_text(old.user_message), chat_text(old.assistant_message));
+        DELETE FROM chats_fts_map WHERE session_id = old.session_id AND turn_id = old.turn_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER chats_fts_au AFTER UPDATE OF user_message, assistant_message ON chats BEGIN
+        INSERT INTO chats_fts(chats_fts, rowid, user_message, assistant_message)
+        VALUES ('delete', {_SQLITE_FTS_MAP_ID.format(row="old")},
+                chat_text(old.user_message), chat_text(old.assistant_message));
+        INSERT INTO chats_fts(rowid, user_message, assistant_message)
+        VALUES ({_SQLITE_FTS_MAP_ID.format(row="new")}, chat_text(new.user_message), chat_text(new.assistant_message));
+    END
+    """,
+]
+
+# PostgreSQL 索引與查詢必須使用完全相同的表達式，才能命中表達式索引
+_PG_DOCUMENT = "(coalesce(user_message, '') || ' ' || coalesce(assistant_message, ''))"
+
+
+def _pg_tsvector() -> str:
+    return f"to_tsvector('{PG_TS_CONFIG}'::regconfig, {_PG_DOCUMENT})"
+
+
+def ensure_search_index(engine) -> None:
+    """
+    建立全文檢索索引（可重複呼叫）
+
+    - SQLite: 以 chats 為外部內容的 FTS5 虛擬表，並以觸發器在新增、更新、刪除時增量維護；
+      FTS5 的 rowid 來自 chats_fts_map 的 INTEGER PRIMARY KEY，VACUUM 後仍然有效
+    - PostgreSQL: tsvector 表達式 GIN 索引，或 pg_trgm 的 GIN 索引（由資料庫自動維護）
+    """
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as connection:
+            if dialect == "sqlite":
+                view = connection.execute(
+                    text("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'chats_fts_content'")
+                ).scalar()
+                definition = connection.execute(
+                    text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'chats_fts'")
+                ).scalar()
+                if (view is not None and "chats_fts_map" not in view) or (
+                        definition is not None and "chats_fts_content" not in definition):
+                    # 舊版索引以 chats 的隱含 rowid 為鍵（或直接以 chats 為內容表），需要重建
+                    connection.execute(text("DROP VIEW IF EXISTS chats_fts_content"))
+                    connection.execute(text("DROP TABLE IF EXISTS chats_fts"))
+                    definition = None
+                connection.execute(text(_SQLITE_FTS_MAP_TABLE))
+                connection.execute(text(_SQLITE_FTS_CONTENT_VIEW))
+                if definition is None:
+                    connection.execute(text(_SQLITE_FTS_TABLE.format(tokenizer=SQLITE_FTS_TOKENIZER)))
+                    # 首次建立時回填既有的對話（索引不存在期間的寫入不會更新對照表，一併重建）
+                    connection.execute(text("DELETE FROM chats_fts_map"))
+                    connection.execute(text(
+                        "INSERT INTO chats_fts_map(session_id, turn_id) SELECT session_id, turn_id FROM chats"
+                    ))
+                    connection.execute(text("INSERT INTO chats_fts(chats_fts) VALUES ('rebuild')"))
+                    backend_logger.info(f"Created SQLite FTS5 index (tokenizer: {SQLITE_FTS_TOKENIZER})")
+                # 每次都重新建立觸發器，確保使用最新的定義
+                for name in _SQLITE_FTS_TRIGGER_NAMES:
+                    connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+                for trigger in _SQLITE_FTS_TRIGGERS:
+                    connection.execute(text(trigger))
+            elif dialect == "postgresql":
+                if PG_SEARCH_MODE == "trigram":
+                    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    connection.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS idx_chats_trgm ON chats USING GIN ({_PG_DOCUMENT} gin_trgm_ops)"
+                    ))
+                else:
+                    connection.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS idx_chats_fts ON chats USING GIN ({_pg_tsvector()})"
+                    ))
+            else:
+                backend_logger.warning(f"Full-text search index is not supported for dialect: {dialect}")
+    except Exception as e:
+        backend_logger.error(f"Failed to create full-text search index: {e}")
+
+
+def rebuild_search_index(engine) -> None:
+    """重建全文檢索索引（例如更換斷詞器後）"""
+    with engine.begin() as connection:
+        if engine.dialect.name == "sqlite":
+            for name in _SQLITE_FTS_TRIGGER_NAMES:
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+            connection.execute(text("DROP TABLE IF EXISTS chats_fts"))
+            connection.execute(text("DROP VIEW IF EXISTS chats_fts_content"))
+            connection.execute(text("DROP TABLE IF EXISTS chats_fts_map"))
+        elif engine.dialect.name == "postgresql":
+            connection.execute(text("DROP INDEX IF EXISTS idx_chats_fts"))
+            connection.execute(text("DROP INDEX IF EXISTS idx_chats_trgm"))
+    ensure_search_index(engine)
+
+
+def make_snippet(content: Optional[str], term: str, width: int = SNIPPET_CHARS) -> str:
+    """
+    擷取關鍵字附近的文字並加上高亮標記（用於沒有原生 snippet 函數的檢索路徑）
+
+    Args:
+        content: 原始文字
+        term: 關鍵字
+        width: 片段的大致長度
+
+    Returns:
+        高亮後的片段；找不到關鍵字時返回開頭的文字
+    """
+    if not content:
+        return ""
+    position = content.lower().find(term.lower())
+    if position == -1:
+        return content[:width] + ("…" if len(content) > width else "")
+    start = max(position - width // 2, 0)
+    end = min(position + len(term) + width // 2, len(content))
+    return (
+        ("…" if start > 0 else "")
+        + content[start:position]
+        + HIGHLIGHT_START + content[position:position + len(term)] + HIGHLIGHT_END
+        + content[position + len(term):end]
+        + ("…" if end < len(content) else "")
+    )
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _fts5_query(terms: List[str]) -> str:
+    # 每個詞以片語形式引用，避免使用者輸入被解析為 FTS5 查詢語法
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _apply_filters(stmt, user_id, start, end, user_column, timestamp_column):
+    if user_id is not None:
+        stmt = stmt.where(user_column == user_id)
+    if start is not None:
+        stmt = stmt.where(timestamp_column >= start)
+    if end is not None:
+        stmt = stmt.where(timestamp_column < end)
+    return stmt
+
+
+def _search_sqlite(db, terms, user_id, start, end, limit):
+    fts = table("chats_fts", column("rowid"))
+    fts_map = table("chats_fts_map", column("id"), column("session_id"), column("turn_id"))
+    fts_ref = literal_column("chats_fts")
+    stmt = (
+        select(
+            Chat.session_id,
+            Chat.turn_id,
+            Chat.user_id,
+            Chat.timestamp,
+            func.snippet(fts_ref, 0, HIGHLIGHT_START, HIGHLIGHT_END, "…", 16).label("user_snippet"),
+            func.snippet(fts_ref, 1, HIGHLIGHT_START, HIGHLIGHT_END, "…", 16).label("assistant_snippet"),
+            (-func.bm25(fts_ref)).label("rank"),
+        )
+        .select_from(
+            fts.join(fts_map, fts_map.c.id == fts.c.rowid)
+            .join(Chat.__table__, (Chat.session_id == fts_map.c.session_id) & (Chat.turn_id == fts_map.c.turn_id))
+        )
+        .where(fts_ref.op("MATCH")(_fts5_query(terms)))
+    )
+    stmt = _apply_filters(stmt, user_id, start, end, Chat.user_id, Chat.timestamp)
+    stmt = stmt.order_by(desc("rank")).limit(limit)
+    return [dict(row._mapping) for row in db.execute(stmt)]
+
+
+def _search_postgres_tsvector(db, query, user_id, start, end, limit):
+    filters = []
+    if user_id is not None:
+        filters.append("user_id = :user_id")
+    if start is not None:
+        filters.append("timestamp >= :start")
+    if end is not None:
+        filters.append("timestamp < :end")
+    where = "".join(f" AND {f}" for f in filters)
+    headline_options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=30, MinWords=10"
+    # 先以索引篩選並排序取前 limit 筆，再只對這些結果產生 ts_headline
+    stmt = text(f"""
+        SELECT hits.session_id, hits.turn_id, hits.user_id, hits.timestamp, hits.rank,
+               ts_headline('{PG_TS_CONFIG}', coalesce(hits.user_message, ''), hits.q, :headline) AS user_snippet,
+               ts_headline('{PG_TS_CONFIG}', coalesce(hits.assistant_message, ''), hits.q, :headline) AS assistant_snippet
+        FROM (
+            SELECT session_id, turn_id, user_id, timestamp, user_message, assistant_message, q,
+                   ts_rank({_pg_tsvector()}, q) AS rank
+            FROM chats, websearch_to_tsquery('{PG_TS_CONFIG}', :query) AS q
+            WHERE {_pg_tsvector()} @@ q{where}
+            ORDER BY rank DESC
+            LIMIT :limit
+        ) AS hits
+        ORDER BY hits.rank DESC
+    """).columns(
+        column("session_id", PG_UUID(as_uuid=True)),
+        column("turn_id", PG_UUID(as_uuid=True)),
+        column("user_id", PG_UUID(as_uuid=True)),
+        column("timestamp", DateTime()),
+        column("rank", Float()),
+        column("user_snippet", Text()),
+        column("assistant_snippet", Text()),
+    )
+    params = {"query": query, "limit": limit, "headline": headline_options,
+              "user_id": user_id, "start": start, "end": end}
+    return [dict(row._mapping) for row in db.execute(stmt, params)]
+
+
+def _search_substring(db, terms, user_id, start, end, limit, document=None, rank_expression=None):
+    """
+    以子字串比對檢索
+
+    提供 document 表達式時以它做 ILIKE 比對（PostgreSQL pg_trgm 表達式索引可加速），
+    否則分別比對兩個訊息欄位（全表掃描）。
+    """
+    stmt = select(Chat.session_id, Chat.turn_id, Chat.user_id, Chat.timestamp,
+                  Chat.user_message, Chat.assistant_message)
+    dialect = db.get_bind().dialect.name
+    user_message = text_expression(Chat.user_message, dialect)
+    assistant_message = text_expression(Chat.assistant_message, dialect)
+    for term in terms:
+        pattern = f"%{_escape_like(term)}%"
+        if document is not None:
+            stmt = stmt.where(document.ilike(pattern, escape="\\"))
+        else:
+            stmt = stmt.where(or_(
+                user_message.ilike(pattern, escape="\\"),
+                assistant_message.ilike(pattern, escape="\\")
+            ))
+    stmt = _apply_filters(stmt, user_id, start, end, Chat.user_id, Chat.timestamp)
+    if rank_expression is not None:
+        stmt = stmt.add_columns(rank_expression.label("rank")).order_by(desc("rank"), desc(Chat.timestamp))
+    else:
+        stmt = stmt.order_by(desc(Chat.timestamp))
+    rows = db.execute(stmt.limit(limit))
+
+    results = []
+    for row in rows:
+        results.append({
+            "session_id": row.session_id,
+            "turn_id": row.turn_id,
+            "user_id": row.user_id,
+            "timestamp": row.timestamp,
+            "rank": float(getattr(row, "rank", 0.0) or 0.0),
+            "user_snippet": make_snippet(row.user_message, terms[0]),
+            "assistant_snippet": make_snippet(row.assistant_message, terms[0]),
+        })
+    return results
+
+
+def search_chats(
+    db: Session,
+    query: str,
+    user_id: Optional[UUID] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = 20
+) -> List[Dict[str, Any]]:
+    """
+    以全文檢索索引搜尋聊天記錄
+
+    索引只涵蓋 chats 熱表；已歸檔到冷儲存的對話（utils/chat_archive.py）不會出現在結果中。
+
+    Args:
+        db: 資料庫 session
+        query: 搜尋字串，以空白分隔的多個詞需同時出現
+        user_id: 只搜尋該用戶的對話
+        start: 起始時間（含）
+        end: 結束時間（不含）
+        limit: 返回的最大筆數
+
+    Returns:
+        依相關性排序的結果列表，每筆包含 session_id、turn_id、user_id、timestamp、rank
+        以及以 <mark> 標記關鍵字的 user_snippet、assistant_snippet
+    """
+    terms = query.split()
+    if not terms:
+        return []
+
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        # trigram 斷詞器無法比對少於三個字元的詞，改用子字串比對
+        if SQLITE_FTS_TOKENIZER == "trigram" and any(len(term) < TRIGRAM_MIN_CHARS for term in terms):
+            return _search_substring(db, terms, user_id, start, end, limit)
+        return _search_sqlite(db, terms, user_id, start, end, limit)
+    if dialect == "postgresql":
+        if PG_SEARCH_MODE == "trigram":
+            document = literal_column(_PG_DOCUMENT)
+            return _search_substring(db, terms, user_id, start, end, limit, document=document,
+                                     rank_expression=func.word_similarity(query, document))
+        return _search_postgres_tsvector(db, query, user_id, start, end, limit)
+    return _search_substring(db, terms, user_id, start, end, limit)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="管理聊天記錄全文檢索索引")
+    parser.add_argument("command", choices=["ensure", "rebuild"])
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        rebuild_search_index(engine)
+    else:
+        ensure_search_index(engine)
+    print(f"Search index {args.command} finished ({engine.dialect.name})")
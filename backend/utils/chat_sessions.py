@@ -0,0 +1,230 @@
+# utils/chat_sessions.py - chat_sessions 摘要表的增量維護與重建
+import argparse
+from datetime import datetime
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, case, func, literal, null, select, text, union_all
+from sqlalchemy.orm import Session
+from sqlalchemy.types import DateTime
+
+from models import Chat, ChatArchive, ChatSession
+from utils.db_upsert import dialect_insert
+from utils.compressed_text import text_expression
+from utils.backend_logger import BackendLogger
+from utils.session_cache import session_cache
+from utils.sqlite_profile import run_write_sync
+
+backend_logger = BackendLogger().logger
+
+# 摘要表中保存的訊息預覽長度（字元）
+PREVIEW_LENGTH = 200
+# 重建指定 session 時每批處理的數量
+REBUILD_BATCH_SIZE = 500
+
+
+def make_preview(message: Optional[str]) -> str:
+    """截取訊息開頭作為預覽"""
+    return (message or "")[:PREVIEW_LENGTH]
+
+
+def record_turn(db: Session, chat: Chat) -> None:
+    """
+    寫入新一輪對話時更新 session 摘要（由呼叫端 commit）
+
+    第一次出現的 session 會新增一筆摘要，否則累加對話輪數並更新最新時間與預覽。
+
+    Args:
+        db: 資料庫 session
+        chat: 剛寫入的對話
+    """
+    now = datetime.now()
+    stmt = dialect_insert(db, ChatSession).values(
+        session_id=chat.session_id,
+        user_id=chat.user_id,
+        first_timestamp=chat.timestamp,
+        last_timestamp=chat.timestamp,
+        turn_count=1,
+        last_user_message_preview=make_preview(chat.user_message),
+        last_assistant_message_preview=make_preview(chat.assistant_message),
+        updated_at=now
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["session_id"],
+        set_={
+            "user_id": func.coalesce(ChatSession.user_id, stmt.excluded.user_id),
+            "last_timestamp": stmt.excluded.last_timestamp,
+            "turn_count": ChatSession.turn_count + 1,
+            "last_user_message_preview": stmt.excluded.last_user_message_preview,
+            "last_assistant_message_preview": stmt.excluded.last_assistant_message_preview,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    )
+    db.execute(stmt)
+
+
+def record_response(db: Session, chat: Chat) -> None:
+    """
+    助手回覆完成後更新 session 摘要的回覆預覽（由呼叫端 commit）
+
+    只有當該輪仍是 session 最新的一輪時才更新預覽；更新時間則一律更新，
+    讓 session 版本（ETag 與對話記錄快取）反映較早一輪的回覆。
+
+    Args:
+        db: 資料庫 session
+        chat: 已填入 assistant_message 的對話
+    """
+    db.query(ChatSession).filter(
+        ChatSession.session_id == chat.session_id
+    ).update(
+        {
+            ChatSession.last_assistant_message_preview: case(
+                (ChatSession.last_timestamp == chat.timestamp, make_preview(chat.assistant_message)),
+                else_=ChatSession.last_assistant_message_preview
+            ),
+            ChatSession.updated_at: datetime.now(),
+        },
+        synchronize_session=False
+    )
+
+
+def session_version(db: Session, session_id: UUID) -> tuple:
+    """以 chat_sessions 主鍵查詢 session 的版本（對話輪數與最後更新時間）"""
+    row = (
+        db.query(ChatSession.turn_count, ChatSession.updated_at)
+        .filter(ChatSession.session_id == session_id)
+        .first()
+    )
+    return tuple(row) if row else (0, None)
+
+
+def _rebuild(db: Session, session_ids: Optional[list]) -> int:
+    dialect = db.get_bind().dialect.name
+    delete_query = db.query(ChatSession)
+    hot_query = select(
+        Chat.session_id,
+        func.min(Chat.timestamp).label("first_timestamp"),
+        func.max(Chat.timestamp).label("last_timestamp"),
+        func.count(Chat.turn_id).label("turn_count")
+    )
+    # 已歸檔到冷儲存的對話計入輪數與第一輪時間；最新一輪一律保留在熱表，因此最後時間只取熱表
+    archive_query = select(
+        ChatArchive.session_id,
+        func.min(ChatArchive.first_timestamp).label("first_timestamp"),
+        null().cast(DateTime).label("last_timestamp"),
+        func.sum(ChatArchive.turn_count).label("turn_count")
+    )
+    if session_ids is not None:
+        delete_query = delete_query.filter(ChatSession.session_id.in_(session_ids))
+        hot_query = hot_query.where(Chat.session_id.in_(session_ids))
+        archive_query = archive_query.where(ChatArchive.session_id.in_(session_ids))
+    delete_query.delete(synchronize_session=False)
+    combined = union_all(
+        hot_query.group_by(Chat.session_id),
+        archive_query.group_by(ChatArchive.session_id)
+    ).subquery()
+    stats = (
+        select(
+            combined.c.session_id,
+            func.min(combined.c.first_timestamp).label("first_timestamp"),
+            func.max(combined.c.last_timestamp).label("last_timestamp"),
+            func.sum(combined.c.turn_count).label("turn_count")
+        )
+        .group_by(combined.c.session_id)
+        .subquery()
+    )
+
+    # 以每個 session 最新一輪的內容作為預覽
+    latest = (
+        select(
+            Chat.session_id,
+            Chat.user_id,
+            stats.c.first_timestamp,
+            stats.c.last_timestamp,
+            stats.c.turn_count,
+            func.substr(text_expression(Chat.user_message, dialect), 1, PREVIEW_LENGTH),
+            func.substr(text_expression(Chat.assistant_message, dialect), 1, PREVIEW_LENGTH),
+            literal(datetime.now())
+        )
+        .join(
+            stats,
+            and_(Chat.session_id == stats.c.session_id, Chat.timestamp == stats.c.last_timestamp)
+        )
+    )
+    stmt = dialect_insert(db, ChatSession).from_select(
+        [
+            "session_id", "user_id", "first_timestamp", "last_timestamp", "turn_count",
+            "last_user_message_preview", "last_assistant_message_preview", "updated_at",
+        ],
+        latest
+    ).on_conflict_do_nothing(index_elements=["session_id"])
+    return db.execute(stmt).rowcount
+
+
+def rebuild_session_summaries(db: Session, session_ids: Optional[Iterable[UUID]] = None) -> int:
+    """
+    從 chats 表與冷儲存索引重建 session 摘要（由呼叫端 commit，可作為批次寫入的一部分）
+
+    Args:
+        db: 資料庫 session
+        session_ids: 只重建指定的 session；為 None 時重建全部
+
+    Returns:
+        重建的 session 數量
+    """
+    if session_ids is None:
+        return _rebuild(db, None)
+    session_ids = list(session_ids)
+    rebuilt = 0
+    for i in range(0, len(session_ids), REBUILD_BATCH_SIZE):
+        rebuilt += _rebuild(db, session_ids[i:i + REBUILD_BATCH_SIZE])
+    return rebuilt
+
+
+def rebuild_chat_sessions(db: Session, session_ids: Optional[Iterable[UUID]] = None) -> int:
+    """
+    從 chats 表重建 session 摘要並 commit（回填或修復）
+
+    Args:
+        db: 資料庫 session
+        session_ids: 只重建指定的 session；為 None 時重建全部
+
+    Returns:
+        重建的 session 數量
+    """
+    if session_ids is not None:
+        session_ids = list(session_ids)
+    rebuilt = run_write_sync(db, lambda write_db: rebuild_session_summaries(write_db, session_ids))
+    # 重建後版本可能不變（例如對話輪數相同），快取中的對話記錄需要重新載入
+    session_cache.invalidate(session_ids)
+    backend_logger.info(f"Rebuilt chat_sessions | sessions: {rebuilt}")
+    return rebuilt
+
+
+def backfill_chat_sessions_if_empty(engine) -> None:
+    """摘要表為空而 chats 表有資料時（例如升級後第一次啟動）自動回填"""
+    with engine.connect() as connection:
+        has_sessions = connection.execute(text("SELECT 1 FROM chat_sessions LIMIT 1")).first()
+        has_chats = connection.execute(text("SELECT 1 FROM chats LIMIT 1")).first()
+    if has_chats and not has_sessions:
+        backend_logger.info("chat_sessions is empty, backfilling from chats...")
+        db = Session(bind=engine)
+        try:
+            rebuild_chat_sessions(db)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="重建 chat_sessions 摘要表")
+    parser.add_argument("--session-id", action="append", type=UUID, help="只重建指定的 session（可重複）")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        count = rebuild_chat_sessions(db, args.session_id)
+        print(f"Rebuilt {count} sessions")
+    finally:
+        db.close()
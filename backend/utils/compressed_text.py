@@ -0,0 +1,274 @@
+# utils/compressed_text.py - 訊息內容的透明壓縮（SQLAlchemy 欄位類型與遷移工具）
+import argparse
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.types import Text, TypeDecorator
+
+from utils.backend_logger import BackendLogger
+from utils.sqlite_profile import run_write_sync
+
+try:
+    import zstandard
+except ImportError:  # 未安裝時只能使用 zlib
+    zstandard = None
+
+backend_logger = BackendLogger().logger
+
+# 壓縮值的第一個位元組標記壓縮方式；未壓縮的值以一般字串儲存，舊資料不需轉換即可讀取
+HEADER_ZLIB = 0x01
+HEADER_ZSTD = 0x02
+HEADER_ZSTD_DICT = 0x03
+# 註冊到 SQLite 連線的解壓函數名稱，供觸發器、檢視與 SQL 表達式使用
+SQLITE_TEXT_FUNCTION = "chat_text"
+
+
+@dataclass
+class CompressionSettings:
+    """
+    壓縮設定
+
+    - CHAT_COMPRESSION: off（默認）、zlib 或 zstd（需要 zstandard，未安裝時記錄警告並改用 zlib）
+    - CHAT_COMPRESSION_MIN_BYTES: 超過此大小（UTF-8 位元組）才壓縮，默認 1024
+    - CHAT_COMPRESSION_DICT: zstd 字典檔路徑（以 train-dict 產生），可提升短訊息的壓縮率
+    """
+    mode: str = "off"
+    min_bytes: int = 1024
+    level: int = 3
+    dictionary_path: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "CompressionSettings":
+        settings = cls(
+            mode=os.getenv("CHAT_COMPRESSION", "off").lower(),
+            min_bytes=int(os.getenv("CHAT_COMPRESSION_MIN_BYTES", "1024")),
+            level=int(os.getenv("CHAT_COMPRESSION_LEVEL", "3")),
+            dictionary_path=os.getenv("CHAT_COMPRESSION_DICT") or None,
+        )
+        if settings.mode == "zstd" and zstandard is None:
+            backend_logger.warning("CHAT_COMPRESSION=zstd but zstandard is not installed, falling back to zlib")
+            settings.mode = "zlib"
+        return settings
+
+
+compression_settings = CompressionSettings.from_env()
+_dictionary_cache = {}
+
+
+def _load_dictionary(path: Optional[str]):
+    if not path:
+        return None
+    if path not in _dictionary_cache:
+        with open(path, "rb") as f:
+            _dictionary_cache[path] = zstandard.ZstdCompressionDict(f.read())
+    return _dictionary_cache[path]
+
+
+def compress_text(value: str, settings: CompressionSettings = None) -> object:
+    """
+    依設定壓縮字串
+
+    Returns:
+        壓縮後的 bytes（含標頭位元組）；未啟用、小於門檻或壓縮無效時返回原字串
+    """
+    settings = settings or compression_settings
+    if settings.mode == "off":
+        return value
+    raw = value.encode("utf-8")
+    if len(raw) < settings.min_bytes:
+        return value
+    if settings.mode == "zstd" and zstandard is not None:
+        dictionary = _load_dictionary(settings.dictionary_path)
+        if dictionary is not None:
+            payload = bytes([HEADER_ZSTD_DICT]) + zstandard.ZstdCompressor(
+                level=settings.level, dict_data=dictionary
+            ).compress(raw)
+        else:
+            payload = bytes([HEADER_ZSTD]) + zstandard.ZstdCompressor(level=settings.level).compress(raw)
+    else:
+        payload = bytes([HEADER_ZLIB]) + zlib.compress(raw, min(settings.level * 2, 9))
+    return payload if len(payload) < len(raw) else value
+
+
+def decompress_text(value, settings: CompressionSettings = None):
+    """還原 compress_text 的結果；一般字串與 None 直接返回"""
+    settings = settings or compression_settings
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    header, payload = data[0], data[1:]
+    if header == HEADER_ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    if header in (HEADER_ZSTD, HEADER_ZSTD_DICT):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed messages")
+        dictionary = _load_dictionary(settings.dictionary_path) if header == HEADER_ZSTD_DICT else None
+        if header == HEADER_ZSTD_DICT and dictionary is None:
+            raise RuntimeError("CHAT_COMPRESSION_DICT is required to read dictionary-compressed messages")
+        decompressor = zstandard.ZstdDecompressor(dict_data=dictionary) if dictionary else zstandard.ZstdDecompressor()
+        return decompressor.decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown compressed text header: {header}")
+
+
+class CompressedText(TypeDecorator):
+    """
+    在 SQLite 上透明壓縮大型文字的欄位類型
+
+    SQLite 的 TEXT 欄位可以直接存放 BLOB，因此不需要變更資料表結構。
+    PostgreSQL 上不做應用層壓縮：大型值本來就會經 TOAST 壓縮（可改用 lz4），
+    而且全文檢索的表達式索引需要讀取原始文字。
+    """
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite":
+            return value
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
+
+
+def text_expression(column, dialect_name: str):
+    """返回可在 SQL 中使用的文字表達式（SQLite 上先解壓）"""
+    if dialect_name == "sqlite":
+        return getattr(func, SQLITE_TEXT_FUNCTION)(column)
+    return column
+
+
+def register_sqlite_functions(engine) -> None:
+    """在每個 SQLite 連線上註冊解壓函數（全文檢索的觸發器與檢視需要使用）"""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _register(dbapi_connection, connection_record):
+        dbapi_connection.create_function(
+            SQLITE_TEXT_FUNCTION, 1, lambda value: decompress_text(value), deterministic=True
+        )
+
+
+def migrate_messages(engine, batch_size: int = 1000, decompress: bool = False) -> int:
+    """
+    依目前設定重新寫入既有訊息
+
+    - SQLite: 以 rowid 分批讀取並重新寫入，符合門檻的訊息會被壓縮（decompress=True 時還原為文字）；
+      每批經由 run_write_sync 提交，SQLITE_PROFILE=production 時由單一寫入執行緒執行
+    - PostgreSQL: 將訊息欄位的 TOAST 壓縮改為 lz4（PostgreSQL 14 以上，只影響之後寫入的值）
+
+    Returns:
+        更新的列數
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            for name in ("user_message", "assistant_message"):
+                connection.execute(text(f"ALTER TABLE chats ALTER COLUMN {name} SET COMPRESSION lz4"))
+        backend_logger.info("Set lz4 TOAST compression on chats messages (run VACUUM FULL to rewrite old rows)")
+        return 0
+
+    settings = CompressionSettings(mode="off") if decompress else compression_settings
+
+    def migrate_batch(db: Session, last_rowid: int) -> tuple:
+        rows = db.execute(
+            text(
+                "SELECT rowid, user_message, assistant_message FROM chats "
+                "WHERE rowid > :last ORDER BY rowid LIMIT :limit"
+            ),
+            {"last": last_rowid, "limit": batch_size}
+        ).all()
+        changed = 0
+        for row in rows:
+            values = {}
+            for name in ("user_message", "assistant_message"):
+                original = getattr(row, name)
+                plain = decompress_text(original)
+                stored = compress_text(plain, settings) if plain is not None else None
+                if stored != original:
+                    values[name] = stored
+            if values:
+                db.execute(
+                    text(
+                        "UPDATE chats SET " + ", ".join(f"{name} = :{name}" for name in values) +
+                        " WHERE rowid = :rowid"
+                    ),
+                    {**values, "rowid": row.rowid}
+                )
+                changed += 1
+        return changed, rows[-1].rowid if rows else None
+
+    updated = 0
+    last_rowid = 0
+    db = Session(bind=engine)
+    try:
+        while True:
+            changed, last_rowid = run_write_sync(db, lambda write_db: migrate_batch(write_db, last_rowid))
+            updated += changed
+            if last_rowid is None:
+                break
+    finally:
+        db.close()
+    backend_logger.info(f"Message compression migration finished | updated rows: {updated}")
+    return updated
+
+
+def storage_stats(engine) -> dict:
+    """統計 SQLite 中訊息欄位的儲存大小（已壓縮與未壓縮分開計算）"""
+    with engine.connect() as connection:
+        rows = connection.execute(text("""
+            SELECT typeof(user_message) = 'blob' AS compressed, count(*), sum(length(CAST(user_message AS BLOB)))
+            FROM chats GROUP BY 1
+            UNION ALL
+            SELECT typeof(assistant_message) = 'blob', count(*), sum(length(CAST(assistant_message AS BLOB)))
+            FROM chats GROUP BY 1
+        """)).all()
+    stats = {"compressed_values": 0, "compressed_bytes": 0, "plain_values": 0, "plain_bytes": 0}
+    for compressed, count, size in rows:
+        prefix = "compressed" if compressed else "plain"
+        stats[f"{prefix}_values"] += count
+        stats[f"{prefix}_bytes"] += size or 0
+    return stats
+
+
+def train_dictionary(engine, output_path: str, dict_size: int = 112640, samples: int = 20000) -> int:
+    """以現有訊息訓練 zstd 字典，返回字典大小"""
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to train a dictionary")
+    from models import Chat
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(Chat.user_message, Chat.assistant_message).order_by(func.random()).limit(samples)
+        ).all()
+    corpus = [message.encode("utf-8") for row in rows for message in row if message]
+    dictionary = zstandard.train_dictionary(dict_size, corpus)
+    with open(output_path, "wb") as f:
+        f.write(dictionary.as_bytes())
+    return len(dictionary.as_bytes())
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="訊息壓縮的遷移與統計工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="依 CHAT_COMPRESSION 設定重新寫入既有訊息")
+    migrate_parser.add_argument("--batch-size", type=int, default=1000)
+    migrate_parser.add_argument("--decompress", action="store_true", help="將已壓縮的訊息還原為文字")
+    subparsers.add_parser("stats", help="顯示 SQLite 中訊息的儲存大小")
+    train_parser = subparsers.add_parser("train-dict", help="以現有訊息訓練 zstd 字典")
+    train_parser.add_argument("output")
+    train_parser.add_argument("--size", type=int, default=112640)
+    train_parser.add_argument("--samples", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(f"Updated {migrate_messages(engine, args.batch_size, args.decompress)} rows")
+    elif args.command == "stats":
+        print(storage_stats(engine))
+    else:
+        print(f"Wrote {train_dictionary(engine, args.output, args.size, args.samples)} byte dictionary to {args.output}")
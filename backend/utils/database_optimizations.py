@@ -1,14 +1,22 @@
 # utils/database_optimizations.py - 數據庫查詢優化工具
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, or_
-from models import Chat
+from sqlalchemy import func, desc, and_, or_, case
+from models import Chat, ChatSession, UserDailyUsage
 from typing import List, Optional, Dict, Any
+from uuid import UUID
+from utils.chat_search import search_chats
+from utils.chat_archive import load_archived_turns
 import logging
 
 logger = logging.getLogger(__name__)
 
 class ChatQueryOptimizer:
-    """聊天記錄查詢優化器"""
+    """
+    聊天記錄查詢優化器
+
+    所有方法皆為唯讀查詢，呼叫端應傳入 get_read_db 或 read_session() 取得的 session，
+    以便在設定副本時分散主資料庫的負載。
+    """
     
     @staticmethod
     def get_paginated_history(
@@ -71,7 +79,7 @@ class ChatQueryOptimizer:
     ) -> List[Chat]:
         """
         優化的會話歷史查詢
-        使用會話索引
+        使用會話索引，並合併已歸檔到冷儲存的對話（以未加入 session 的 Chat 物件返回）
         """
         try:
             query = db.query(Chat).filter(Chat.session_id == session_id)
@@ -81,6 +89,20 @@ class ChatQueryOptimizer:
             
             # 使用索引優化的排序
             items = query.order_by(Chat.timestamp).all()
+
+            archived = load_archived_turns(db, session_id, user_id)
+            if archived:
+                items = sorted([
+                    Chat(
+                        session_id=UUID(turn["session_id"]),
+                        turn_id=UUID(turn["turn_id"]),
+                        user_id=UUID(turn["user_id"]) if turn["user_id"] else None,
+                        user_message=turn["user_message"],
+                        assistant_message=turn["assistant_message"],
+                        timestamp=turn["timestamp"]
+                    )
+                    for turn in archived
+                ] + items, key=lambda chat: chat.timestamp)
             
             logger.info(f"Session history query executed: session_id={session_id}, user_id={user_id}, count={len(items)}")
             
@@ -101,25 +123,19 @@ class ChatQueryOptimizer:
         優化的查詢，只獲取每個會話的最新消息
         """
         try:
-            # 使用子查詢獲取每個會話的最新時間戳
-            subquery = db.query(
-                Chat.session_id,
-                func.max(Chat.timestamp).label('latest_timestamp')
+            # 使用 chat_sessions 摘要表的最新時間戳，避免對 chats 表分組聚合
+            query = db.query(Chat).join(
+                ChatSession,
+                and_(
+                    Chat.session_id == ChatSession.session_id,
+                    Chat.timestamp == ChatSession.last_timestamp
+                )
             )
             
             if user_id:
-                subquery = subquery.filter(Chat.user_id == user_id)
-            
-            subquery = subquery.group_by(Chat.session_id).subquery()
+                query = query.filter(ChatSession.user_id == user_id)
             
-            # 主查詢獲取最新消息的詳細信息
-            query = db.query(Chat).join(
-                subquery,
-                and_(
-                    Chat.session_id == subquery.c.session_id,
-                    Chat.timestamp == subquery.c.latest_timestamp
-                )
-            ).order_by(desc(Chat.timestamp)).limit(limit)
+            query = query.order_by(desc(ChatSession.last_timestamp)).limit(limit)
             
             items = query.all()
             
@@ -140,23 +156,17 @@ class ChatQueryOptimizer:
     ) -> List[Chat]:
         """
         優化的消息搜索
-        使用文本搜索和索引
+        使用全文檢索索引（SQLite FTS5 / PostgreSQL GIN）
         """
         try:
-            query = db.query(Chat)
-            
-            # 添加文本搜索條件
-            search_filter = or_(
-                Chat.user_message.ilike(f'%{search_term}%'),
-                Chat.assistant_message.ilike(f'%{search_term}%')
-            )
-            query = query.filter(search_filter)
+            hits = search_chats(db, search_term, user_id=user_id, limit=limit)
+            if not hits:
+                return []
             
-            if user_id:
-                query = query.filter(Chat.user_id == user_id)
-            
-            # 按相關性排序（最新的優先）
-            items = query.order_by(desc(Chat.timestamp)).limit(limit).all()
+            # 按相關性排序
+            order = {hit["turn_id"]: i for i, hit in enumerate(hits)}
+            items = db.query(Chat).filter(Chat.turn_id.in_(list(order))).all()
+            items.sort(key=lambda chat: order[chat.turn_id])
             
             logger.info(f"Message search executed: term='{search_term}', user_id={user_id}, count={len(items)}")
             
@@ -173,27 +183,21 @@ class ChatQueryOptimizer:
     ) -> Dict[str, Any]:
         """
         獲取用戶統計信息
-        使用聚合查詢和索引優化
+        從 user_daily_usage 彙總表與 chat_sessions 摘要表讀取，不掃描 chats 表
         """
         try:
-            # 消息總數
-            total_messages = db.query(func.count(Chat.turn_id)).filter(Chat.user_id == user_id).scalar()
-            
-            # 會話總數
-            total_sessions = db.query(func.count(func.distinct(Chat.session_id))).filter(Chat.user_id == user_id).scalar()
-            
-            # 最近活動時間
-            latest_activity = db.query(func.max(Chat.timestamp)).filter(Chat.user_id == user_id).scalar()
-            
-            # 今日消息數
             from datetime import datetime
             today = datetime.now().date()
-            today_messages = db.query(func.count(Chat.turn_id)).filter(
-                and_(
-                    Chat.user_id == user_id,
-                    func.date(Chat.timestamp) == today
-                )
-            ).scalar()
+
+            # 消息總數、最近活動時間與今日消息數（沿著彙總表主鍵的單一範圍查詢）
+            total_messages, latest_activity, today_messages = db.query(
+                func.coalesce(func.sum(UserDailyUsage.turns), 0),
+                func.max(UserDailyUsage.last_timestamp),
+                func.coalesce(func.sum(case((UserDailyUsage.day == today, UserDailyUsage.turns), else_=0)), 0)
+            ).filter(UserDailyUsage.user_id == user_id).one()
+            
+            # 會話總數
+            total_sessions = db.query(func.count(ChatSession.session_id)).filter(ChatSession.user_id == user_id).scalar()
             
             stats = {
                 "total_messages": total_messages,
@@ -0,0 +1,153 @@
+# utils/db_pool.py - 資料庫連線池設定、預熱與統計
+import os
+import bisect
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import exc, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# 取得連線等待時間的直方圖區間上限（毫秒）
+WAIT_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000]
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def pool_settings_from_env(database_url: str) -> dict:
+    """
+    從環境變數讀取連線池設定，返回 create_engine 的參數
+
+    - DB_POOL_SIZE: 常駐連線數（默認 5）
+    - DB_MAX_OVERFLOW: 超出常駐數量時可額外建立的連線數（默認 10）
+    - DB_POOL_TIMEOUT: 取得連線的最長等待秒數（默認 30）
+    - DB_POOL_RECYCLE: 連線使用多少秒後重建（默認 1800，避免被伺服器端閒置斷線）
+    - DB_POOL_PRE_PING: 取出連線前先檢查是否可用（默認 true）
+
+    記憶體 SQLite 使用單一連線的連線池，不套用以上設定。
+    """
+    if database_url.startswith("sqlite") and (":memory:" in database_url or database_url.rstrip("/") == "sqlite:"):
+        return {}
+    return {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+    }
+
+
+class CheckoutWaitStats:
+    """取得連線等待時間的直方圖（執行緒安全）"""
+
+    def __init__(self, buckets_ms: List[float] = WAIT_BUCKETS_MS):
+        self.buckets_ms = list(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.total = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def record(self, wait_ms: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets_ms, wait_ms)] += 1
+            self.total += 1
+            self.total_ms += wait_ms
+            self.max_ms = max(self.max_ms, wait_ms)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            labels = [f"<={bucket}ms" for bucket in self.buckets_ms] + [f">{self.buckets_ms[-1]}ms"]
+            return {
+                "count": self.total,
+                "avg_ms": self.total_ms / self.total if self.total else 0.0,
+                "max_ms": self.max_ms,
+                "timeouts": self.timeouts,
+                "histogram": dict(zip(labels, self.counts)),
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """記錄每次取得連線（含等待、建立新連線與 pre-ping）耗時的 QueuePool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = CheckoutWaitStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.wait_stats.record_timeout()
+            raise
+        self.wait_stats.record((time.perf_counter() - start) * 1000)
+        return connection
+
+
+def get_pool_stats(engine: Engine) -> dict:
+    """返回連線池目前的使用狀況與等待時間統計"""
+    pool = engine.pool
+    stats = {"pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    wait_stats: Optional[CheckoutWaitStats] = getattr(pool, "wait_stats", None)
+    if wait_stats is not None:
+        stats["checkout_wait"] = wait_stats.to_dict()
+    return stats
+
+
+def warm_up_pool(engine: Engine, connections: Optional[int] = None) -> int:
+    """
+    啟動時預先建立連線，避免第一批請求承擔建立連線的延遲
+
+    Args:
+        engine: 資料庫引擎
+        connections: 預熱的連線數，默認為 DB_POOL_WARMUP 或連線池常駐大小
+
+    Returns:
+        成功建立的連線數
+    """
+    pool = engine.pool
+    if connections is None:
+        default = pool.size() if isinstance(pool, QueuePool) else 1
+        connections = int(os.getenv("DB_POOL_WARMUP", str(default)))
+    opened = []
+    warmed = 0
+    try:
+        # 同時持有多條連線，確保建立的是不同的連線
+        for _ in range(connections):
+            connection = engine.connect()
+            opened.append(connection)
+            connection.execute(text("SELECT 1"))
+            warmed += 1
+    except Exception as e:
+        backend_logger.warning(f"Pool warm-up stopped early: {e}")
+    finally:
+        for connection in opened:
+            connection.close()
+    backend_logger.info(f"Pool warm-up finished | connections: {warmed}")
+    return warmed
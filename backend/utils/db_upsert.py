@@ -0,0 +1,26 @@
+# utils/db_upsert.py - 跨資料庫的 INSERT ... ON CONFLICT 輔助函數
+from sqlalchemy.orm import Session
+
+
+def dialect_insert(db: Session, model):
+    """
+    返回當前資料庫方言的 insert 建構器，以便使用 on_conflict_do_update / on_conflict_do_nothing
+
+    Args:
+        db: 資料庫 session
+        model: ORM 模型或 Table
+
+    Returns:
+        支援 ON CONFLICT 子句的 Insert 物件
+
+    Raises:
+        NotImplementedError: 資料庫方言不支援 ON CONFLICT
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert is not supported for dialect: {dialect}")
+    return insert(model)
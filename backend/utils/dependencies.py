@@ -1,7 +1,28 @@
+from fastapi import Request
+
 from database import SessionLocal
+from utils import read_routing
 
 def get_db():
     db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db(request: Request):
+    """
+    唯讀查詢使用的 session
+
+    依副本健康狀態、複製延遲與該 session/user 是否剛寫入過，決定使用副本或主資料庫。
+    請求標頭 X-Read-Consistency: strong 可強制讀取主資料庫。
+    """
+    keys = read_routing.write_keys(
+        request.path_params.get("session_id"),
+        request.query_params.get("user_id")
+    )
+    consistent = request.headers.get(read_routing.CONSISTENCY_HEADER, "").lower() == "strong"
+    db = read_routing.replica_router.choose(keys, consistent)()
     try:
         yield db
     finally:
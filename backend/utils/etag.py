@@ -0,0 +1,39 @@
+# utils/etag.py - 條件式 GET（ETag / 304）輔助函數
+import hashlib
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """
+    由版本資訊與請求參數產生弱 ETag
+
+    Args:
+        parts: 任何可轉為字串的版本資訊（例如最新更新時間、對話輪數、查詢參數）
+
+    Returns:
+        弱 ETag 字串，例如 W/"3f2a..."
+    """
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+    return f'W/"{digest[:24]}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """檢查請求的 If-None-Match 是否包含目前的 ETag（弱比較）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    current = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == current for candidate in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    """返回不含內容的 304 響應"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def set_etag(response: Response, etag: str) -> None:
+    """在響應中加入 ETag，並要求客戶端每次使用前重新驗證"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
@@ -0,0 +1,85 @@
+# utils/json_codec.py - 快速 JSON 編解碼（orjson，未安裝時退回標準庫 json）與對應的響應 / 路由類別
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Iterable
+from uuid import UUID
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+try:
+    import orjson
+except ImportError:  # 未安裝時使用標準庫，輸出格式相同
+    orjson = None
+
+CHAT_FIELDS = ("session_id", "turn_id", "user_id", "user_message", "assistant_message", "timestamp")
+
+
+def _default(value: Any):
+    """標準庫 json 無法處理的類型（與 orjson 及 pydantic 的輸出格式一致）"""
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """序列化為 UTF-8 JSON（UUID 與 datetime 直接輸出，不需先轉為字串）"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def chat_to_dict(chat) -> dict:
+    """
+    將 Chat ORM 物件（或具有相同欄位的物件）轉為 ChatHistory 格式的字典
+
+    欄位與類型已由資料庫保證，不需再經過 pydantic 驗證。
+    """
+    if isinstance(chat, dict):
+        return {field: chat.get(field) for field in CHAT_FIELDS}
+    return {field: getattr(chat, field) for field in CHAT_FIELDS}
+
+
+def chats_to_list(chats: Iterable) -> list:
+    return [chat_to_dict(chat) for chat in chats]
+
+
+class FastJSONResponse(JSONResponse):
+    """以 orjson 序列化的 JSONResponse（應用程式的默認響應類別）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class FastJSONRequest(Request):
+    """以 orjson 解析請求內容的 Request"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """
+    請求內容改以 orjson 解析的路由類別
+
+    FastAPI 解析 JSON 請求時呼叫 request.json()，替換 Request 類別即可，不影響驗證流程。
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def fast_json_handler(request: Request) -> Response:
+            return await handler(FastJSONRequest(request.scope, request.receive))
+
+        return fast_json_handler
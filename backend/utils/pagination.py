@@ -0,0 +1,46 @@
+# utils/pagination.py - 鍵集（游標）分頁的游標編碼工具
+import json
+import base64
+from datetime import datetime
+from uuid import UUID
+from typing import Tuple
+
+
+class InvalidCursorError(ValueError):
+    """游標格式錯誤時拋出"""
+
+
+def encode_cursor(timestamp: datetime, session_id: UUID) -> str:
+    """
+    將分頁位置編碼為不透明的游標字串
+
+    Args:
+        timestamp: 上一頁最後一筆的時間戳
+        session_id: 上一頁最後一筆的 session_id
+
+    Returns:
+        URL 安全的游標字串
+    """
+    payload = json.dumps({"t": timestamp.isoformat(), "s": str(session_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    解碼游標字串
+
+    Args:
+        cursor: encode_cursor 產生的游標
+
+    Returns:
+        (時間戳, session_id)
+
+    Raises:
+        InvalidCursorError: 游標格式錯誤
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return datetime.fromisoformat(payload["t"]), UUID(payload["s"])
+    except Exception as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
@@ -0,0 +1,155 @@
+# utils/read_routing.py - 讀寫分離：將唯讀查詢導向副本，並處理複製延遲與讀己之寫
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, ReadSessionLocal, DATABASE_REPLICA_URL
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# PostgreSQL 副本的複製延遲（秒）；已追上主庫或不是副本時為 0
+PG_REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+# 客戶端可以用此標頭要求強一致讀取（例如多個 worker 之間無法共享寫入紀錄時）
+CONSISTENCY_HEADER = "x-read-consistency"
+
+
+def write_keys(session_id=None, user_id=None) -> list:
+    """返回寫入操作影響的讀取鍵"""
+    keys = []
+    if session_id is not None:
+        keys.append(f"session:{str(session_id).lower()}")
+    if user_id is not None:
+        keys.append(f"user:{str(user_id).lower()}")
+    return keys
+
+
+class ReplicaRouter:
+    """
+    決定唯讀查詢使用副本或主資料庫
+
+    以下情況改用主資料庫：
+    - 未設定副本
+    - 副本連線失敗或複製延遲超過 max_lag_seconds（健康檢查結果快取 check_interval 秒）
+    - 查詢的 session / user 在 read_your_writes_seconds 內剛寫入過（讀己之寫）
+    """
+
+    def __init__(
+        self,
+        primary: Callable[[], Session],
+        replica: Optional[Callable[[], Session]] = None,
+        max_lag_seconds: float = 5.0,
+        check_interval: float = 10.0,
+        read_your_writes_seconds: float = 30.0
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval = check_interval
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._recent_writes: Dict[str, float] = {}
+        self._healthy = True
+        self._lag: Optional[float] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def mark_write(self, keys: Iterable[str]) -> None:
+        """記錄剛寫入的鍵，之後一段時間內相同鍵的讀取走主資料庫"""
+        if self.replica is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._recent_writes[key] = now
+            # 清除過期的紀錄，避免無限增長
+            expired = [k for k, t in self._recent_writes.items() if now - t > self.read_your_writes_seconds]
+            for key in expired:
+                del self._recent_writes[key]
+
+    def recently_written(self, keys: Iterable[str]) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            return any(
+                now - self._recent_writes.get(key, float("-inf")) <= self.read_your_writes_seconds
+                for key in keys
+            )
+
+    def measure_lag(self) -> float:
+        """查詢副本的複製延遲（秒），連線失敗時拋出例外"""
+        db = self.replica()
+        try:
+            if db.get_bind().dialect.name == "postgresql":
+                return float(db.execute(PG_REPLICA_LAG_SQL).scalar() or 0)
+            db.execute(text("SELECT 1"))
+            return 0.0
+        finally:
+            db.close()
+
+    def replica_healthy(self) -> bool:
+        """副本是否可用且延遲在允許範圍內（結果會快取）"""
+        if self.replica is None:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._healthy
+        try:
+            lag = self.measure_lag()
+            healthy = lag <= self.max_lag_seconds
+        except Exception as e:
+            backend_logger.warning(f"Replica health check failed: {e}")
+            lag, healthy = None, False
+        with self._lock:
+            if healthy != self._healthy:
+                backend_logger.warning(f"Replica routing changed | healthy: {healthy}, lag: {lag}")
+            self._healthy, self._lag, self._checked_at = healthy, lag, now
+        return healthy
+
+    def choose(self, keys: Iterable[str] = (), consistent: bool = False) -> Callable[[], Session]:
+        """返回此次讀取應使用的 session 工廠"""
+        if self.replica is None or consistent or self.recently_written(keys):
+            return self.primary
+        return self.replica if self.replica_healthy() else self.primary
+
+    def get_stats(self) -> dict:
+        return {
+            "replica_configured": self.replica is not None,
+            "replica_healthy": self._healthy if self.replica is not None else False,
+            "replica_lag_seconds": self._lag,
+            "tracked_writes": len(self._recent_writes),
+        }
+
+
+replica_router = ReplicaRouter(
+    primary=SessionLocal,
+    replica=ReadSessionLocal if DATABASE_REPLICA_URL else None,
+    max_lag_seconds=float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5")),
+    check_interval=float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "10")),
+    read_your_writes_seconds=float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "30")),
+)
+
+
+@contextmanager
+def read_session(keys: Iterable[str] = (), consistent: bool = False):
+    """
+    開啟唯讀 session 的 context manager（供路由以外的程式使用，例如 ChatQueryOptimizer 的呼叫端）
+
+    Args:
+        keys: 讀取的 session / user 鍵，用於讀己之寫判斷
+        consistent: 是否強制使用主資料庫
+    """
+    db = replica_router.choose(keys, consistent)()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -1,6 +1,7 @@
 # utils/security_middleware.py
 import time
 from collections import defaultdict
+from typing import Dict, Optional
 from fastapi import Request
 from fastapi.responses import JSONResponse
 import logging
@@ -65,14 +66,22 @@ async def security_headers_middleware(request: Request, call_next):
     
     return response
 
-def validate_request_size(max_size: int = 10 * 1024 * 1024):  # 10MB 默認
-    """請求大小限制裝飾器"""
+def validate_request_size(max_size: int = 10 * 1024 * 1024,  # 10MB 默認
+                          path_limits: Optional[Dict[str, int]] = None):
+    """
+    請求大小限制裝飾器
+
+    path_limits 為個別路徑的上限（例如串流上傳的端點），0 表示不以 Content-Length 限制
+    """
+    path_limits = path_limits or {}
+
     async def middleware(request: Request, call_next):
+        limit = path_limits.get(request.url.path, max_size)
         content_length = request.headers.get("content-length")
-        if content_length and int(content_length) > max_size:
+        if limit and content_length and int(content_length) > limit:
             return JSONResponse(
                 status_code=413,
-                content={"detail": f"請求體過大，最大允許 {max_size // (1024*1024)}MB"}
+                content={"detail": f"請求體過大，最大允許 {limit // (1024*1024)}MB"}
             )
         
         response = await call_next(request)
@@ -0,0 +1,233 @@
+# utils/session_cache.py - 最近 session 對話記錄的程序內 LRU 快取（寫入時同步更新）
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional
+from uuid import UUID
+
+from utils.backend_logger import BackendLogger
+
+try:
+    import redis
+except ImportError:  # 未安裝時只能使用程序內的失效通知
+    redis = None
+
+backend_logger = BackendLogger().logger
+
+# 快取的記憶體上限（位元組，依訊息字串實際佔用的大小估算），0 表示停用
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# 設定後透過 Redis pub/sub 在多個 worker 之間廣播失效的 session
+SESSION_CACHE_REDIS_URL = os.getenv("SESSION_CACHE_REDIS_URL")
+INVALIDATION_CHANNEL = "session_cache:invalidate"
+# 每輪對話除了訊息內容之外的估計大小（字典、UUID、時間戳）
+TURN_OVERHEAD_BYTES = 400
+# 廣播「清除全部」時使用的訊息
+_CLEAR_ALL = "*"
+
+
+def estimate_turns_size(turns: List[dict]) -> int:
+    """
+    估算對話列表佔用的記憶體（訊息字串的實際大小加上固定開銷）
+
+    以 sys.getsizeof 計算字串大小：CPython 依字串中最寬的字元以 1、2 或 4 位元組儲存每個字元，
+    中文等訊息每個字元至少佔 2 位元組，只計算字元數會低估快取的記憶體用量。
+    """
+    return sum(
+        sys.getsizeof(turn["user_message"] or "") + sys.getsizeof(turn["assistant_message"] or "")
+        + TURN_OVERHEAD_BYTES
+        for turn in turns
+    )
+
+
+class LocalInvalidation:
+    """只在目前程序內生效的失效通知（單一 worker 時使用）"""
+
+    def start(self, on_invalidate: Callable[[List[str]], None]) -> None:
+        pass
+
+    def publish(self, keys: List[str]) -> None:
+        pass
+
+
+class RedisInvalidation:
+    """以 Redis pub/sub 將失效的 session 廣播給其他 worker"""
+
+    def __init__(self, url: str, channel: str = INVALIDATION_CHANNEL):
+        self.client = redis.Redis.from_url(url)
+        self.channel = channel
+        self.source = f"{os.getpid()}:{id(self)}"
+
+    def start(self, on_invalidate: Callable[[List[str]], None]) -> None:
+        def listen():
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.channel)
+            for message in pubsub.listen():
+                source, _, payload = message["data"].decode("utf-8").partition("|")
+                if source != self.source:
+                    on_invalidate(payload.split(","))
+
+        threading.Thread(target=listen, name="session-cache-invalidation", daemon=True).start()
+
+    def publish(self, keys: List[str]) -> None:
+        try:
+            self.client.publish(self.channel, f"{self.source}|{','.join(keys)}")
+        except Exception as e:
+            backend_logger.warning(f"Session cache invalidation publish failed: {e}")
+
+
+class SessionHistoryCache:
+    """
+    session 對話記錄的 LRU 快取
+
+    每筆快取記錄 session 的版本（chat_sessions 的對話輪數與更新時間），
+    讀取時與資料庫中的版本比對，不一致就視為未命中，因此其他 worker 的寫入不會讀到舊資料；
+    失效通知只是讓記憶體盡早釋放。
+
+    - put / get: 以版本存取完整的對話列表（ChatHistory 格式的字典）
+    - write_through: stream_and_save 寫入後直接更新快取中的對話
+    - invalidate: 匯入、歸檔等批次變更後移除快取
+    """
+
+    def __init__(self, max_bytes: int = SESSION_CACHE_MAX_BYTES, invalidation=None):
+        self.max_bytes = max_bytes
+        self.invalidation = invalidation or LocalInvalidation()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.write_throughs = 0
+        self.invalidations = 0
+        self.invalidation.start(self._drop)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, session_id: UUID, version: tuple) -> Optional[List[dict]]:
+        """返回版本相符的對話列表（呼叫端不可修改），否則返回 None"""
+        if not self.enabled:
+            return None
+        key = str(session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != version:
+                self.stale += 1
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, session_id: UUID, version: tuple, turns: List[dict]) -> None:
+        if not self.enabled:
+            return
+        size = estimate_turns_size(turns)
+        if size > self.max_bytes:
+            return
+        key = str(session_id)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (version, turns, size)
+            self._bytes += size
+            self._evict()
+
+    def write_through(self, session_id: UUID, turn: dict, previous_version: tuple, version: tuple) -> None:
+        """
+        寫入一輪對話後更新快取
+
+        只有快取中的版本正是寫入前的版本時才更新（確保快取內容完整）；
+        新的 session 直接建立快取。其他情況移除快取，下次讀取時重新載入。
+
+        Args:
+            session_id: session ID
+            turn: 寫入的對話（ChatHistory 格式的字典），turn_id 已存在時取代，否則附加在最後
+            previous_version: 寫入前的版本，新的 session 為 (0, None)
+            version: 寫入後的版本
+        """
+        if not self.enabled:
+            return
+        key = str(session_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and previous_version[0]:
+                return
+            if entry is not None and entry[0] != previous_version:
+                self._remove(key)
+                return
+            turns = [t for t in entry[1] if t["turn_id"] != turn["turn_id"]] if entry else []
+            turns.append(turn)
+            turns.sort(key=lambda t: t["timestamp"])
+            size = estimate_turns_size(turns)
+            self._remove(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (version, turns, size)
+                self._bytes += size
+                self.write_throughs += 1
+                self._evict()
+
+    def invalidate(self, session_ids: Optional[Iterable[UUID]] = None) -> None:
+        """移除指定的 session（None 表示全部），並通知其他 worker"""
+        keys = [_CLEAR_ALL] if session_ids is None else [str(session_id) for session_id in session_ids]
+        if not keys:
+            return
+        self._drop(keys)
+        self.invalidation.publish(keys)
+
+    def _drop(self, keys: List[str]) -> None:
+        with self._lock:
+            if _CLEAR_ALL in keys:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                for key in keys:
+                    self._remove(key)
+            self.invalidations += len(keys)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict(self) -> None:
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry[2]
+            self.evictions += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "enabled": self.enabled,
+                "sessions": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "write_throughs": self.write_throughs,
+                "invalidations": self.invalidations,
+                "invalidation_backend": type(self.invalidation).__name__,
+            }
+
+
+def create_invalidation_backend():
+    """SESSION_CACHE_REDIS_URL 已設定且安裝了 redis 時使用 Redis，否則只在程序內失效"""
+    if not SESSION_CACHE_REDIS_URL:
+        return LocalInvalidation()
+    if redis is None:
+        backend_logger.warning("SESSION_CACHE_REDIS_URL is set but redis is not installed, using local invalidation")
+        return LocalInvalidation()
+    return RedisInvalidation(SESSION_CACHE_REDIS_URL)
+
+
+session_cache = SessionHistoryCache(invalidation=create_invalidation_backend())
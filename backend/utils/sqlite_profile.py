@@ -0,0 +1,291 @@
+# utils/sqlite_profile.py - SQLite 正式環境設定：WAL 與連線 pragma、單一寫入執行緒（group commit）
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, TypeVar
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+T = TypeVar("T")
+
+# default: 沿用 SQLite 默認設定；production: 啟用 WAL、調整 pragma，並以單一執行緒寫入
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default").lower()
+# 單次 commit 最多合併的寫入數
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("SQLITE_GROUP_COMMIT_MAX_BATCH", "64"))
+
+
+def is_file_sqlite(database_url: str) -> bool:
+    """是否為檔案型 SQLite（記憶體資料庫不支援 WAL，也不需要寫入佇列）"""
+    if not database_url or not database_url.startswith("sqlite"):
+        return False
+    return ":memory:" not in database_url and database_url.rstrip("/") != "sqlite:"
+
+
+def production_pragmas() -> Dict[str, object]:
+    """
+    正式環境使用的 pragma
+
+    - journal_mode=WAL: 讀取不會被寫入阻塞，commit 只需附加到 WAL 檔
+    - synchronous=NORMAL: WAL 模式下只在 checkpoint 時 fsync，斷電最多遺失最後幾筆交易，不會損毀資料庫
+    - busy_timeout: 遇到鎖定時等待的毫秒數（SQLITE_BUSY_TIMEOUT_MS，默認 5000）
+    - mmap_size: 記憶體映射讀取的大小（SQLITE_MMAP_SIZE，默認 256MB）
+    - cache_size: 每條連線的頁面快取（SQLITE_CACHE_SIZE_KB，默認 64MB）
+    """
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+        "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+        "temp_store": "MEMORY",
+    }
+
+
+def apply_sqlite_pragmas(engine, pragmas: Dict[str, object]) -> None:
+    """在每條新建立的 SQLite 連線上設定 pragma"""
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def configure_sqlite_engine(engine, database_url: str, profile: str = SQLITE_PROFILE) -> bool:
+    """依 SQLITE_PROFILE 設定引擎，返回是否套用了正式環境設定"""
+    if profile != "production" or not is_file_sqlite(database_url):
+        return False
+    apply_sqlite_pragmas(engine, production_pragmas())
+    return True
+
+
+def create_writer_engine(database_url: str):
+    """
+    建立寫入執行緒專用的引擎（單一連線）
+
+    pysqlite 默認會延遲送出 BEGIN，使 SAVEPOINT 無法正常運作，
+    因此關閉驅動的交易處理，改由 SQLAlchemy 在交易開始時送出 BEGIN IMMEDIATE，
+    一開始就取得寫入鎖，不會在交易中途才發生鎖定衝突。
+    """
+    from utils.compressed_text import register_sqlite_functions
+
+    writer_engine = create_engine(database_url, pool_size=1, max_overflow=0)
+    apply_sqlite_pragmas(writer_engine, production_pragmas())
+    register_sqlite_functions(writer_engine)
+
+    @event.listens_for(writer_engine, "connect")
+    def _disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(writer_engine, "begin")
+    def _begin_immediate(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return writer_engine
+
+
+class _Job:
+    __slots__ = ("fn", "future", "enqueued_at")
+
+    def __init__(self, fn: Callable[[Session], object]):
+        self.fn = fn
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+_STOP = object()
+
+
+class SQLiteWriteQueue:
+    """
+    單一寫入執行緒（每個程序一個）
+
+    程序內的寫入排入佇列，由同一條連線依序執行，同一程序的請求之間不會互相等待鎖。
+    經由 run_write / run_write_sync 的寫入：對話與回覆（含配額與每日用量）、歷史匯入、
+    冷資料歸檔、session 摘要重建、用量回填與訊息壓縮遷移。啟動時的建表與全文檢索索引等 DDL 不經過佇列。
+    多個 uvicorn worker 與命令列工具各有自己的寫入連線，彼此之間仍以 busy_timeout 等待鎖，
+    BEGIN IMMEDIATE 讓等待發生在交易開始時，而不是交易中途。
+    執行緒每次取出佇列中所有等待的寫入（最多 max_batch 筆），各自在 SAVEPOINT 中執行，
+    再以一次 commit 提交（group commit）；單筆寫入失敗只回滾該筆，不影響同批的其他寫入。
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.jobs = 0
+        self.failed_jobs = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.max_batch_seen = 0
+        self.commit_ms_total = 0.0
+        self.wait_ms_total = 0.0
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """處理完佇列中已排入的寫入後停止執行緒"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        self._thread = None
+
+    def submit(self, fn: Callable[[Session], T]) -> "Future[T]":
+        """
+        排入一組寫入
+
+        Args:
+            fn: 接收寫入 session 的函數，只需呼叫 add / execute，不要自行 commit
+
+        Returns:
+            commit 完成後得到 fn 返回值的 Future
+        """
+        self.start()
+        job = _Job(fn)
+        self._queue.put(job)
+        return job.future
+
+    def run(self, fn: Callable[[Session], T]) -> T:
+        """排入寫入並等待 commit 完成"""
+        return self.submit(fn).result()
+
+    def _run(self) -> None:
+        db = self.session_factory()
+        try:
+            while True:
+                first = self._queue.get()
+                if first is _STOP:
+                    return
+                batch = [first]
+                stop = False
+                # 不額外等待：前一次 commit 期間到達的寫入自然累積成下一批
+                while len(batch) < self.max_batch:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is _STOP:
+                        stop = True
+                        break
+                    batch.append(job)
+                self._execute(db, batch)
+                if stop:
+                    return
+        finally:
+            db.close()
+
+    def _execute(self, db: Session, batch) -> None:
+        started = time.perf_counter()
+        done = []
+        for job in batch:
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            try:
+                with db.begin_nested():
+                    result = job.fn(db)
+            except Exception as e:
+                job.future.set_exception(e)
+                with self._stats_lock:
+                    self.failed_jobs += 1
+                continue
+            done.append((job, result))
+
+        commit_start = time.perf_counter()
+        try:
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            backend_logger.error(f"SQLite group commit failed | jobs: {len(done)} | {e}")
+            for job, _ in done:
+                job.future.set_exception(e)
+            with self._stats_lock:
+                self.failed_commits += 1
+                self.failed_jobs += len(done)
+            return
+        finally:
+            # 寫入的物件交還給呼叫端繼續使用（session 不會過期物件屬性）
+            db.expunge_all()
+
+        commit_ms = (time.perf_counter() - commit_start) * 1000
+        with self._stats_lock:
+            self.jobs += len(done)
+            self.commits += 1
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.commit_ms_total += commit_ms
+            self.wait_ms_total += sum((started - job.enqueued_at) * 1000 for job, _ in done)
+        for job, result in done:
+            job.future.set_result(result)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "jobs": self.jobs,
+                "failed_jobs": self.failed_jobs,
+                "commits": self.commits,
+                "failed_commits": self.failed_commits,
+                "avg_batch": self.jobs / self.commits if self.commits else 0.0,
+                "max_batch": self.max_batch_seen,
+                "avg_commit_ms": self.commit_ms_total / self.commits if self.commits else 0.0,
+                "avg_queue_wait_ms": self.wait_ms_total / self.jobs if self.jobs else 0.0,
+            }
+
+
+def create_write_queue(database_url: str, profile: str = SQLITE_PROFILE) -> Optional[SQLiteWriteQueue]:
+    """SQLITE_PROFILE=production 且為檔案型 SQLite 時建立寫入佇列，否則返回 None"""
+    if profile != "production" or not is_file_sqlite(database_url):
+        return None
+    writer_engine = create_writer_engine(database_url)
+    backend_logger.info("SQLite production profile enabled | WAL, single writer with group commit")
+    return SQLiteWriteQueue(sessionmaker(bind=writer_engine, autoflush=False, expire_on_commit=False))
+
+
+async def run_write(db: Session, fn: Callable[[Session], T]) -> T:
+    """
+    執行一組寫入並 commit
+
+    啟用寫入佇列時交由寫入執行緒執行（與其他請求的寫入合併 commit），
+    否則直接在呼叫端的 session 上執行並 commit。
+    """
+    import database
+
+    if database.write_queue is not None:
+        return await asyncio.wrap_future(database.write_queue.submit(fn))
+    result = fn(db)
+    db.commit()
+    return result
+
+
+def run_write_sync(db: Session, fn: Callable[[Session], T]) -> T:
+    """
+    run_write 的同步版本（供執行緒池中的批次作業與命令列工具使用）
+
+    啟用寫入佇列時排入佇列並阻塞等待 commit，否則直接在呼叫端的 session 上執行並 commit。
+    """
+    import database
+
+    if database.write_queue is not None:
+        return database.write_queue.run(fn)
+    result = fn(db)
+    db.commit()
+    return result
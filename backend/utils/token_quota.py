@@ -0,0 +1,325 @@
+# utils/token_quota.py - 以用戶為單位的 token 配額計算與限制
+import os
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from utils.db_upsert import dialect_insert
+from utils.token_utils import estimate_tokens
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# 每張圖片以高解析度估算的 token 數
+IMAGE_TOKEN_ESTIMATE = 765
+
+
+class TokenQuotaExceeded(Exception):
+    """超過 token 配額時拋出"""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+@dataclass
+class QuotaReservation:
+    user_id: Optional[UUID]
+    input_tokens: int
+    reserved_tokens: int
+    # 預留額度是否已由 reconcile 或 release 歸還，避免重複扣除
+    settled: bool = False
+
+
+@dataclass
+class _UserUsage:
+    buckets: Deque[List] = field(default_factory=deque)  # [bucket_start_ts, tokens]
+    window_tokens: int = 0
+    day: Optional[datetime] = None
+    day_tokens: int = 0
+    reserved_tokens: int = 0
+    loaded_at: float = 0.0
+
+
+def estimate_request_tokens(chat_request) -> int:
+    """
+    估算聊天請求的輸入 token 數（訊息、系統提示詞、上下文、圖片與檢索內容）
+
+    Args:
+        chat_request: schemas.ChatRequest
+
+    Returns:
+        估算的輸入 token 數
+    """
+    tokens = estimate_tokens(chat_request.message) + estimate_tokens(chat_request.prompt)
+    for h in chat_request.context:
+        tokens += estimate_tokens(h.user_message)
+        tokens += estimate_tokens(h.assistant_message)
+        tokens += estimate_tokens(h.file_content)
+    if chat_request.images:
+        tokens += IMAGE_TOKEN_ESTIMATE * len(chat_request.images)
+    if chat_request.retrieval and chat_request.retrieval.enabled:
+        tokens += chat_request.retrieval.max_tokens
+    return tokens
+
+
+class TokenQuotaManager:
+    """
+    Token 配額管理器
+
+    以固定長度的時間桶累計用量：記憶體中的計數在每次請求時以 O(1) 更新，
+    並以 upsert 的方式寫入 token_usage 表，重啟後可從資料庫恢復。
+    多個 worker 之間透過定期從資料庫重新載入來同步用量；載入在鎖外進行，
+    完成後才在鎖內合併，其他用戶的請求不需等待資料庫查詢。
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = 3600,
+        window_limit: int = 0,
+        daily_limit: int = 0,
+        bucket_seconds: int = 60,
+        refresh_interval: float = 30.0,
+        session_factory=SessionLocal
+    ):
+        """
+        Args:
+            window_seconds: 滾動視窗長度（秒）
+            window_limit: 滾動視窗內允許的最大 token 數，0 表示不限制
+            daily_limit: 每日允許的最大 token 數，0 表示不限制
+            bucket_seconds: 時間桶長度（秒）
+            refresh_interval: 從資料庫重新載入用量的間隔（秒）
+            session_factory: 建立資料庫 session 的工廠
+        """
+        self.window_seconds = window_seconds
+        self.window_limit = window_limit
+        self.daily_limit = daily_limit
+        self.bucket_seconds = bucket_seconds
+        self.refresh_interval = refresh_interval
+        self.session_factory = session_factory
+        self._usage: Dict[UUID, _UserUsage] = {}
+        self._lock = threading.Lock()
+
+    def _bucket_start(self, now: float) -> float:
+        return now - now % self.bucket_seconds
+
+    def _expire(self, usage: _UserUsage, now: float) -> None:
+        window_start = now - self.window_seconds
+        while usage.buckets and usage.buckets[0][0] + self.bucket_seconds <= window_start:
+            _, tokens = usage.buckets.popleft()
+            usage.window_tokens -= tokens
+        today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        if usage.day != today:
+            usage.day = today
+            usage.day_tokens = 0
+
+    def _load(self, user_id: UUID, now: float) -> _UserUsage:
+        """從資料庫載入用戶在滾動視窗與當日內的用量"""
+        usage = _UserUsage(loaded_at=now)
+        today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        window_start = datetime.fromtimestamp(self._bucket_start(now - self.window_seconds))
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(models.TokenUsage.bucket_start, models.TokenUsage.tokens)
+                .filter(
+                    models.TokenUsage.user_id == user_id,
+                    models.TokenUsage.bucket_start >= min(today, window_start)
+                )
+                .order_by(models.TokenUsage.bucket_start)
+                .all()
+            )
+        finally:
+            db.close()
+
+        usage.day = today
+        for bucket_start, tokens in rows:
+            if bucket_start >= today:
+                usage.day_tokens += tokens
+            if bucket_start >= window_start:
+                usage.buckets.append([bucket_start.timestamp(), tokens])
+                usage.window_tokens += tokens
+        return usage
+
+    def _refresh(self, user_id: UUID, now: float) -> None:
+        """用量未載入或已超過 refresh_interval 時，在鎖外從資料庫載入，再於鎖內合併（保留預留額度）"""
+        with self._lock:
+            usage = self._usage.get(user_id)
+            if usage is not None and now - usage.loaded_at <= self.refresh_interval:
+                return
+        loaded = self._load(user_id, now)
+        with self._lock:
+            current = self._usage.get(user_id)
+            if current is not None:
+                if current.loaded_at >= loaded.loaded_at:
+                    # 其他執行緒已載入同樣新或更新的用量
+                    return
+                loaded.reserved_tokens = current.reserved_tokens
+            self._usage[user_id] = loaded
+
+    def _get_usage(self, user_id: UUID, now: float) -> _UserUsage:
+        """取得記憶體中的用量（需持有鎖，並先呼叫 _refresh）"""
+        usage = self._usage.get(user_id)
+        if usage is None:
+            # 載入後被其他執行緒移除的情況不會發生，保險起見以空用量代替，下次請求時重新載入
+            self._usage[user_id] = usage = _UserUsage()
+        self._expire(usage, now)
+        return usage
+
+    def reserve(self, user_id: Optional[UUID], input_tokens: int, max_output_tokens: int) -> QuotaReservation:
+        """
+        在呼叫模型前預留 token 額度
+
+        需要時會查詢資料庫，非同步路由中請以 run_in_threadpool 呼叫；
+        未設定任何配額時直接返回，不查詢資料庫也不預留。
+
+        Args:
+            user_id: 用戶ID；為 None 時不做限制
+            input_tokens: 估算的輸入 token 數
+            max_output_tokens: 請求允許的最大輸出 token 數
+
+        Returns:
+            預留記錄，串流結束後需傳給 reconcile
+
+        Raises:
+            TokenQuotaExceeded: 預留後會超過滾動視窗或每日配額
+        """
+        reserved = input_tokens + max_output_tokens
+        if user_id is None:
+            return QuotaReservation(user_id=None, input_tokens=input_tokens, reserved_tokens=0)
+        if not self.window_limit and not self.daily_limit:
+            # 不限制時不需要預留，用量仍由 reconcile 寫入
+            return QuotaReservation(user_id=user_id, input_tokens=input_tokens, reserved_tokens=0, settled=True)
+
+        now = time.time()
+        self._refresh(user_id, now)
+        with self._lock:
+            usage = self._get_usage(user_id, now)
+            if self.window_limit and usage.window_tokens + usage.reserved_tokens + reserved > self.window_limit:
+                retry_after = self.window_seconds
+                if usage.buckets:
+                    retry_after = int(usage.buckets[0][0] + self.bucket_seconds + self.window_seconds - now) + 1
+                raise TokenQuotaExceeded(
+                    f"Token 用量超過限制（{self.window_seconds} 秒內 {self.window_limit} tokens），請稍後再試",
+                    retry_after=max(retry_after, 1)
+                )
+            if self.daily_limit and usage.day_tokens + usage.reserved_tokens + reserved > self.daily_limit:
+                tomorrow = usage.day + timedelta(days=1)
+                raise TokenQuotaExceeded(
+                    f"今日 token 用量超過限制（{self.daily_limit} tokens）",
+                    retry_after=max(int(tomorrow.timestamp() - now), 1)
+                )
+            usage.reserved_tokens += reserved
+
+        return QuotaReservation(user_id=user_id, input_tokens=input_tokens, reserved_tokens=reserved)
+
+    def reconcile(self, db: Session, reservation: QuotaReservation, output_tokens: int) -> int:
+        """
+        串流結束後以實際用量取代預留額度，並將用量寫入資料庫（由呼叫端 commit）
+
+        用量在 SAVEPOINT 中寫入，失敗時只回滾這一步並拋出例外，記憶體中的計數與預留不變
+        （預留由之後的 release 歸還）；寫入成功後才更新記憶體中的計數。
+
+        Args:
+            db: 資料庫 session
+            reservation: reserve 返回的預留記錄
+            output_tokens: 實際輸出的 token 數
+
+        Returns:
+            本次請求計入的 token 數
+        """
+        actual = reservation.input_tokens + output_tokens
+        if reservation.user_id is None:
+            return actual
+
+        now = time.time()
+        bucket_start = self._bucket_start(now)
+        # 先載入（不含本次用量），寫入成功後再加上本次用量
+        self._refresh(reservation.user_id, now)
+
+        stmt = dialect_insert(db, models.TokenUsage).values(
+            user_id=reservation.user_id,
+            bucket_start=datetime.fromtimestamp(bucket_start),
+            tokens=actual,
+            requests=1
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "bucket_start"],
+            set_={
+                "tokens": models.TokenUsage.tokens + stmt.excluded.tokens,
+                "requests": models.TokenUsage.requests + 1,
+            }
+        )
+        with db.begin_nested():
+            db.execute(stmt)
+
+        with self._lock:
+            usage = self._get_usage(reservation.user_id, now)
+            if not reservation.settled:
+                usage.reserved_tokens = max(usage.reserved_tokens - reservation.reserved_tokens, 0)
+                reservation.settled = True
+            if usage.buckets and usage.buckets[-1][0] == bucket_start:
+                usage.buckets[-1][1] += actual
+            else:
+                usage.buckets.append([bucket_start, actual])
+            usage.window_tokens += actual
+            usage.day_tokens += actual
+        return actual
+
+    def release(self, reservation: QuotaReservation) -> None:
+        """
+        釋放未使用的預留額度（例如客戶端在串流開始前斷線，或請求在呼叫模型前失敗）
+
+        已由 reconcile 或先前的 release 歸還的預留不會重複扣除，可在每個結束路徑上呼叫。
+        """
+        if reservation.user_id is None:
+            return
+        with self._lock:
+            if reservation.settled:
+                return
+            reservation.settled = True
+            usage = self._usage.get(reservation.user_id)
+            if usage is not None:
+                usage.reserved_tokens = max(usage.reserved_tokens - reservation.reserved_tokens, 0)
+
+    def get_usage(self, user_id: UUID) -> Dict[str, int]:
+        """
+        獲取用戶目前的 token 用量
+
+        Args:
+            user_id: 用戶ID
+
+        Returns:
+            包含滾動視窗、當日用量與配額的字典
+        """
+        now = time.time()
+        self._refresh(user_id, now)
+        with self._lock:
+            usage = self._get_usage(user_id, now)
+            return {
+                "user_id": str(user_id),
+                "window_seconds": self.window_seconds,
+                "window_tokens": usage.window_tokens,
+                "window_limit": self.window_limit,
+                "daily_tokens": usage.day_tokens,
+                "daily_limit": self.daily_limit,
+                "reserved_tokens": usage.reserved_tokens,
+            }
+
+
+# 全局配額管理器實例（默認不限制，由部署時設定配額啟用）
+token_quota = TokenQuotaManager(
+    window_seconds=int(os.getenv("TOKEN_QUOTA_WINDOW_SECONDS", "3600")),
+    window_limit=int(os.getenv("TOKEN_QUOTA_WINDOW_LIMIT", "0")),
+    daily_limit=int(os.getenv("TOKEN_QUOTA_DAILY_LIMIT", "0")),
+    bucket_seconds=int(os.getenv("TOKEN_QUOTA_BUCKET_SECONDS", "60")),
+)
@@ -0,0 +1,57 @@
+# utils/token_utils.py - Token 數量估算工具
+import re
+from typing import Optional
+
+# 中日韓文字大致一個字對應一個 token，其餘字元約四個字元對應一個 token
+CJK_RANGES = (
+    (0x3040, 0x30ff), (0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xac00, 0xd7af), (0xf900, 0xfaff), (0xff00, 0xffef),
+)
+_CJK_PATTERN = re.compile("[" + "".join(f"{chr(low)}-{chr(high)}" for low, high in CJK_RANGES) + "]")
+CHARS_PER_TOKEN = 4
+
+
+def _is_cjk(char: str) -> bool:
+    return _CJK_PATTERN.match(char) is not None
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    估算文字的 token 數量
+
+    不依賴特定模型的 tokenizer，僅作為配額與預算控制使用的保守估計值。
+
+    Args:
+        text: 要估算的文字
+
+    Returns:
+        估算的 token 數量
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_token_budget(text: Optional[str], budget: int) -> str:
+    """
+    截斷文字使其估算 token 數不超過預算
+
+    Args:
+        text: 原始文字
+        budget: 允許的最大 token 數
+
+    Returns:
+        截斷後的文字（若未超過預算則原樣返回）
+    """
+    if not text or budget <= 0:
+        return ""
+    if estimate_tokens(text) <= budget:
+        return text
+
+    cost = 0.0
+    for index, char in enumerate(text):
+        cost += 1.0 if _is_cjk(char) else 1.0 / CHARS_PER_TOKEN
+        if cost > budget:
+            return text[:index]
+    return text
@@ -0,0 +1,340 @@
+# utils/usage_rollup.py - 每位用戶每日、每個模型的用量彙總（寫入時增量更新）
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import Chat, ChatSession, UserDailyUsage
+from utils.db_upsert import dialect_insert
+from utils.token_utils import estimate_tokens
+from utils.sqlite_profile import run_write_sync
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# 回填時無法得知模型，以此值記錄
+UNKNOWN_MODEL = "unknown"
+ERROR_PREFIX = "Error:"
+
+
+def is_error_message(message: Optional[str]) -> bool:
+    return (message or "").startswith(ERROR_PREFIX)
+
+
+def is_first_turn_of_day(db: Session, session_id: UUID, timestamp: datetime) -> bool:
+    """
+    判斷此輪是否為該 session 當天的第一輪（需在 record_turn 之前呼叫）
+
+    以 chat_sessions 主鍵查詢上一輪的時間，用於累計每日活躍的 session 數。
+    不區分模型：session 當天中途換模型時只記在第一輪的模型下，各模型的 sessions 加總即為當天的 session 數。
+    """
+    last_timestamp = db.query(ChatSession.last_timestamp).filter(ChatSession.session_id == session_id).scalar()
+    return last_timestamp is None or last_timestamp.date() < timestamp.date()
+
+
+def _greatest(db: Session, a, b):
+    """兩個值中較大者（SQLite 的多參數 max 等同 PostgreSQL 的 greatest）"""
+    if db.get_bind().dialect.name == "sqlite":
+        return func.max(a, b)
+    return func.greatest(a, b)
+
+
+def record_usage(
+    db: Session,
+    user_id: Optional[UUID],
+    timestamp: datetime,
+    model: Optional[str],
+    tokens: int,
+    error: bool = False,
+    latency_ms: float = 0.0,
+    new_session: bool = False
+) -> None:
+    """
+    累加一輪對話的用量到每日彙總（由呼叫端 commit）
+
+    匿名請求沒有 user_id，不記錄。
+
+    Args:
+        db: 資料庫 session
+        user_id: 用戶ID
+        timestamp: 對話時間
+        model: 使用的模型
+        tokens: 該輪的 token 數
+        error: 該輪是否失敗
+        latency_ms: 該輪的總耗時
+        new_session: 是否為該 session 當天的第一輪
+    """
+    if user_id is None:
+        return
+    stmt = dialect_insert(db, UserDailyUsage).values(
+        user_id=user_id,
+        day=timestamp.date(),
+        model=model or UNKNOWN_MODEL,
+        turns=1,
+        sessions=int(new_session),
+        tokens=tokens,
+        errors=int(error),
+        latency_ms_sum=latency_ms,
+        last_timestamp=timestamp
+    )
+    db.execute(_accumulate_on_conflict(db, stmt))
+
+
+def _accumulate_on_conflict(db: Session, stmt):
+    """同一 (用戶, 日期, 模型) 已有彙總時累加各項數值"""
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "day", "model"],
+        set_={
+            "turns": UserDailyUsage.turns + stmt.excluded.turns,
+            "sessions": UserDailyUsage.sessions + stmt.excluded.sessions,
+            "tokens": UserDailyUsage.tokens + stmt.excluded.tokens,
+            "errors": UserDailyUsage.errors + stmt.excluded.errors,
+            "latency_ms_sum": UserDailyUsage.latency_ms_sum + stmt.excluded.latency_ms_sum,
+            "last_timestamp": _greatest(db, UserDailyUsage.last_timestamp, stmt.excluded.last_timestamp),
+        }
+    )
+
+
+def record_imported_usage(db: Session, rows: List[dict]) -> int:
+    """
+    將匯入的對話累加到每日彙總（由呼叫端 commit）
+
+    與回填相同，以 UNKNOWN_MODEL 記錄、耗時為 0；session 數只計入匯入前當天在熱表中
+    沒有其他對話的 session，與寫入時的 is_first_turn_of_day 一致。
+
+    Args:
+        db: 資料庫 session
+        rows: 實際寫入 chats 表的對話（欄位同 chat_import.parse_line）
+
+    Returns:
+        更新的 (用戶, 日期) 數量
+    """
+    rows = [row for row in rows if row["user_id"] is not None]
+    if not rows:
+        return 0
+    totals: Dict[Tuple[UUID, date], dict] = {}
+    for row in rows:
+        _accumulate(totals, row["user_id"], row["session_id"], row["timestamp"],
+                    row["user_message"], row["assistant_message"])
+
+    # 匯入前當天已有對話的 session 已經計入彙總
+    imported = {(row["session_id"], row["turn_id"]) for row in rows}
+    start = datetime.combine(min(row["timestamp"] for row in rows).date(), datetime.min.time())
+    end = datetime.combine(max(row["timestamp"] for row in rows).date() + timedelta(days=1), datetime.min.time())
+    existing = db.execute(
+        select(Chat.session_id, Chat.turn_id, Chat.timestamp)
+        .where(Chat.session_id.in_({row["session_id"] for row in rows}))
+        .where(Chat.timestamp >= start, Chat.timestamp < end)
+    )
+    counted = {
+        (row.session_id, row.timestamp.date()) for row in existing if (row.session_id, row.turn_id) not in imported
+    }
+
+    values = [
+        {
+            "user_id": user_id,
+            "day": day,
+            "model": UNKNOWN_MODEL,
+            "turns": entry["turns"],
+            "sessions": sum(1 for session_id in entry["sessions"] if (session_id, day) not in counted),
+            "tokens": entry["tokens"],
+            "errors": entry["errors"],
+            "latency_ms_sum": 0.0,
+            "last_timestamp": entry["last_timestamp"],
+        }
+        for (user_id, day), entry in totals.items()
+    ]
+    db.execute(_accumulate_on_conflict(db, dialect_insert(db, UserDailyUsage.__table__)), values)
+    return len(values)
+
+
+def get_usage_stats(
+    db: Session,
+    user_id: UUID,
+    start: Optional[date] = None,
+    end: Optional[date] = None
+) -> dict:
+    """
+    從每日彙總讀取用戶的用量統計（沿著主鍵索引的單一範圍查詢）
+
+    Args:
+        db: 資料庫 session
+        user_id: 用戶ID
+        start / end: 可選的日期範圍（含兩端）
+
+    Returns:
+        總計與每日、每個模型的明細
+    """
+    query = db.query(UserDailyUsage).filter(UserDailyUsage.user_id == user_id)
+    if start is not None:
+        query = query.filter(UserDailyUsage.day >= start)
+    if end is not None:
+        query = query.filter(UserDailyUsage.day <= end)
+    rows = query.order_by(UserDailyUsage.day.desc(), UserDailyUsage.model).all()
+
+    today = date.today()
+    total_turns = sum(row.turns for row in rows)
+    latency_ms_sum = sum(row.latency_ms_sum for row in rows)
+    return {
+        "user_id": user_id,
+        "total_turns": total_turns,
+        "total_tokens": sum(row.tokens for row in rows),
+        "total_errors": sum(row.errors for row in rows),
+        "avg_latency_ms": latency_ms_sum / total_turns if total_turns else 0.0,
+        "today_turns": sum(row.turns for row in rows if row.day == today),
+        "latest_activity": max((row.last_timestamp for row in rows), default=None),
+        "days": [
+            {
+                "day": row.day,
+                "model": row.model,
+                "turns": row.turns,
+                "sessions": row.sessions,
+                "tokens": row.tokens,
+                "errors": row.errors,
+                "avg_latency_ms": row.latency_ms_sum / row.turns if row.turns else 0.0,
+            }
+            for row in rows
+        ],
+    }
+
+
+def _aggregate_chats(db: Session, since: Optional[date]) -> Dict[Tuple[UUID, date], dict]:
+    """從 chats 表逐批計算每位用戶每日的用量（只含仍在熱表中的對話）"""
+    query = (
+        select(Chat.user_id, Chat.session_id, Chat.timestamp, Chat.user_message, Chat.assistant_message)
+        .where(Chat.user_id.is_not(None))
+    )
+    if since is not None:
+        query = query.where(Chat.timestamp >= datetime.combine(since, datetime.min.time()))
+    totals: Dict[Tuple[UUID, date], dict] = {}
+    for rows in db.execute(query.execution_options(yield_per=5000)).partitions():
+        for row in rows:
+            _accumulate(totals, row.user_id, row.session_id, row.timestamp, row.user_message, row.assistant_message)
+    return totals
+
+
+def _accumulate(totals: Dict[Tuple[UUID, date], dict], user_id: UUID, session_id: UUID, timestamp: datetime,
+                user_message: Optional[str], assistant_message: Optional[str]) -> None:
+    """將一輪對話累加到 (用戶, 日期) 的統計"""
+    entry = totals.setdefault((user_id, timestamp.date()), {
+        "turns": 0, "sessions": set(), "tokens": 0, "errors": 0, "last_timestamp": timestamp
+    })
+    entry["turns"] += 1
+    entry["sessions"].add(session_id)
+    entry["tokens"] += estimate_tokens(user_message) + estimate_tokens(assistant_message)
+    entry["errors"] += int(is_error_message(assistant_message))
+    entry["last_timestamp"] = max(entry["last_timestamp"], timestamp)
+
+
+def _rollup_totals(db: Session, since: Optional[date]) -> Dict[Tuple[UUID, date], dict]:
+    """彙總表中每位用戶每日（所有模型合計）的數值"""
+    query = db.query(
+        UserDailyUsage.user_id,
+        UserDailyUsage.day,
+        func.sum(UserDailyUsage.turns),
+        func.sum(UserDailyUsage.sessions),
+        func.sum(UserDailyUsage.errors)
+    )
+    if since is not None:
+        query = query.filter(UserDailyUsage.day >= since)
+    return {
+        (user_id, day): {"turns": turns, "sessions": sessions, "errors": errors}
+        for user_id, day, turns, sessions, errors in query.group_by(UserDailyUsage.user_id, UserDailyUsage.day)
+    }
+
+
+def backfill_usage(db: Session, since: Optional[date] = None, replace: bool = False) -> int:
+    """
+    從 chats 表回填每日彙總
+
+    歷史資料沒有模型與耗時資訊，以 UNKNOWN_MODEL 記錄、耗時為 0。
+    默認只填入彙總表中還沒有資料的 (用戶, 日期)，replace=True 時先刪除範圍內的彙總再重建。
+
+    Returns:
+        寫入的 (用戶, 日期) 數量
+    """
+    existing = set() if replace else set(_rollup_totals(db, since))
+
+    rows = [
+        {
+            "user_id": user_id,
+            "day": day,
+            "model": UNKNOWN_MODEL,
+            "turns": entry["turns"],
+            "sessions": len(entry["sessions"]),
+            "tokens": entry["tokens"],
+            "errors": entry["errors"],
+            "latency_ms_sum": 0.0,
+            "last_timestamp": entry["last_timestamp"],
+        }
+        for (user_id, day), entry in _aggregate_chats(db, since).items()
+        if (user_id, day) not in existing
+    ]
+
+    def write(write_db: Session) -> None:
+        if replace:
+            delete_query = write_db.query(UserDailyUsage)
+            if since is not None:
+                delete_query = delete_query.filter(UserDailyUsage.day >= since)
+            delete_query.delete(synchronize_session=False)
+        if rows:
+            write_db.execute(dialect_insert(write_db, UserDailyUsage.__table__).on_conflict_do_nothing(), rows)
+
+    run_write_sync(db, write)
+    backend_logger.info(f"Usage rollup backfilled | days: {len(rows)}")
+    return len(rows)
+
+
+def check_usage(db: Session, since: Optional[date] = None) -> List[dict]:
+    """
+    比對彙總表與 chats 表的輪數、session 數與錯誤數
+
+    已歸檔到冷儲存的對話不在 chats 表中，應以 since 限制在保留期限內比對。
+
+    Returns:
+        不一致的 (用戶, 日期) 清單
+    """
+    expected = {
+        key: {"turns": entry["turns"], "sessions": len(entry["sessions"]), "errors": entry["errors"]}
+        for key, entry in _aggregate_chats(db, since).items()
+    }
+    actual = _rollup_totals(db, since)
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=lambda k: (str(k[0]), k[1])):
+        if expected.get(key) != actual.get(key):
+            mismatches.append({
+                "user_id": key[0],
+                "day": key[1],
+                "expected": expected.get(key),
+                "actual": actual.get(key),
+            })
+    return mismatches
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="維護 user_daily_usage 每日用量彙總")
+    parser.add_argument("command", choices=["backfill", "check"])
+    parser.add_argument("--since", type=date.fromisoformat, help="只處理此日期之後（YYYY-MM-DD）")
+    parser.add_argument("--days", type=int, help="只處理最近 N 天（與 --since 擇一）")
+    parser.add_argument("--replace", action="store_true", help="backfill 時先刪除範圍內既有的彙總")
+    args = parser.parse_args()
+    since = args.since or (date.today() - timedelta(days=args.days) if args.days else None)
+
+    db = SessionLocal()
+    try:
+        if args.command == "backfill":
+            print(f"Backfilled {backfill_usage(db, since, args.replace)} user-days")
+        else:
+            mismatches = check_usage(db, since)
+            for mismatch in mismatches:
+                print(mismatch)
+            print(f"{len(mismatches)} mismatched user-days")
+            sys.exit(1 if mismatches else 0)
+    finally:
+        db.close()
@@ -1,13 +1,53 @@
-import re
-import uuid
 import chromadb
-from chromadb.utils import embedding_functions
+from collections import Counter
+from dataclasses import dataclass, field
+from chromadb.api.shared_system_client import SharedSystemClient
 from typing import List, Optional, Dict, Any, Union, Tuple
 from utils.logging import setup_logging
 from utils.backend_logger import BackendLogger
+from utils.vectordb.chunking import iter_chunks, validate_chunk_params
+from utils.vectordb.embedding_cache import cached_embedding_function
+from utils.vectordb.hashing import deterministic_uuid, sha256_digest
 
 logger = setup_logging()
 backend_logger = BackendLogger().logger
+# 塊 ID 中內容雜湊的長度（十六進位字元）
+CHUNK_HASH_LENGTH = 32
+
+
+@dataclass
+class UpsertResult:
+    """文件層級 upsert 的結果：新增（需要嵌入）、刪除、只更新元數據與未變更的塊"""
+    added: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    deleted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "added": len(self.added),
+            "deleted": self.deleted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "failed": len(self.failed),
+        }
+
+
+def chunk_ids(base_id: str, chunks: List[str]) -> List[str]:
+    """
+    以塊內容的雜湊產生塊 ID，內容未變的塊在文件編輯後仍保有相同的 ID。
+
+    同一文件中內容相同的塊依出現順序加上序號以區分。
+    """
+    ids = []
+    seen = Counter()
+    for chunk in chunks:
+        digest = sha256_digest(chunk).hex()[:CHUNK_HASH_LENGTH]
+        occurrence = seen[digest]
+        seen[digest] += 1
+        ids.append(f"{base_id}_chunk_{digest}" if occurrence == 0 else f"{base_id}_chunk_{digest}_{occurrence}")
+    return ids
 
 
 class ChromaDBConnecter:
@@ -26,7 +66,10 @@ class ChromaDBConnecter:
         """
         try:
             self.path = path
-            self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+            # 已開啟的集合，透過 client_registry 重複使用同一個連接器時不需再查詢集合
+            self._collections: Dict[str, chromadb.Collection] = {}
+            # 程序內共用的嵌入模型（啟動時已載入並預熱），相同內容的區塊直接取用快取的向量
+            self.embedding_function = cached_embedding_function
             # self.embedding_function = embedding_functions.OpenAIEmbeddingFunction(api_key="YOUR_API_KEY", model_name="text-embedding-ada-002")
 
             if path:
@@ -59,12 +102,41 @@ class ChromaDBConnecter:
                 embedding_function=self.embedding_function,
                 metadata=metadata
             )
+            self._collections[name] = collection
             backend_logger.info(f"Successfully created collection at: {self.path}")
             return collection
         except Exception as e:
             backend_logger.error(f"Error occurred while creating or retrieving collection '{name}': {e}")
             return None
 
+    def get_collection(self, name: str) -> chromadb.Collection:
+        """
+        取得已存在的集合（開啟後快取在連接器中）。
+
+        Raises:
+            Exception: 集合不存在時由 ChromaDB 拋出。
+        """
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self.client.get_collection(name=name, embedding_function=self.embedding_function)
+            self._collections[name] = collection
+        return collection
+
+    def close(self) -> None:
+        """
+        關閉持久化客戶端，釋放 SQLite 連線與載入記憶體的 HNSW 索引。
+
+        ChromaDB 以路徑為鍵在程序內共用 System 且不會自行釋放，需要停止並從共用表中移除，
+        否則目錄刪除後再次開啟同一路徑仍會使用舊的 System。
+        """
+        self._collections.clear()
+        if not self.path:
+            return
+        system = SharedSystemClient._identifier_to_system.pop(self.client._identifier, None)
+        if system is not None:
+            system.stop()
+        backend_logger.info(f"ChromaDB client closed: {self.path}")
+
     def add_documents(self, collection_name: str, ids: List[str], documents: List[str], metadatas: Optional[List[Dict[str, Any]]] = None) -> bool:
         """
         將多個文件（及其元數據）添加到指定的集合中。
@@ -79,7 +151,7 @@ class ChromaDBConnecter:
             bool: 如果文件成功添加則返回 True，否則返回 False。
         """
         try:
-            collection = self.client.get_collection(name=collection_name, embedding_function=self.embedding_function)
+            collection = self.get_collection(collection_name)
             collection.add(
                 ids=ids,
                 documents=documents,
@@ -113,7 +185,7 @@ class ChromaDBConnecter:
                                       如果發生錯誤則返回 None。
         """
         try:
-            collection = self.client.get_collection(name=collection_name, embedding_function=self.embedding_function)
+            collection = self.get_collection(collection_name)
             results = collection.get(
                 ids=ids,
                 where=where,
@@ -130,95 +202,168 @@ class ChromaDBConnecter:
 
     def add_document_with_chunking(self, collection_name: str, document: str, document_id: str = None,
                                   chunk_size: int = 1000, chunk_overlap: int = 200,
-                                  metadata: Optional[Dict[str, Any]] = None) -> bool:
+                                  metadata: Optional[Dict[str, Any]] = None, chunk_unit: str = "chars") -> bool:
         """
-        將單個文件進行分塊處理，然後將這些塊作為獨立的條目添加到指定的 ChromaDB 集合中。
+        將單個文件進行分塊處理，然後將這些塊作為獨立的條目寫入指定的 ChromaDB 集合中。
 
         此方法首先使用提供的參數將輸入的文本文檔分割成多個可能重疊的塊。
-        接著，為每個塊生成一個唯一的 ID，並創建包含原始元數據以及塊特定信息
-        （例如塊索引、總塊數）的元數據字典。最後，調用 `add_documents` 方法
-        將所有塊及其對應的 ID 和元數據批量添加到目標集合。
+        接著，以塊內容的雜湊為每個塊生成 ID，並創建包含原始元數據以及塊特定信息
+        （例如塊索引、總塊數）的元數據字典。最後，調用 `upsert_chunks` 與集合中
+        同一文件已有的塊比對：只新增（嵌入）內容改變的塊，刪除不再存在的塊。
+        重新寫入編輯過的文件時，未變更的塊不會重新嵌入。
 
         Args:
             collection_name (str): 要添加文件塊的目標 ChromaDB 集合的名稱。
             document (str): 需要被分割和添加的原始文本文檔內容。
             document_id (str, optional): 整個原始文件的基礎唯一標識符。
-                                         如果提供，塊的 ID 將基於此 ID 生成。
-                                         如果為 None，將自動生成一個 UUID 作為基礎 ID。
+                                         如果提供，塊的 ID 將基於此 ID 生成，相同 ID 的文件會被取代。
+                                         如果為 None，將以文件完整內容的雜湊作為基礎 ID。
                                          預設為 None。
             chunk_size (int, optional): 每個文本塊的目標字符數。預設為 1000。
-            chunk_overlap (int, optional): 連續文本塊之間重疊的字符數，有助於維持上下文連貫性。
-                                         預設為 200。
+            chunk_overlap (int, optional): 連續文本塊之間重疊的字符數，有助於維持上下文連貫性，
+                                         必須小於 chunk_size。預設為 200。
             metadata (Optional[Dict[str, Any]], optional):
                                          與整個原始文件相關聯的元數據字典。
                                          此字典的內容將被複製到每個塊的元數據中，
                                          並額外補充塊特定的信息（`chunk_index`, `total_chunks`, `base_document_id`）。
                                          如果為 None，則每個塊的元數據只包含塊特定的信息。
                                          預設為 None。
+            chunk_unit (str, optional): chunk_size 與 chunk_overlap 的單位，"chars"（字符數）或
+                                        "tokens"（估算的 token 數）。預設為 "chars"。
 
         Returns:
-            bool: 如果文件成功分塊並添加到集合中，則返回 True。
+            bool: 如果文件成功分塊並寫入集合中，則返回 True。
                   如果在處理過程中發生任何錯誤（例如分塊或添加至數據庫時），則返回 False。
         """
         if not isinstance(document, str) or not document:
             backend_logger.error("Error: document must be a non-empty string.")
             return False
-        if not isinstance(chunk_size, int) or chunk_size <= 0:
-            backend_logger.error("Error: chunk_size must be a positive integer.")
-            return False
-        if not isinstance(chunk_overlap, int) or chunk_overlap < 0:
-            backend_logger.error("Error: chunk_overlap must be a non-negative integer.")
+        try:
+            validate_chunk_params(chunk_size, chunk_overlap, chunk_unit)
+        except ValueError as e:
+            backend_logger.error(f"Error: {e}.")
             return False
         try:
-            base_id = document_id if document_id else str(uuid.uuid4())
-            chunks = self._split_text_into_chunks(document, chunk_size, chunk_overlap)
+            ids, chunks, metadatas = self.build_chunks(document, document_id, chunk_size, chunk_overlap, metadata,
+                                                       chunk_unit)
             backend_logger.info(f"Split document into {len(chunks)} chunks")
-            ids = [f"{base_id}_chunk_{i}" for i in range(len(chunks))]
-            if metadata is None:
-                metadata = {}
-            metadatas = []
-            for i in range(len(chunks)):
-                chunk_metadata = metadata.copy()
-                chunk_metadata.update({
-                    "chunk_index": i,
-                    "total_chunks": len(chunks),
-                    "base_document_id": base_id
-                })
-                metadatas.append(chunk_metadata)
-            return self.add_documents(
-                collection_name=collection_name,
-                ids=ids,
-                documents=chunks,
-                metadatas=metadatas
-            )
+            result = self.upsert_chunks(collection_name, [metadatas[0]["base_document_id"]], ids, chunks, metadatas)
+            backend_logger.info(f"Upserted document '{metadatas[0]['base_document_id']}': {result.to_dict()}")
+            return not result.failed
         except Exception as e:
             backend_logger.error(f"Error in chunking and adding document: {e}")
             return False
 
-    def _split_text_into_chunks(self, text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
-        if len(text) <= chunk_size:
-            return [text]
-        chunks = []
-        start = 0
-
-        while start < len(text):
-            end = start + chunk_size
-            chunk = text[start:end]
-            if end < len(text):
-                paragraph_break = chunk.rfind('\n\n')
-                if paragraph_break != -1 and paragraph_break > chunk_size // 2:
-                    end = start + paragraph_break + 2
-                    chunk = text[start:end]
-                else:
-                    sentence_break = re.search(r'[.!?]\s+', chunk[::-1])
-                    if sentence_break and sentence_break.start() < chunk_size // 4:
-                        break_pos = len(chunk) - sentence_break.start()
-                        end = start + break_pos
-                        chunk = text[start:end]
-            chunks.append(chunk)
-            start = end - chunk_overlap
-
-        return chunks
+    def build_chunks(self, document: str, document_id: Optional[str] = None,
+                     chunk_size: int = 1000, chunk_overlap: int = 200,
+                     metadata: Optional[Dict[str, Any]] = None,
+                     chunk_unit: str = "chars") -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+        """
+        將文件分塊並產生每個塊的 ID 與元數據（不寫入集合）。
+
+        Args:
+            document (str): 原始文本文檔內容。
+            document_id (Optional[str]): 文件的基礎 ID，為 None 時使用文件內容的雜湊。
+            chunk_size (int): 每個文本塊的目標字符數。
+            chunk_overlap (int): 連續文本塊之間重疊的字符數。
+            metadata (Optional[Dict[str, Any]]): 複製到每個塊的文件元數據。
+            chunk_unit (str): chunk_size 與 chunk_overlap 的單位，"chars" 或 "tokens"。
+
+        Returns:
+            Tuple[List[str], List[str], List[Dict[str, Any]]]: 塊 ID（由塊內容的雜湊產生）、塊內容與塊元數據。
+        """
+        base_id = document_id if document_id else deterministic_uuid(document)
+        chunks = self._split_text_into_chunks(document, chunk_size, chunk_overlap, chunk_unit)
+        ids = chunk_ids(base_id, chunks)
+        if metadata is None:
+            metadata = {}
+        metadatas = []
+        for i in range(len(chunks)):
+            chunk_metadata = metadata.copy()
+            chunk_metadata.update({
+                "chunk_index": i,
+                "total_chunks": len(chunks),
+                "base_document_id": base_id
+            })
+            metadatas.append(chunk_metadata)
+        return ids, chunks, metadatas
+
+    def upsert_chunks(self, collection_name: str, base_ids: List[str], ids: List[str], documents: List[str],
+                      metadatas: List[Dict[str, Any]], batch_size: Optional[int] = None) -> UpsertResult:
+        """
+        以文件為單位寫入塊：與集合中 `base_ids` 已有的塊比對後只做必要的變更。
+
+        - 新的塊 ID（內容改變）：新增並嵌入，依 batch_size 分批
+        - 已存在且元數據相同：不做任何事
+        - 已存在但元數據不同（例如塊索引位移）：只更新元數據，不重新嵌入
+        - 已存在但不在新的塊中：刪除
+
+        先新增再更新與刪除；某份文件有任何新增失敗時，保留該文件原有的塊與元數據，
+        避免文件只剩下部分內容。
+
+        Args:
+            collection_name (str): 目標集合的名稱。
+            base_ids (List[str]): 要取代的文件 ID。
+            ids (List[str]): 這些文件所有塊的 ID。
+            documents (List[str]): 塊內容。
+            metadatas (List[Dict[str, Any]]): 塊元數據。
+            batch_size (Optional[int]): 每次新增的塊數，None 表示一次新增。
+
+        Returns:
+            UpsertResult: 各類變更的塊；新增失敗的塊列在 failed 中。
+
+        Raises:
+            Exception: 讀取既有的塊、刪除或更新元數據失敗時由 ChromaDB 拋出。
+        """
+        collection = self.get_collection(collection_name)
+        result = UpsertResult()
+        existing = {}
+        if base_ids:
+            stored = collection.get(where={"base_document_id": {"$in": list(base_ids)}}, include=["metadatas"])
+            existing = dict(zip(stored["ids"], stored["metadatas"]))
+
+        new_indexes, update_ids, update_metadatas = [], [], []
+        for i, (chunk_id, metadata) in enumerate(zip(ids, metadatas)):
+            if chunk_id not in existing:
+                new_indexes.append(i)
+            elif existing[chunk_id] != metadata:
+                update_ids.append(chunk_id)
+                update_metadatas.append(metadata)
+            else:
+                result.unchanged += 1
+
+        batch_size = batch_size or max(len(new_indexes), 1)
+        failed_bases = set()
+        for start in range(0, len(new_indexes), batch_size):
+            batch = new_indexes[start:start + batch_size]
+            batch_ids = [ids[i] for i in batch]
+            if self.add_documents(collection_name, batch_ids, [documents[i] for i in batch],
+                                  [metadatas[i] for i in batch]):
+                result.added.extend(batch_ids)
+            else:
+                result.failed.extend(batch_ids)
+                failed_bases.update(metadatas[i].get("base_document_id") for i in batch)
+
+        if failed_bases:
+            update_pairs = [(chunk_id, metadata) for chunk_id, metadata in zip(update_ids, update_metadatas)
+                            if metadata.get("base_document_id") not in failed_bases]
+            update_ids = [chunk_id for chunk_id, _ in update_pairs]
+            update_metadatas = [metadata for _, metadata in update_pairs]
+        if update_ids:
+            collection.update(ids=update_ids, metadatas=update_metadatas)
+            result.updated = len(update_ids)
+        new_ids = set(ids)
+        stale_ids = [chunk_id for chunk_id, metadata in existing.items()
+                     if chunk_id not in new_ids and metadata.get("base_document_id") not in failed_bases]
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+            result.deleted = len(stale_ids)
+        return result
+
+    def _split_text_into_chunks(self, text: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                                chunk_unit: str = "chars") -> List[str]:
+        """以段落與中英文句子邊界分塊（見 utils.vectordb.chunking.iter_chunks）"""
+        return list(iter_chunks(text, chunk_size, chunk_overlap, chunk_unit))
 
     def retrieve_similar_documents(
         self,
@@ -247,9 +392,11 @@ class ChromaDBConnecter:
                                        結果字典通常包含 'ids', 'documents', 'metadatas', 'distances' 等鍵。
         """
         try:
-            collection = self.client.get_collection(name=collection_name, embedding_function=self.embedding_function)
+            collection = self.get_collection(collection_name)
+            # 查詢向量不寫入區塊的嵌入快取（見 CachedEmbeddingFunction.embed_query）
+            embed_query = getattr(self.embedding_function, "embed_query", self.embedding_function)
             results = collection.query(
-                query_texts=[query],
+                query_embeddings=embed_query([query]),
                 n_results=n_results,
                 where=where,
                 where_document=where_document,
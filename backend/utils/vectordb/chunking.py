@@ -0,0 +1,126 @@
+# utils/vectordb/chunking.py - 文件分塊（生成器，依段落與中英文句子邊界切分，可依字元數或估算 token 數切分）
+import re
+from typing import Iterator, Optional
+
+import numpy as np
+
+from utils.token_utils import CHARS_PER_TOKEN, CJK_RANGES
+
+CHUNK_UNITS = ("chars", "tokens")
+# 段落（空行）與句子結尾：英文 .!? 之後需有空白，中文。！？可直接接續下一句；
+# 收尾的引號、括號與同一行的空白留在前一句，換行留給段落邊界判斷
+PARAGRAPH_PATTERN = r"\n[ \t\r]*\n\s*"
+SENTENCE_PATTERN = r"[.!?]+[\"')\]]*(?=\s)[ \t]*|[。！？]+[」』”’）)]*[ \t]*"
+# 貪婪的 .* 從區間末端往回比對，第一個成功的即為區間內最後一個邊界，不需複製或反轉文字
+_LAST_PARAGRAPH = re.compile(rf".*({PARAGRAPH_PATTERN})", re.S)
+_LAST_SENTENCE = re.compile(rf".*({SENTENCE_PATTERN})", re.S)
+# 每個 BMP 字元的估算成本（四分之一 token 為單位），BMP 以外的字元皆為 1
+_COST_TABLE = np.ones(0x10001, dtype=np.uint8)
+for _low, _high in CJK_RANGES:
+    _COST_TABLE[_low:_high + 1] = CHARS_PER_TOKEN
+# 以 token 估算時每次計算累積成本的字元數
+TOKEN_BLOCK_CHARS = 1 << 20
+
+
+def validate_chunk_params(chunk_size: int, chunk_overlap: int, unit: str = "chars") -> None:
+    """
+    檢查分塊參數
+
+    Raises:
+        ValueError: chunk_size 非正整數、chunk_overlap 為負數或不小於 chunk_size、unit 不支援
+    """
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        raise ValueError("chunk_size must be a positive integer")
+    if not isinstance(chunk_overlap, int) or chunk_overlap < 0:
+        raise ValueError("chunk_overlap must be a non-negative integer")
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+    if unit not in CHUNK_UNITS:
+        raise ValueError(f"unit must be one of {CHUNK_UNITS}")
+
+
+class _TokenWindow:
+    """
+    以 token_utils 的估算方式（中日韓文字一個 token，其他字元四分之一個 token）量測分塊視窗
+
+    累積成本以區塊為單位計算，區塊內的多個視窗共用同一份累積成本，記憶體用量與文件大小無關。
+    """
+
+    def __init__(self, text: str, chunk_size: int, chunk_overlap: int) -> None:
+        self.text = text
+        # 以四分之一 token 為單位，避免浮點誤差
+        self.budget = chunk_size * CHARS_PER_TOKEN
+        self.overlap = chunk_overlap * CHARS_PER_TOKEN
+        # 視窗最多 chunk_size * 4 個字元（全部為非中日韓字元時）
+        self.max_chars = chunk_size * CHARS_PER_TOKEN
+        self.block_chars = max(TOKEN_BLOCK_CHARS, 2 * self.max_chars)
+        self.block_start = 0
+        self.prefix = np.zeros(1, dtype=np.int64)
+
+    def _load(self, start: int) -> None:
+        """計算 text[start:start + block_chars] 的累積成本（prefix[k] 為前 k 個字元的成本）"""
+        codes = np.frombuffer(self.text[start:start + self.block_chars].encode("utf-32-le"), dtype=np.uint32)
+        costs = _COST_TABLE[np.minimum(codes, len(_COST_TABLE) - 1)]
+        self.prefix = np.concatenate(([0], np.cumsum(costs, dtype=np.int64)))
+        self.block_start = start
+
+    def limit(self, start: int) -> int:
+        """從 start 開始、估算 token 數不超過 chunk_size 的最遠位置"""
+        block_end = self.block_start + len(self.prefix) - 1
+        if start < self.block_start or (start + self.max_chars > block_end and block_end < len(self.text)):
+            self._load(start)
+        offset = start - self.block_start
+        target = self.prefix[offset] + self.budget
+        return self.block_start + int(np.searchsorted(self.prefix, target, side="right")) - 1
+
+    def next_start(self, end: int) -> int:
+        """end 之前估算 token 數約為 chunk_overlap 的位置（下一塊的起點）"""
+        target = self.prefix[end - self.block_start] - self.overlap
+        return self.block_start + int(np.searchsorted(self.prefix, target, side="left"))
+
+
+def iter_chunks(text: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                unit: str = "chars") -> Iterator[str]:
+    """
+    將文字切分為可能重疊的塊（生成器）
+
+    每塊最多 chunk_size 個字元（unit="tokens" 時為估算的 token 數）。
+    優先在視窗後半的最後一個段落邊界切分，其次為視窗後半的最後一個句子邊界，
+    都沒有時直接在視窗末端切分；下一塊從前一塊結尾往前 chunk_overlap 的位置開始。
+    邊界只在原文的視窗後半由末端往回搜尋（不複製或反轉文字），每個字元只被檢查常數次。
+
+    Args:
+        text: 原始文字
+        chunk_size: 每塊的大小上限
+        chunk_overlap: 連續兩塊重疊的大小
+        unit: "chars"（字元數）或 "tokens"（token_utils 估算的 token 數）
+
+    Yields:
+        文字塊
+
+    Raises:
+        ValueError: 參數不合法（見 validate_chunk_params）
+    """
+    validate_chunk_params(chunk_size, chunk_overlap, unit)
+    length = len(text)
+    window: Optional[_TokenWindow] = _TokenWindow(text, chunk_size, chunk_overlap) if unit == "tokens" else None
+    start = 0
+
+    while start < length:
+        limit = window.limit(start) if window else start + chunk_size
+        if limit >= length:
+            yield text[start:]
+            return
+
+        # 邊界必須落在視窗後半，避免切出過小的塊
+        earliest = start + (limit - start) // 2
+        boundary = _LAST_PARAGRAPH.match(text, earliest, limit) or _LAST_SENTENCE.match(text, earliest, limit)
+        end = boundary.end(1) if boundary else limit
+
+        next_start = window.next_start(end) if window else end - chunk_overlap
+        if next_start <= start:
+            end = limit
+            next_start = window.next_start(end) if window else end - chunk_overlap
+        yield text[start:end]
+        # 估算的重疊進位後可能等於起點，至少前進一個字元
+        start = max(next_start, start + 1)
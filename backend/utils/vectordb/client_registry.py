@@ -0,0 +1,204 @@
+# utils/vectordb/client_registry.py - 程序內共用的 ChromaDB 客戶端登錄表（LRU 淘汰與引用計數）
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+# 同時保持開啟的客戶端數量上限
+VECTORDB_MAX_CLIENTS = int(os.getenv("VECTORDB_MAX_CLIENTS", "32"))
+# 開啟中的客戶端估計佔用的記憶體上限（位元組）
+VECTORDB_MAX_CLIENT_BYTES = int(os.getenv("VECTORDB_MAX_CLIENT_BYTES", str(512 * 1024 * 1024)))
+# 每個客戶端除了 HNSW 索引之外的估計開銷（System、SQLite 連線與頁面快取）
+CLIENT_OVERHEAD_BYTES = 4 * 1024 * 1024
+# ChromaDB 的中繼資料庫，由 SQLite 讀取而不是整個載入記憶體
+CHROMA_SQLITE_FILE = "chroma.sqlite3"
+# 釋放連接器時重新估算記憶體的最短間隔（秒），避免每次請求都走訪目錄
+VECTORDB_SIZE_REFRESH_SECONDS = float(os.getenv("VECTORDB_SIZE_REFRESH_SECONDS", "30"))
+
+
+def estimate_client_bytes(path: str) -> int:
+    """以 HNSW 索引檔案的大小估算客戶端佔用的記憶體（開啟集合時索引會載入記憶體）"""
+    total = CLIENT_OVERHEAD_BYTES
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name == CHROMA_SQLITE_FILE:
+                continue
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class _ClientEntry:
+    __slots__ = ("connecter", "refs", "bytes", "sized_at", "closed", "ready")
+
+    def __init__(self):
+        # 開啟中的項目 connecter 為 None，ready 於開啟完成（或失敗）時設定
+        self.connecter = None
+        self.refs = 0
+        self.bytes = CLIENT_OVERHEAD_BYTES
+        self.sized_at = 0.0
+        self.closed = False
+        self.ready = threading.Event()
+
+
+class ChromaClientRegistry:
+    """
+    以 session 路徑為鍵保存開啟中的 ChromaDBConnecter
+
+    - acquire: 取得（或開啟）路徑的連接器，使用期間引用計數大於 0，不會被淘汰或關閉；
+      開啟與估算大小在全域鎖之外進行，同一路徑的其他請求等待開啟完成，不影響其他路徑
+    - 超過數量或記憶體上限時，從最久未使用且未被使用中的連接器開始關閉
+    - invalidate: 刪除目錄前呼叫，關閉連接器（使用中的連接器在釋放時關閉）
+    """
+
+    def __init__(self, max_clients: int = VECTORDB_MAX_CLIENTS, max_bytes: int = VECTORDB_MAX_CLIENT_BYTES):
+        self.max_clients = max_clients
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _ClientEntry]" = OrderedDict()
+        # 開啟中的路徑先以佔位項目登錄：ChromaDB 以路徑共用 System，同一路徑不能同時開啟兩次再關閉其中一個
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    @contextmanager
+    def acquire(self, path: str, factory: Callable[[str], object]) -> Iterator:
+        """
+        取得路徑的連接器，離開 with 區塊時釋放
+
+        Args:
+            path: 向量數據庫目錄
+            factory: 開啟連接器的函數（通常為 ChromaDBConnecter）
+        """
+        key = self._key(path)
+        entry = self._open(key, path, factory)
+        try:
+            yield entry.connecter
+        finally:
+            self._release(key, entry)
+
+    def _open(self, key: str, path: str, factory: Callable[[str], object]) -> _ClientEntry:
+        """取得已開啟的項目（引用計數加一），或登錄佔位項目後在鎖外開啟"""
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    entry = _ClientEntry()
+                    entry.refs = 1
+                    self._entries[key] = entry
+                    break
+                if entry.connecter is not None:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    entry.refs += 1
+                    return entry
+            # 同一路徑正在由其他執行緒開啟，完成後重新查詢（開啟失敗時會移除佔位項目）
+            entry.ready.wait()
+
+        try:
+            connecter = factory(path)
+            size = estimate_client_bytes(path)
+        except BaseException:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry.ready.set()
+            raise
+        with self._lock:
+            entry.connecter = connecter
+            entry.bytes = size
+            entry.sized_at = time.monotonic()
+            self._evict()
+        entry.ready.set()
+        return entry
+
+    def _release(self, key: str, entry: _ClientEntry) -> None:
+        # 寫入後索引可能變大，定期在鎖外重新估算
+        size = None
+        if time.monotonic() - entry.sized_at >= VECTORDB_SIZE_REFRESH_SECONDS:
+            size = estimate_client_bytes(key)
+        with self._lock:
+            entry.refs -= 1
+            if self._entries.get(key) is not entry:
+                # 使用期間已被失效，最後一個使用者負責關閉；
+                # 若同一路徑已重新開啟，兩者共用 ChromaDB 的 System，交由新的連接器關閉
+                if entry.refs == 0 and key not in self._entries:
+                    self._close(key, entry)
+                return
+            if size is not None:
+                entry.bytes = size
+                entry.sized_at = time.monotonic()
+            self._evict()
+
+    def invalidate(self, path: str) -> None:
+        """移除路徑的連接器（刪除目錄前呼叫）"""
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self.invalidations += 1
+            if entry.refs == 0:
+                self._close(key, entry)
+
+    def clear(self) -> None:
+        """關閉所有未使用中的連接器並清空登錄表"""
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                self._entries.pop(key)
+                if entry.refs == 0:
+                    self._close(key, entry)
+
+    def _evict(self) -> None:
+        total = sum(entry.bytes for entry in self._entries.values())
+        for key, entry in list(self._entries.items()):
+            if len(self._entries) <= self.max_clients and total <= self.max_bytes:
+                break
+            if entry.refs > 0 or entry.connecter is None:
+                continue
+            del self._entries[key]
+            total -= entry.bytes
+            self.evictions += 1
+            self._close(key, entry)
+
+    def _close(self, key: str, entry: _ClientEntry) -> None:
+        if entry.closed or entry.connecter is None:
+            return
+        entry.closed = True
+        try:
+            entry.connecter.close()
+        except Exception as e:
+            backend_logger.error(f"Failed to close ChromaDB client {key}: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "clients": len(self._entries),
+                "in_use": sum(1 for entry in self._entries.values() if entry.refs > 0),
+                "bytes": sum(entry.bytes for entry in self._entries.values()),
+                "max_clients": self.max_clients,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+client_registry = ChromaClientRegistry()
@@ -0,0 +1,142 @@
+# utils/vectordb/embedding.py - 程序內共用的嵌入模型服務（啟動時載入並預熱 ONNX MiniLM）
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from functools import cached_property
+
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+from utils.backend_logger import BackendLogger
+from utils.vectordb.executor import VECTORDB_WORKERS
+
+backend_logger = BackendLogger().logger
+
+
+def default_num_threads() -> int:
+    """
+    平分 CPU 核心，避免推論執行緒互相搶佔
+
+    uvicorn worker 數（start.sh 的 WORKERS，未設定時為 WEB_CONCURRENCY）乘上每個 worker
+    同時推論的數量（向量執行緒池大小 VECTORDB_WORKERS）為同時執行的推論數。
+    """
+    workers = max(1, int(os.getenv("WORKERS") or os.getenv("WEB_CONCURRENCY") or "1"))
+    concurrent = workers * max(1, VECTORDB_WORKERS)
+    return max(1, (os.cpu_count() or 1) // concurrent)
+
+
+# ONNX Runtime 單次推論使用的執行緒數
+EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", str(default_num_threads())))
+# 啟動時是否載入並預熱模型
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "true").lower() == "true"
+# 推論耗時統計保留的最近批次數
+LATENCY_WINDOW = 1000
+WARMUP_TEXT = "warm up"
+
+
+class ThreadLimitedMiniLM(ONNXMiniLM_L6_V2):
+    """限制 ONNX Runtime 執行緒數的 MiniLM（與 ChromaDB 默認嵌入模型相同）"""
+
+    def __init__(self, num_threads: int) -> None:
+        super().__init__()
+        self.num_threads = num_threads
+
+    @cached_property
+    def model(self):
+        options = self.ort.SessionOptions()
+        options.log_severity_level = 3
+        options.intra_op_num_threads = self.num_threads
+        options.inter_op_num_threads = 1
+        return self.ort.InferenceSession(
+            os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+            providers=self.ort.get_available_providers(),
+            sess_options=options,
+        )
+
+
+class EmbeddingService(EmbeddingFunction[Documents]):
+    """
+    程序內共用的嵌入函數
+
+    所有 ChromaDBConnecter 使用同一個實例，模型只載入一次；
+    並記錄載入耗時與每批推論的耗時。
+    """
+
+    # 嵌入模型識別，用於區分嵌入快取
+    model_id = f"onnx-{ONNXMiniLM_L6_V2.MODEL_NAME}"
+
+    def __init__(self, num_threads: int = EMBEDDING_NUM_THREADS) -> None:
+        self.num_threads = num_threads
+        self._model = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.load_seconds = None
+        self.warmup_ms = None
+        self.batches = 0
+        self.texts = 0
+
+    def load(self) -> ThreadLimitedMiniLM:
+        """載入模型（首次使用時下載），多個執行緒同時呼叫時只載入一次"""
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                start = time.perf_counter()
+                model = ThreadLimitedMiniLM(self.num_threads)
+                model._download_model_if_not_exists()
+                model.tokenizer
+                model.model
+                self.load_seconds = time.perf_counter() - start
+                self._model = model
+                backend_logger.info(
+                    f"Embedding model loaded in {self.load_seconds:.2f}s | threads: {self.num_threads}"
+                )
+        return self._model
+
+    def warm_up(self) -> None:
+        """載入模型並執行一次推論（不計入推論統計）"""
+        model = self.load()
+        start = time.perf_counter()
+        model([WARMUP_TEXT])
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+
+    def __call__(self, input: Documents) -> Embeddings:
+        model = self.load()
+        start = time.perf_counter()
+        embeddings = model(input)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._stats_lock:
+            self._latencies.append(elapsed_ms)
+            self.batches += 1
+            self.texts += len(input)
+        return embeddings
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            latencies = sorted(self._latencies)
+            batches, texts = self.batches, self.texts
+        return {
+            "loaded": self._model is not None,
+            "num_threads": self.num_threads,
+            "load_seconds": self.load_seconds,
+            "warmup_ms": self.warmup_ms,
+            "batches": batches,
+            "texts": texts,
+            "batch_median_ms": statistics.median(latencies) if latencies else None,
+            "batch_p95_ms": latencies[int(len(latencies) * 0.95)] if latencies else None,
+            "batch_max_ms": latencies[-1] if latencies else None,
+        }
+
+
+def warm_up_embedding() -> None:
+    """啟動時預熱嵌入模型；失敗時（例如無法下載模型）只記錄警告，首次使用時再載入"""
+    try:
+        embedding_service.warm_up()
+    except Exception as e:
+        backend_logger.warning(f"Embedding model warm-up failed: {e}")
+
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,278 @@
+# utils/vectordb/embedding_cache.py - 以區塊內容雜湊為鍵的持久化嵌入快取（跨會話重複使用嵌入向量）
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+
+from utils.backend_logger import BackendLogger
+from utils.vectordb.embedding import embedding_service
+from utils.vectordb.hashing import sha256_digest
+
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台無法跨程序鎖定，只有程序內的鎖
+    fcntl = None
+
+backend_logger = BackendLogger().logger
+
+# 快取檔案目錄（每個嵌入模型一個子目錄）
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./data/embedding_cache")
+# 快取檔案大小上限（位元組），設為 0 時停用快取
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# 向量儲存精度（float16 佔用一半空間，float32 與模型輸出完全相同）
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+# SHA-256 摘要長度
+KEY_BYTES = 32
+
+
+class EmbeddingCache:
+    """
+    持久化的嵌入向量快取
+
+    以（嵌入模型 ID, 區塊內容 SHA-256）為鍵，向量存放於記憶體映射的 npy 陣列，
+    另一個陣列存放每個槽位的鍵；開啟時由鍵陣列重建索引。
+    檔案大小固定為容量上限，滿了以後以 CLOCK 演算法淘汰最近未命中的向量。
+
+    多個 worker 可以共用同一個目錄：寫入時先清除槽位的鍵再寫入向量與鍵，
+    讀取時前後比對鍵，槽位被其他程序覆寫時視為未命中；
+    建立檔案時持有目錄中的檔案鎖，取得鎖後若其他程序已建立相同設定的快取則直接使用。
+    """
+
+    def __init__(self, directory: str, model_id: str, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+                 dtype: str = EMBEDDING_CACHE_DTYPE) -> None:
+        self.directory = os.path.join(directory, model_id)
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._index: Dict[bytes, int] = {}
+        self._free: List[int] = []
+        self._referenced: Optional[np.ndarray] = None
+        self._hand = 0
+        self._opened = False
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.conflicts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def capacity(self) -> int:
+        return 0 if self._keys is None else len(self._keys)
+
+    def _capacity_for(self, dim: int) -> int:
+        return self.max_bytes // (dim * self.dtype.itemsize + KEY_BYTES)
+
+    def _paths(self):
+        return (os.path.join(self.directory, "vectors.npy"),
+                os.path.join(self.directory, "keys.npy"),
+                os.path.join(self.directory, "meta.json"))
+
+    @contextmanager
+    def _creation_lock(self) -> Iterator[None]:
+        """跨程序的建立鎖（目錄中的 create.lock），同時只有一個 worker 建立快取檔案"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "create.lock"), "a+") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _attach_existing(self, dim: Optional[int] = None) -> bool:
+        """開啟與目前設定（及指定的向量維度）相符的既有快取檔案，成功時返回 True"""
+        vectors_path, keys_path, meta_path = self._paths()
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if (meta.get("dtype") == self.dtype.name
+                    and meta.get("capacity") == self._capacity_for(meta["dim"])
+                    and (dim is None or meta["dim"] == dim)):
+                self._attach(np.load(vectors_path, mmap_mode="r+"), np.load(keys_path, mmap_mode="r+"))
+                return True
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            backend_logger.warning(f"Embedding cache at {self.directory} unreadable, rebuilding: {e}")
+        return False
+
+    def _open(self, dim: Optional[int] = None) -> None:
+        """開啟既有的快取檔案；檔案不存在或與目前設定不符時，在已知向量維度後重新建立"""
+        vectors_path, keys_path, meta_path = self._paths()
+        if not self._opened:
+            self._opened = True
+            self._attach_existing()
+
+        if dim is None or (self._vectors is not None and self._vectors.shape[1] == dim):
+            return
+
+        capacity = self._capacity_for(dim)
+        if capacity <= 0:
+            return
+        with self._creation_lock():
+            # 等待鎖的期間其他 worker 可能已建立相同設定的快取，直接使用而不覆寫
+            if self._attach_existing(dim):
+                return
+            # 先移除 meta，建立過程中斷時下次開啟會重新建立
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=self.dtype, shape=(capacity, dim))
+            keys = np.lib.format.open_memmap(keys_path, mode="w+", dtype=np.uint8, shape=(capacity, KEY_BYTES))
+            # 向量與鍵寫入磁碟後才寫入 meta，其他 worker 看到 meta 時檔案已完整
+            vectors.flush()
+            keys.flush()
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model_id": self.model_id, "dim": dim, "dtype": self.dtype.name, "capacity": capacity}, f)
+            self._attach(vectors, keys)
+        backend_logger.info(f"Embedding cache created at {self.directory} | capacity: {capacity} | dim: {dim}")
+
+    def _attach(self, vectors: np.memmap, keys: np.memmap) -> None:
+        self._vectors, self._keys = vectors, keys
+        used = keys.any(axis=1)
+        self._index = {keys[slot].tobytes(): int(slot) for slot in np.flatnonzero(used)}
+        self._free = np.flatnonzero(~used)[::-1].tolist()
+        self._referenced = np.zeros(len(keys), dtype=bool)
+        self._hand = 0
+
+    def _read(self, slot: int, key: bytes) -> Optional[np.ndarray]:
+        # 讀取向量前後的鍵都必須相同，否則槽位正被其他程序覆寫
+        if self._keys[slot].tobytes() != key:
+            return None
+        vector = np.array(self._vectors[slot], dtype=np.float32)
+        if self._keys[slot].tobytes() != key:
+            return None
+        return vector
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """查詢多個鍵，未命中的位置為 None"""
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        if not self.enabled:
+            return results
+        with self._lock:
+            self._open()
+            for i, key in enumerate(keys):
+                slot = self._index.get(key)
+                vector = None if slot is None else self._read(slot, key)
+                if vector is None:
+                    if slot is not None:
+                        # 槽位已被其他程序改寫，移出本程序的索引
+                        del self._index[key]
+                        self.conflicts += 1
+                    self.misses += 1
+                    continue
+                self._referenced[slot] = True
+                self.hits += 1
+                results[i] = vector
+        return results
+
+    def _evict(self) -> int:
+        # CLOCK：跳過最近命中過的槽位並清除其標記，取第一個未被命中的槽位
+        while self._referenced[self._hand]:
+            self._referenced[self._hand] = False
+            self._hand = (self._hand + 1) % len(self._referenced)
+        slot = self._hand
+        self._hand = (self._hand + 1) % len(self._referenced)
+        self._index.pop(self._keys[slot].tobytes(), None)
+        self.evictions += 1
+        return slot
+
+    def put_many(self, keys: List[bytes], vectors: List[np.ndarray]) -> None:
+        """寫入多個向量；已存在的鍵不重複寫入"""
+        if not self.enabled or not keys:
+            return
+        with self._lock:
+            self._open(dim=len(vectors[0]))
+            if self._vectors is None:
+                return
+            for key, vector in zip(keys, vectors):
+                if key in self._index or len(vector) != self._vectors.shape[1]:
+                    continue
+                slot = self._free.pop() if self._free else self._evict()
+                self._keys[slot] = 0
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self._index[key] = slot
+                # 新寫入的向量不設定命中標記，只出現一次的區塊會先被淘汰
+                self._referenced[slot] = False
+                self.stores += 1
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+                self._keys.flush()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            bytes_used = 0
+            if self._vectors is not None:
+                bytes_used = self._vectors.nbytes + self._keys.nbytes
+            return {
+                "enabled": self.enabled,
+                "model_id": self.model_id,
+                "dtype": self.dtype.name,
+                "entries": len(self._index),
+                "capacity": self.capacity,
+                "bytes": bytes_used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "conflicts": self.conflicts,
+            }
+
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    先查詢嵌入快取，只對未命中的區塊執行推論並寫回快取
+
+    只用於文件區塊；查詢文字請使用 embed_query，避免一次性的查詢向量
+    擠掉可重複使用的區塊向量。
+    """
+
+    def __init__(self, inner: EmbeddingFunction[Documents], cache: EmbeddingCache) -> None:
+        self.inner = inner
+        self.cache = cache
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if not self.cache.enabled:
+            return self.inner(input)
+        keys = [sha256_digest(text) for text in input]
+        embeddings = self.cache.get_many(keys)
+
+        # 同一批次中重複的區塊只推論一次
+        missing: Dict[bytes, List[int]] = {}
+        for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+            if embedding is None:
+                missing.setdefault(key, []).append(i)
+        if missing:
+            texts = [input[positions[0]] for positions in missing.values()]
+            computed = [np.asarray(vector, dtype=np.float32) for vector in self.inner(texts)]
+            self.cache.put_many(list(missing), computed)
+            for positions, vector in zip(missing.values(), computed):
+                for i in positions:
+                    embeddings[i] = vector
+        return embeddings
+
+    def embed_query(self, input: Documents) -> Embeddings:
+        """嵌入查詢文字：直接推論，不讀寫快取（結果與未經 float16 儲存的向量完全相同）"""
+        return self.inner(input)
+
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, embedding_service.model_id)
+cached_embedding_function = CachedEmbeddingFunction(embedding_service, embedding_cache)
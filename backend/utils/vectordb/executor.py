@@ -0,0 +1,135 @@
+# utils/vectordb/executor.py - 向量數據庫操作專用的有界執行緒池（不阻塞事件迴圈）
+import asyncio
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+# 同時執行的向量操作數量（分塊、嵌入推論與 Chroma 磁碟 I/O）
+VECTORDB_WORKERS = int(os.getenv("VECTORDB_WORKERS", "2"))
+# 等待與執行中的操作數量上限，超過時拒絕新的操作
+VECTORDB_MAX_QUEUE = int(os.getenv("VECTORDB_MAX_QUEUE", "32"))
+# 排隊與執行耗時統計保留的最近操作數
+LATENCY_WINDOW = 1000
+
+
+class VectorExecutorBusy(Exception):
+    """向量操作佇列已滿"""
+
+
+def busy_exception(e: VectorExecutorBusy) -> HTTPException:
+    """佇列已滿時返回給客戶端的 503"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": "1"}
+    )
+
+
+def _summary(samples) -> dict:
+    values = sorted(samples)
+    if not values:
+        return {"median_ms": None, "p95_ms": None, "max_ms": None}
+    return {
+        "median_ms": statistics.median(values),
+        "p95_ms": values[int(len(values) * 0.95)],
+        "max_ms": values[-1],
+    }
+
+
+class VectorExecutor:
+    """
+    向量操作的有界執行緒池
+
+    ChromaDB 與 ONNX 推論都是同步且耗時的操作，在 async 路由中直接執行會阻塞同一 worker 的所有串流。
+    所有向量操作改由此執行緒池執行，並以 max_queue 限制排隊數量，記錄排隊與執行耗時。
+    """
+
+    def __init__(self, workers: int = VECTORDB_WORKERS, max_queue: int = VECTORDB_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vectordb")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._wait_ms = deque(maxlen=LATENCY_WINDOW)
+        self._run_ms = deque(maxlen=LATENCY_WINDOW)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> "asyncio.Future":
+        """
+        提交操作並返回可 await 的 Future（必須在事件迴圈中呼叫）
+
+        Raises:
+            VectorExecutorBusy: 等待與執行中的操作已達上限
+        """
+        with self._lock:
+            if self._pending + self._running >= self.max_queue:
+                self.rejected += 1
+                raise VectorExecutorBusy(f"Vector operation queue is full ({self.max_queue})")
+            self._pending += 1
+            self.submitted += 1
+        queued_at = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            with self._lock:
+                self._pending -= 1
+                self._running += 1
+                self._wait_ms.append((started - queued_at) * 1000)
+            ok = False
+            try:
+                result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._run_ms.append((time.perf_counter() - started) * 1000)
+                    if ok:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+        future = self._executor.submit(run)
+        future.add_done_callback(self._on_done)
+        return asyncio.wrap_future(future)
+
+    def _on_done(self, future) -> None:
+        # 開始執行前被取消（例如檢索逾時）的操作不會經過 run，需要在此移出佇列
+        if future.cancelled():
+            with self._lock:
+                self._pending -= 1
+                self.cancelled += 1
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """在執行緒池中執行操作並等待結果"""
+        return await self.submit(fn, *args, **kwargs)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "queued": self._pending,
+                "running": self._running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "queue_wait": _summary(self._wait_ms),
+                "run": _summary(self._run_ms),
+            }
+
+
+vector_executor = VectorExecutor()
@@ -0,0 +1,34 @@
+# utils/vectordb/hashing.py - 文件與區塊內容的雜湊（文件 ID 與嵌入快取的鍵）
+import hashlib
+import uuid
+from typing import Union
+
+
+def content_bytes(content: Union[str, bytes]) -> bytes:
+    """將字串（UTF-8）或位元組內容轉為位元組"""
+    if isinstance(content, str):
+        return content.encode("utf-8")
+    if isinstance(content, bytes):
+        return content
+    raise ValueError(f"Content type {type(content)} not supported !")
+
+
+def sha256_digest(content: Union[str, bytes]) -> bytes:
+    """內容的 SHA-256 摘要（32 位元組）"""
+    return hashlib.sha256(content_bytes(content)).digest()
+
+
+def deterministic_uuid(content: Union[str, bytes]) -> str:
+    """Creates deterministic UUID on hash value of string or byte content.
+
+    Args:
+        content: String or byte representation of data.
+
+    Returns:
+        UUID of the content.
+    """
+    hash_hex = sha256_digest(content).hex()
+    namespace = uuid.UUID("00000000-0000-0000-0000-000000000000")
+    content_uuid = str(uuid.uuid5(namespace, hash_hex))
+
+    return content_uuid
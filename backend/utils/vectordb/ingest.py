@@ -0,0 +1,287 @@
+# utils/vectordb/ingest.py - 以 NDJSON 串流批次寫入多份文件（分塊 → 大批嵌入 → 大批 collection.add）
+import asyncio
+import os
+import zlib
+from dataclasses import dataclass, field
+from typing import AsyncIterator, List, Optional, Tuple
+
+from utils.json_codec import loads
+from utils.backend_logger import BackendLogger
+from utils.vectordb.chromadb_connecter import ChromaDBConnecter
+from utils.vectordb.client_registry import client_registry
+from utils.vectordb.executor import VectorExecutorBusy, vector_executor
+from utils.vectordb.hashing import deterministic_uuid
+
+backend_logger = BackendLogger().logger
+
+# 累積多少位元組的文件後送出一批（分塊、嵌入與寫入）
+INGEST_BATCH_BYTES = int(os.getenv("INGEST_BATCH_BYTES", str(1024 * 1024)))
+# 每次 collection.add 的區塊數上限（同時也是每批嵌入推論的大小）
+INGEST_ADD_BATCH = int(os.getenv("INGEST_ADD_BATCH", "512"))
+# 單份文件（NDJSON 一行）的大小上限
+INGEST_MAX_DOCUMENT_BYTES = int(os.getenv("INGEST_MAX_DOCUMENT_BYTES", str(16 * 1024 * 1024)))
+# 單次上傳（接收到的原始位元組，gzip 時為壓縮後）的大小上限，0 表示不限制
+INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", str(1024 * 1024 * 1024)))
+# gzip 解壓時每次輸出的位元組上限，避免高壓縮比的內容一次展開佔用大量記憶體
+DECOMPRESS_CHUNK_BYTES = 1024 * 1024
+# 向量執行緒池已滿時，後續批次重試的等待時間上限（秒）
+INGEST_BUSY_TIMEOUT = float(os.getenv("INGEST_BUSY_TIMEOUT", "30"))
+COLLECTION_NAME = "documents"
+
+
+@dataclass
+class IngestOptions:
+    """文件未指定時使用的默認值"""
+    chunk_size: int = 1000
+    chunk_overlap: int = 200
+    chunk_unit: str = "chars"
+    type: str = "txt"
+
+
+class IngestTooLarge(Exception):
+    """上傳內容超過 INGEST_MAX_BYTES（已寫入的批次保留）"""
+
+
+@dataclass
+class IngestResult:
+    """批次寫入結果，results 為每份文件（依行號排序）的結果"""
+    results: List[dict] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        results = sorted(self.results, key=lambda r: r["line"])
+        succeeded = sum(1 for r in results if r["status"] == "success")
+        return {
+            "documents": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "chunks": sum(r.get("chunks", 0) for r in results),
+            "embedded": sum(r.get("embedded", 0) for r in results),
+            "results": results,
+        }
+
+
+def parse_document(line: bytes, options: IngestOptions) -> dict:
+    """
+    解析一行 NDJSON：{"document": "...", "document_id": "...", "type": "txt"}
+
+    Raises:
+        ValueError: 格式錯誤或 document 為空
+    """
+    try:
+        data = loads(line)
+        document = data["document"]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid document line: {e}") from e
+    if not isinstance(document, str) or not document:
+        raise ValueError("Document must be a non-empty string")
+    return {
+        "document": document,
+        # 以完整內容的雜湊作為默認 ID，同一批上傳中開頭相同的文件不會互相覆蓋
+        "document_id": str(data.get("document_id") or deterministic_uuid(document)),
+        "type": str(data.get("type") or options.type),
+    }
+
+
+def ingest_batch(path: str, lines: List[Tuple[int, bytes]], options: IngestOptions, seen_ids: set) -> List[dict]:
+    """
+    分塊並寫入一批文件（在向量執行緒池中執行）
+
+    所有文件的區塊合併後與集合中同 ID 文件已有的區塊比對，只新增內容改變的區塊
+    （以 INGEST_ADD_BATCH 為單位呼叫 collection.add，嵌入推論也以同樣的大小分批），
+    並刪除不再存在的區塊；某次寫入失敗時，區塊包含在其中的文件記為失敗。
+
+    Args:
+        path: 向量數據庫路徑
+        lines: (行號, NDJSON 行)
+        options: 默認的分塊參數與類型
+        seen_ids: 本次上傳已處理的文件 ID，重複的文件會被略過
+
+    Returns:
+        每份文件的結果
+    """
+    results = []
+    base_ids, ids, chunks, metadatas, owners = [], [], [], [], {}
+    with client_registry.acquire(path, ChromaDBConnecter) as connecter:
+        for line_no, line in lines:
+            result = {"line": line_no}
+            results.append(result)
+            try:
+                doc = parse_document(line, options)
+            except ValueError as e:
+                result.update(status="error", error=str(e))
+                continue
+            result["document_id"] = doc["document_id"]
+            if doc["document_id"] in seen_ids:
+                result.update(status="error", error="Duplicate document_id in upload")
+                continue
+            seen_ids.add(doc["document_id"])
+            doc_ids, doc_chunks, doc_metadatas = connecter.build_chunks(
+                doc["document"], doc["document_id"], options.chunk_size, options.chunk_overlap,
+                metadata={"source": "API", "type": doc["type"]}, chunk_unit=options.chunk_unit
+            )
+            result.update(status="success", chunks=len(doc_chunks), embedded=0)
+            base_ids.append(doc["document_id"])
+            ids.extend(doc_ids)
+            chunks.extend(doc_chunks)
+            metadatas.extend(doc_metadatas)
+            owners.update((chunk_id, result) for chunk_id in doc_ids)
+
+        upserted = None
+        error = None
+        if ids:
+            try:
+                if connecter.create_collection(COLLECTION_NAME) is None:
+                    raise RuntimeError("Failed to open collection")
+                upserted = connecter.upsert_chunks(COLLECTION_NAME, base_ids, ids, chunks, metadatas,
+                                                   batch_size=INGEST_ADD_BATCH)
+            except Exception as e:
+                backend_logger.error(f"Failed to upsert ingest batch into {path}: {e}")
+                error = str(e)
+    if upserted is not None:
+        for chunk_id in upserted.added:
+            owners[chunk_id]["embedded"] += 1
+        for chunk_id in upserted.failed:
+            owners[chunk_id].update(status="error", error="Failed to add chunks to VectorDB")
+    for result in results:
+        if error is not None and result["status"] == "success":
+            result.update(status="error", error=error)
+        if result["status"] == "error":
+            result.pop("chunks", None)
+            result.pop("embedded", None)
+    stats = upserted.to_dict() if upserted is not None else {}
+    backend_logger.info(f"Ingested batch into {path} | documents: {len(results)} | chunks: {len(ids)} | {stats}")
+    return results
+
+
+async def _retry_batch(path: str, lines: List[Tuple[int, bytes]], options: IngestOptions,
+                       seen_ids: set) -> List[dict]:
+    """已有批次寫入後遇到佇列已滿時等待重試，而非中斷整個上傳"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + INGEST_BUSY_TIMEOUT
+    while True:
+        try:
+            return await vector_executor.run(ingest_batch, path, lines, options, seen_ids)
+        except VectorExecutorBusy as e:
+            if loop.time() >= deadline:
+                return [{"line": line_no, "status": "error", "error": str(e)} for line_no, _ in lines]
+            await asyncio.sleep(0.1)
+
+
+async def ingest_byte_stream(
+    path: str,
+    stream: AsyncIterator[bytes],
+    options: IngestOptions,
+    compressed: bool = False
+) -> IngestResult:
+    """
+    從非同步位元組串流（例如請求內容）寫入 NDJSON 文件
+
+    邊接收邊分批：前一批在向量執行緒池中嵌入與寫入時繼續接收下一批，
+    同時最多一批在處理中，記憶體用量約為兩批加上一份文件，與上傳總大小無關。
+    超過 INGEST_MAX_DOCUMENT_BYTES 的行直接丟棄並記為失敗；gzip 內容以 DECOMPRESS_CHUNK_BYTES 為單位逐段解壓。
+
+    Args:
+        path: 向量數據庫路徑
+        stream: 位元組串流
+        options: 默認的分塊參數與類型
+        compressed: 內容是否為 gzip 壓縮
+
+    Returns:
+        每份文件的寫入結果
+
+    Raises:
+        VectorExecutorBusy: 第一批送出時向量執行緒池已滿（尚未寫入任何文件）
+        IngestTooLarge: 接收的內容超過 INGEST_MAX_BYTES（之前的批次已寫入）
+    """
+    decompressor = zlib.decompressobj(wbits=31) if compressed else None
+    result = IngestResult()
+    seen_ids: set = set()
+    pending: List[Tuple[int, bytes]] = []
+    pending_bytes = 0
+    in_flight: Optional[asyncio.Future] = None
+    submitted = False
+    buffer = bytearray()
+    line_no = 0
+    oversized = False
+    received = 0
+
+    def reject(line: int) -> None:
+        result.results.append({
+            "line": line, "status": "error",
+            "error": f"Document exceeds {INGEST_MAX_DOCUMENT_BYTES} bytes"
+        })
+
+    def take_line(line: bytes) -> None:
+        nonlocal pending_bytes
+        if len(line) > INGEST_MAX_DOCUMENT_BYTES:
+            reject(line_no)
+        elif line.strip():
+            pending.append((line_no, line))
+            pending_bytes += len(line)
+
+    async def submit_pending() -> None:
+        nonlocal pending, pending_bytes, in_flight, submitted
+        if in_flight is not None:
+            result.results.extend(await in_flight)
+            in_flight = None
+        if not pending:
+            return
+        batch, pending, pending_bytes = pending, [], 0
+        if not submitted:
+            # 第一批直接送出，佇列已滿時讓呼叫端返回 503
+            in_flight = vector_executor.submit(ingest_batch, path, batch, options, seen_ids)
+            submitted = True
+        else:
+            in_flight = asyncio.ensure_future(_retry_batch(path, batch, options, seen_ids))
+
+    async def feed(chunk: bytes) -> None:
+        nonlocal line_no, oversized, buffer
+        start = 0
+        while (newline := chunk.find(b"\n", start)) != -1:
+            line_no += 1
+            if oversized:
+                oversized = False
+            else:
+                buffer += chunk[start:newline]
+                take_line(bytes(buffer))
+            buffer.clear()
+            start = newline + 1
+        if not oversized:
+            buffer += chunk[start:]
+            if len(buffer) > INGEST_MAX_DOCUMENT_BYTES:
+                # 丟棄這一行其餘的內容，直到下一個換行
+                oversized = True
+                buffer.clear()
+                reject(line_no + 1)
+        if pending_bytes >= INGEST_BATCH_BYTES:
+            await submit_pending()
+
+    try:
+        async for data in stream:
+            received += len(data)
+            if INGEST_MAX_BYTES and received > INGEST_MAX_BYTES:
+                raise IngestTooLarge(f"Upload exceeds {INGEST_MAX_BYTES} bytes")
+            if decompressor is None:
+                await feed(data)
+                continue
+            while True:
+                chunk = decompressor.decompress(data, DECOMPRESS_CHUNK_BYTES)
+                data = decompressor.unconsumed_tail
+                await feed(chunk)
+                # 輸入用完且輸出未達上限時，解壓器內已沒有待輸出的內容
+                if not data and len(chunk) < DECOMPRESS_CHUNK_BYTES:
+                    break
+        if decompressor is not None:
+            buffer += decompressor.flush()
+        if not oversized:
+            line_no += 1
+            take_line(bytes(buffer))
+        await submit_pending()
+        if in_flight is not None:
+            result.results.extend(await in_flight)
+            in_flight = None
+    finally:
+        if in_flight is not None and not in_flight.done():
+            # 上傳中斷時等待處理中的批次完成，避免背景寫入與之後的操作交錯
+            await asyncio.wait([in_flight])
+    return result
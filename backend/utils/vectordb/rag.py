@@ -0,0 +1,143 @@
+# utils/vectordb/rag.py - 聊天請求的伺服器端檢索增強 (RAG)
+import os
+import time
+import asyncio
+from typing import List, Dict, Any, Tuple
+from utils.vectordb.chromadb_connecter import ChromaDBConnecter
+from utils.vectordb.client_registry import client_registry
+from utils.vectordb.executor import vector_executor
+from utils.token_utils import estimate_tokens, truncate_to_token_budget
+from utils.backend_logger import BackendLogger
+
+backend_logger = BackendLogger().logger
+
+VECTORDB_ROOT = "./data/chromadb_data"
+RETRIEVAL_PROMPT_HEADER = "以下是從本次對話上傳的文件中檢索到的參考資料，回答時請優先依據這些內容：\n"
+
+
+def get_session_vectordb_path(session_id) -> str:
+    """獲取會話向量數據庫的路徑（不會建立目錄）"""
+    return f"{VECTORDB_ROOT}/{session_id}"
+
+
+def retrieve_session_documents(
+    session_id,
+    query: str,
+    collection_name: str = "documents",
+    n_chunks_per_doc: int = 5,
+    max_docs: int = 3
+) -> List[Dict[str, Any]]:
+    """
+    從會話的 Chroma 集合中檢索並重構相關文件
+
+    Args:
+        session_id: 會話ID
+        query: 查詢文本
+        collection_name: 集合名稱
+        n_chunks_per_doc: 每份文件最多使用的區塊數
+        max_docs: 最多返回的文件數
+
+    Returns:
+        重構後的文件列表；會話沒有向量數據庫時返回空列表
+    """
+    path = get_session_vectordb_path(session_id)
+    if not os.path.exists(path):
+        return []
+    with client_registry.acquire(path, ChromaDBConnecter) as connecter:
+        return connecter.retrieve_and_reconstruct_documents(
+            collection_name=collection_name,
+            query=query,
+            n_chunks_per_doc=n_chunks_per_doc,
+            max_docs=max_docs
+        )
+
+
+class RetrievalTask:
+    """
+    在向量執行緒池中進行的檢索
+
+    建立時立即提交到執行緒池（佇列已滿時 result() 返回空結果），呼叫端可以在等待結果前繼續處理其他工作
+    （例如寫入使用者訊息、組裝上下文）。
+    """
+
+    def __init__(self, session_id, query: str, options) -> None:
+        """
+        Args:
+            session_id: 會話ID
+            query: 查詢文本
+            options: schemas.RetrievalOptions
+        """
+        self.session_id = session_id
+        self.options = options
+        self.start = time.perf_counter()
+        self.future = asyncio.ensure_future(vector_executor.run(
+            retrieve_session_documents,
+            session_id,
+            query,
+            options.collection_name,
+            options.n_chunks_per_doc,
+            options.max_docs
+        ))
+
+    async def result(self) -> Tuple[List[Dict[str, Any]], float]:
+        """
+        等待檢索結果，逾時從建立任務時開始計算
+
+        逾時或失敗時不會中斷聊天，只會返回空結果。
+
+        Returns:
+            (檢索到的文件列表, 檢索耗時毫秒)
+        """
+        remaining = max(self.options.timeout - (time.perf_counter() - self.start), 0)
+        documents: List[Dict[str, Any]] = []
+        try:
+            documents = await asyncio.wait_for(self.future, timeout=remaining)
+        except asyncio.TimeoutError:
+            backend_logger.warning(f"Retrieval timed out after {self.options.timeout}s | session: {self.session_id}")
+        except Exception as e:
+            backend_logger.error(f"Retrieval failed | session: {self.session_id} | error: {e}")
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        return documents, elapsed_ms
+
+
+def build_retrieval_prompt(documents: List[Dict[str, Any]], max_tokens: int) -> str:
+    """
+    將檢索到的文件組成提示詞片段，總長度受 token 預算限制
+
+    文件依相關性順序加入，預算不足時截斷最後一份文件並捨棄其餘文件。
+
+    Args:
+        documents: retrieve_and_reconstruct_documents 返回的文件列表
+        max_tokens: 參考資料可使用的最大 token 數
+
+    Returns:
+        提示詞片段；沒有文件或預算不足時返回空字串
+    """
+    if not documents or max_tokens <= 0:
+        return ""
+
+    remaining = max_tokens - estimate_tokens(RETRIEVAL_PROMPT_HEADER)
+    sections = []
+    for index, doc in enumerate(documents, start=1):
+        title = f"[{index}] (relevance: {doc.get('relevance', 0.0):.2f})\n"
+        available = remaining - estimate_tokens(title)
+        if available <= 0:
+            break
+        content = truncate_to_token_budget(doc.get("content", ""), available)
+        if not content:
+            break
+        sections.append(title + content)
+        remaining = available - estimate_tokens(content)
+
+    if not sections:
+        return ""
+    return RETRIEVAL_PROMPT_HEADER + "\n\n".join(sections)
+
+
+def merge_prompt(prompt: str, retrieval_prompt: str) -> str:
+    """將檢索內容附加到使用者設定的系統提示詞之後"""
+    if not retrieval_prompt:
+        return prompt
+    if not prompt:
+        return retrieval_prompt
+    return f"{prompt}\n\n{retrieval_prompt}"
@@ -51,25 +51,11 @@ export const useChatHistory = (userId = null) => {
       );
       
       // 格式化歷史記錄
-      const formattedHistory = history.items.map((msg) => ({
-        sessionId: msg.session_id,
-        date: new Date(msg.timestamp).toLocaleDateString(),
-        lastMessage: msg.user_message,
-        message: {
-          id: msg.turn_id,
-          userMessage: {
-            id: `${msg.turn_id}-user`,
-            text: msg.user_message,
-            sender: 'user',
-            timestamp: msg.timestamp,
-          },
-          assistantMessage: {
-            id: `${msg.turn_id}-assistant`,
-            text: msg.assistant_message,
-            sender: 'assistant',
-            timestamp: msg.timestamp,
-          },
-        },
+      const formattedHistory = history.items.map((session) => ({
+        sessionId: session.session_id,
+        date: new Date(session.last_timestamp).toLocaleDateString(),
+        lastMessage: session.last_user_message_preview,
+        turnCount: session.turn_count,
       }));
 
       // 更新消息列表
@@ -239,7 +239,8 @@ onError(error);
   // 獲取聊天歷史，預設返回最新的20條記錄
   getChatHistory: async (skip = 0, limit = 20, user_id = null) => {
     try {
-      const params = { skip, limit };
+      // 側邊欄只需要預覽，完整內容於開啟 session 時再讀取
+      const params = { skip, limit, view: 'preview' };
       if (user_id) {
 params.user_id = user_id;
 }